@@ -24,7 +24,9 @@ data class BloodPressureAnalysisResponse(
     val analysis: String,
     val recommendations: List<String>,
     val alert_level: String,
-    val email_sent: Boolean = false
+    val email_sent: Boolean = false,
+    val email_queued: Boolean = false,
+    val email_outbox_id: String? = null
 )
 
 interface BloodPressureApi {
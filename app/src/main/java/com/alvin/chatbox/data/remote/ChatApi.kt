@@ -8,16 +8,25 @@ import retrofit2.http.POST
 interface ChatApi {
     @POST("/chat")
     suspend fun sendMessage(@Body request: ChatRequest): ChatResponse
+
+    // Session ids are issued (and signed) by the server
+    @POST("/chat/sessions")
+    suspend fun createSession(): ChatSessionResponse
 }
 
 @Serializable
 data class ChatRequest(
-    @SerialName("message") val message: String
+    @SerialName("message") val message: String,
+    @SerialName("session_id") val sessionId: String? = null
 )
 
 @Serializable
 data class ChatResponse(
-    @SerialName("reply") val reply: String
+    @SerialName("reply") val reply: String,
+    @SerialName("session_id") val sessionId: String? = null
 )
 
-
+@Serializable
+data class ChatSessionResponse(
+    @SerialName("session_id") val sessionId: String
+)
@@ -3,15 +3,31 @@ package com.alvin.chatbox.data.repository
 import com.alvin.chatbox.data.remote.ChatApi
 import com.alvin.chatbox.data.remote.ChatRequest
 import com.alvin.chatbox.domain.repository.ChatRepository
+import kotlinx.coroutines.sync.Mutex
+import kotlinx.coroutines.sync.withLock
+import retrofit2.HttpException
 import javax.inject.Inject
 
 class ChatRepositoryImpl @Inject constructor(
     private val api: ChatApi
 ) : ChatRepository {
+    // The server keeps the conversation context, so only the new message is sent
+    private val sessionLock = Mutex()
+    private var sessionId: String? = null
+
     override suspend fun sendMessage(message: String): String {
-        val resp = api.sendMessage(ChatRequest(message))
-        return resp.reply
+        val id = session()
+        return try {
+            api.sendMessage(ChatRequest(message, id)).reply
+        } catch (e: HttpException) {
+            if (e.code() != 404) throw e
+            // The session expired or the server no longer knows it: start a new one
+            sessionLock.withLock { if (sessionId == id) sessionId = null }
+            api.sendMessage(ChatRequest(message, session())).reply
+        }
     }
-}
-
 
+    private suspend fun session(): String = sessionLock.withLock {
+        sessionId ?: api.createSession().sessionId.also { sessionId = it }
+    }
+}
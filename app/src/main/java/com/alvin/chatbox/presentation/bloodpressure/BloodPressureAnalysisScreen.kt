@@ -132,7 +132,7 @@ fun BloodPressureAnalysisScreen(
                         )
                     }
                     
-                    if (result.email_sent) {
+                    if (result.email_sent || result.email_queued) {
                         Spacer(modifier = Modifier.height(8.dp))
                         Row(
                             verticalAlignment = Alignment.CenterVertically
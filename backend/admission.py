@@ -0,0 +1,235 @@
+"""
+Admission control for upstream (Qwen) calls
+A global concurrency limit with a bounded FIFO wait queue, plus optional
+per-endpoint limits with their own FIFO queues (an endpoint at its limit
+waits for one of its own calls to finish). When a queue is full (or a
+request waited too long) the call is rejected at once with a Retry-After
+hint instead of piling up until dashscope rate-limits us and the request
+times out.
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+# Endpoint the current request is charged to (set by the route handlers)
+UPSTREAM_ENDPOINT: ContextVar[str] = ContextVar("upstream_endpoint", default="default")
+
+
+def parse_endpoint_limits(value: str) -> Dict[str, int]:
+    """Parse "chat=20,analyze=10" into {"chat": 20, "analyze": 10}"""
+    limits = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        name, limit = item.split("=", 1)
+        limits[name.strip()] = int(limit)
+    return limits
+
+
+class AdmissionRejected(Exception):
+    """Raised when an upstream call is shed (429 endpoint limit, 503 overload)"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """A granted upstream slot; release() is idempotent"""
+    __slots__ = ("controller", "endpoint", "admitted_at", "released")
+
+    def __init__(self, controller: "AdmissionController", endpoint: str):
+        self.controller = controller
+        self.endpoint = endpoint
+        self.admitted_at = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrent: int = 20,
+        max_queue: int = 100,
+        queue_timeout: float = 5.0,
+        endpoint_limits: Optional[Dict[str, int]] = None,
+    ):
+        self.max_concurrent = max_concurrent  # 0 disables admission control
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.endpoint_limits = endpoint_limits or {}
+
+        self.in_flight = 0
+        self._waiters: deque = deque()
+        self._endpoint_active: Dict[str, int] = {}  # admitted or waiting for a global slot
+        self._endpoint_waiters: Dict[str, deque] = {}
+        # Moving average of how long a slot is held, used for Retry-After
+        self._avg_hold = 1.0
+
+        self.admitted = 0
+        self.queued_total = 0
+        self.endpoint_queued_total = 0
+        self.rejected: Dict[str, int] = {"endpoint_limit": 0, "queue_full": 0, "queue_timeout": 0}
+
+    @asynccontextmanager
+    async def slot(self, endpoint: Optional[str] = None):
+        ticket = await self.acquire(endpoint)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    async def acquire(self, endpoint: Optional[str] = None) -> AdmissionTicket:
+        """Wait for an upstream slot, or raise AdmissionRejected"""
+        endpoint = endpoint or UPSTREAM_ENDPOINT.get()
+        await self._reserve_endpoint(endpoint)
+        try:
+            await self._acquire_slot()
+        except BaseException:
+            self._release_endpoint(endpoint)
+            raise
+        self.admitted += 1
+        return AdmissionTicket(self, endpoint)
+
+    def try_acquire(self, endpoint: Optional[str] = None) -> Optional[AdmissionTicket]:
+        """An extra slot only if one is free right now (hedged calls never queue), else None"""
+        endpoint = endpoint or UPSTREAM_ENDPOINT.get()
+        active = self._endpoint_active.get(endpoint, 0)
+        limit = self.endpoint_limits.get(endpoint)
+        if limit is not None and (active >= limit or self._endpoint_waiters.get(endpoint)):
+            return None
+        if self.max_concurrent and (self.in_flight >= self.max_concurrent or self._waiters):
+            return None
+        self._endpoint_active[endpoint] = active + 1
+        self.in_flight += 1
+        self.admitted += 1
+        return AdmissionTicket(self, endpoint)
+
+    async def _reserve_endpoint(self, endpoint: str):
+        """Count the call against its endpoint limit, waiting FIFO while the endpoint is full"""
+        active = self._endpoint_active.get(endpoint, 0)
+        limit = self.endpoint_limits.get(endpoint)
+        waiters = self._endpoint_waiters.setdefault(endpoint, deque())
+        if limit is None or (active < limit and not waiters):
+            self._endpoint_active[endpoint] = active + 1
+            return
+
+        if len(waiters) >= self.max_queue:
+            self.rejected["endpoint_limit"] += 1
+            raise AdmissionRejected(
+                429, f"Too many concurrent {endpoint} requests", self.retry_after(len(waiters) + 1, limit)
+            )
+        # _release_endpoint() hands the endpoint slot directly to the first waiter
+        waiter = asyncio.get_running_loop().create_future()
+        waiters.append(waiter)
+        self.endpoint_queued_total += 1
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not (waiter.done() and not waiter.cancelled()):
+                self._remove_waiter(waiters, waiter)
+                self.rejected["endpoint_limit"] += 1
+                raise AdmissionRejected(
+                    429, f"Too many concurrent {endpoint} requests", self.retry_after(len(waiters) + 1, limit)
+                )
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release_endpoint(endpoint)
+            else:
+                self._remove_waiter(waiters, waiter)
+            raise
+
+    async def _acquire_slot(self):
+        if not self.max_concurrent or (self.in_flight < self.max_concurrent and not self._waiters):
+            self.in_flight += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self.rejected["queue_full"] += 1
+            raise AdmissionRejected(503, "Upstream is overloaded, please retry later", self.retry_after())
+
+        # Queue FIFO; _release() hands its slot directly to the first waiter
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued_total += 1
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not (waiter.done() and not waiter.cancelled()):
+                self._remove_waiter(self._waiters, waiter)
+                self.rejected["queue_timeout"] += 1
+                raise AdmissionRejected(503, "Upstream is overloaded, please retry later", self.retry_after())
+            # The slot arrived together with the timeout: keep it
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we were cancelled: pass it on
+                self._handoff()
+            else:
+                self._remove_waiter(self._waiters, waiter)
+            raise
+
+    def retry_after(self, ahead: Optional[int] = None, slots: Optional[int] = None) -> int:
+        """Seconds until one of `slots` is likely free for a request behind `ahead` others"""
+        if ahead is None:
+            ahead = len(self._waiters) + 1
+        slots = slots or self.max_concurrent or 1
+        return max(1, math.ceil(self._avg_hold * ahead / slots))
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "max_queue": self.max_queue,
+            "endpoint_active": dict(self._endpoint_active),
+            "endpoint_queued": {name: len(w) for name, w in self._endpoint_waiters.items() if w},
+            "endpoint_limits": dict(self.endpoint_limits),
+            "avg_hold_seconds": round(self._avg_hold, 3),
+            "admitted": self.admitted,
+            "queued_total": self.queued_total,
+            "endpoint_queued_total": self.endpoint_queued_total,
+            "rejected": dict(self.rejected),
+        }
+
+    def _release(self, ticket: AdmissionTicket):
+        held = time.monotonic() - ticket.admitted_at
+        self._avg_hold += 0.2 * (held - self._avg_hold)
+        self._handoff()
+        self._release_endpoint(ticket.endpoint)
+
+    def _handoff(self):
+        """Give a freed slot to the first live waiter, or return it"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _release_endpoint(self, endpoint: str):
+        """Pass the endpoint slot to the endpoint's first live waiter, or return it"""
+        waiters = self._endpoint_waiters.get(endpoint)
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._endpoint_active[endpoint] -= 1
+
+    @staticmethod
+    def _remove_waiter(waiters: deque, waiter: asyncio.Future):
+        try:
+            waiters.remove(waiter)
+        except ValueError:
+            pass
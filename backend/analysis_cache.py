@@ -0,0 +1,108 @@
+"""
+LRU + TTL cache for blood pressure analyses
+Keys are hashes of the canonical Qwen request (prompt built from the
+top-10 sorted readings plus model parameters), so an identical history
+returns the stored analysis without another upstream call. Expired entries
+can be kept for a grace period and served by get_stale() while the upstream
+is unavailable. Entries live in a StateBackend: in-process by default, or
+shared by every worker (sqlite://, redis://) so one worker's analysis is a
+hit for the others.
+"""
+
+import hashlib
+import json
+import time
+from typing import Any, Optional
+
+from state_backend import MemoryBackend, StateBackend, StateBackendError
+
+KEY_PREFIX = "analysis:"
+
+
+def make_cache_key(payload: dict) -> str:
+    """Stable hash of a JSON-serializable payload"""
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class TTLCache:
+    def __init__(self, max_size: int = 512, ttl: float = 600.0, stale_ttl: float = 0.0,
+                 backend: Optional[StateBackend] = None):
+        """
+        max_size <= 0 disables the cache; it bounds the default in-process
+        backend, a shared backend is bounded by its own TTLs
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.backend = backend if backend is not None else MemoryBackend(max_entries=max(max_size, 0))
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = await self._load(key)
+        # Entries stay in the backend for ttl + stale_ttl, they are fresh for ttl
+        if entry is None or entry[0] < time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    async def get_stale(self, key: str) -> Optional[Any]:
+        """Entry even if expired (within stale_ttl), for degraded-mode fallbacks"""
+        entry = await self._load(key)
+        if entry is None:
+            return None
+        self.stale_hits += 1
+        return entry[1]
+
+    async def set(self, key: str, value: Any):
+        if not self.enabled:
+            return
+        try:
+            await self.backend.set(KEY_PREFIX + key, [time.time() + self.ttl, value], self.ttl + self.stale_ttl)
+        except StateBackendError as e:
+            self.errors += 1
+            print(f"Analysis cache write failed: {e}")
+
+    async def invalidate(self, key: Optional[str] = None) -> int:
+        """Drop one entry, or everything when key is None; returns the number removed"""
+        if key is None:
+            return await self.backend.delete_prefix(KEY_PREFIX)
+        return 1 if await self.backend.delete(KEY_PREFIX + key) else 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        local = isinstance(self.backend, MemoryBackend)
+        return {
+            "backend": self.backend.name,
+            # Size and evictions are only known for the in-process backend
+            "size": self.backend.count(KEY_PREFIX) if local else None,
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.backend.evictions if local else None,
+            "stale_hits": self.stale_hits,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    async def _load(self, key: str) -> Optional[list]:
+        """[expires_at, value] or None; an unreachable backend counts as a miss"""
+        if not self.enabled:
+            return None
+        try:
+            return await self.backend.get(KEY_PREFIX + key)
+        except StateBackendError as e:
+            self.errors += 1
+            print(f"Analysis cache read failed: {e}")
+            return None
@@ -0,0 +1,108 @@
+"""
+Bearer-token authorization
+Operator endpoints (e.g. flushing the analysis cache) need ADMIN_TOKEN in an
+"Authorization: Bearer ..." header. Without ADMIN_TOKEN they are disabled
+and answer 403, so a deployment never exposes them by accident.
+
+The per-user endpoints (/blood-pressure/users/{user_id}/...) need a user
+token: the user id and an expiry signed with an HMAC, issued through an
+admin endpoint (e.g. by the account service after login). The user id is
+taken from the token; a token for another user gets 403. Workers must share
+the secret, like chat session ids.
+"""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import secrets
+import time
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+
+def bearer_token(request: Request) -> Optional[str]:
+    """Token of an "Authorization: Bearer <token>" header, None without one"""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    return token.strip()
+
+
+class AdminAuth:
+    def __init__(self, token: str = ""):
+        """An empty token disables every admin endpoint"""
+        self.token = token
+        self.allowed = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token)
+
+    async def __call__(self, request: Request):
+        """FastAPI dependency; 403 while disabled, 401 for a missing or wrong token"""
+        if not self.enabled:
+            self.rejected += 1
+            raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN is not set)")
+        token = bearer_token(request)
+        if token is None or not hmac.compare_digest(token.encode("utf-8"), self.token.encode("utf-8")):
+            self.rejected += 1
+            raise HTTPException(status_code=401, detail="Invalid admin token",
+                                headers={"WWW-Authenticate": "Bearer"})
+        self.allowed += 1
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "allowed": self.allowed, "rejected": self.rejected}
+
+
+class UserTokens:
+    """Signed, expiring user tokens: <base64url user id>.<expires_at>.<hmac>"""
+
+    def __init__(self, secret: Optional[bytes] = None, ttl: float = 30 * 86400):
+        self.secret = secret or secrets.token_bytes(32)  # random: tokens are valid in this process only
+        self.ttl = ttl
+        self.issued = 0
+        self.allowed = 0
+        self.rejected = 0
+
+    def issue(self, user_id: str, now: Optional[float] = None) -> Tuple[str, int]:
+        """New token for user_id; returns (token, expires_at)"""
+        expires_at = int((time.time() if now is None else now) + self.ttl)
+        subject = base64.urlsafe_b64encode(user_id.encode("utf-8")).decode("ascii").rstrip("=")
+        payload = f"{subject}.{expires_at}"
+        self.issued += 1
+        return f"{payload}.{self._sign(payload)}", expires_at
+
+    def verify(self, token: Optional[str], now: Optional[float] = None) -> Optional[str]:
+        """User id of a valid, unexpired token, else None"""
+        payload, _, signature = (token or "").rpartition(".")
+        subject, _, expires_at = payload.partition(".")
+        if not subject or not hmac.compare_digest(signature, self._sign(payload)):
+            return None
+        if not expires_at.isdigit() or int(expires_at) <= (time.time() if now is None else now):
+            return None
+        try:
+            return base64.urlsafe_b64decode(subject + "=" * (-len(subject) % 4)).decode("utf-8")
+        except (binascii.Error, UnicodeDecodeError):
+            return None
+
+    def _sign(self, payload: str) -> str:
+        return hmac.new(self.secret, payload.encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+    async def __call__(self, request: Request, user_id: str) -> str:
+        """FastAPI dependency for /users/{user_id}/ routes; returns the token's user id"""
+        token_user = self.verify(bearer_token(request))
+        if token_user is None:
+            self.rejected += 1
+            raise HTTPException(status_code=401, detail="Missing, invalid or expired user token",
+                                headers={"WWW-Authenticate": "Bearer"})
+        if token_user != user_id:
+            self.rejected += 1
+            raise HTTPException(status_code=403, detail="Token does not belong to this user")
+        self.allowed += 1
+        return token_user
+
+    def stats(self) -> dict:
+        return {"ttl": self.ttl, "issued": self.issued, "allowed": self.allowed, "rejected": self.rejected}
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Parse time and memory of /blood-pressure/analyze bodies
+Compares the pydantic path (json + one BloodPressureRecord per reading) with
+the fast path (record_codec.py) for the same readings sent as JSON records,
+columnar JSON and streamed NDJSON, and the default JSON response encoding
+with the orjson one. Runs in-process, no server needed:
+
+    python bench_serialization.py --readings 10000 100000 --repeat 5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import tracemalloc
+
+os.environ.setdefault("DASHSCOPE_API_KEY", "bench")
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+from bp_stats import PreparedRecords  # noqa: E402
+from main import (  # noqa: E402
+    BloodPressureAnalysisRequest, BloodPressureAnalysisResponse, BloodPressureRecord
+)
+from record_codec import (  # noqa: E402
+    decode_analysis_payload, decode_columnar_payload, loads, orjson, read_ndjson
+)
+
+CHUNK_BYTES = 64 * 1024
+
+
+def make_records(readings: int) -> list:
+    now = time.time()
+    return [
+        {
+            "systolic": random.randint(110, 170),
+            "diastolic": random.randint(70, 105),
+            "heart_rate": random.randint(55, 95) if i % 4 else None,
+            "timestamp": now - i * 3600,
+            "notes": "after exercise" if i % 50 == 0 else None,
+        }
+        for i in range(readings)
+    ]
+
+
+def records_body(records: list) -> bytes:
+    return json.dumps({"records": records, "email": "patient@example.com"}).encode("utf-8")
+
+
+def columnar_body(records: list) -> bytes:
+    columns = {key: [r[key] for r in records] for key in ("timestamp", "systolic", "diastolic", "heart_rate", "notes")}
+    return json.dumps({**columns, "email": "patient@example.com"}).encode("utf-8")
+
+
+def ndjson_body(records: list) -> bytes:
+    return "".join(json.dumps(r) + "\n" for r in records).encode("utf-8")
+
+
+def parse_pydantic(body: bytes):
+    request = BloodPressureAnalysisRequest.model_validate(json.loads(body))
+    return request, PreparedRecords(request.records)
+
+
+def prepare(columns):
+    return PreparedRecords.from_arrays(columns.arrays, columns.notes, BloodPressureRecord.model_construct)
+
+
+def parse_records(body: bytes):
+    return prepare(decode_analysis_payload(loads(body)))
+
+
+def parse_columnar(body: bytes):
+    return prepare(decode_columnar_payload(loads(body)))
+
+
+def parse_ndjson(body: bytes):
+    async def chunks():
+        for start in range(0, len(body), CHUNK_BYTES):
+            yield body[start:start + CHUNK_BYTES]
+
+    return prepare(asyncio.run(read_ndjson(chunks(), len(body), BloodPressureRecord.model_validate)))
+
+
+def encode_default(response: BloodPressureAnalysisResponse) -> bytes:
+    return json.dumps(jsonable_encoder(response), ensure_ascii=False).encode("utf-8")
+
+
+def encode_orjson(response: BloodPressureAnalysisResponse) -> bytes:
+    return orjson.dumps(response.model_dump())
+
+
+def measure(fn, arg, repeat: int) -> dict:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - started)
+
+    tracemalloc.start()
+    result = fn(arg)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {"seconds": best, "peak_bytes": peak, "retained_bytes": retained}
+
+
+def report(name: str, size: int, m: dict, per: float):
+    print(f"  {name:<10} {size / per / 2**20:6.2f} MiB body  {m['seconds'] * 1000 / per:8.2f} ms   "
+          f"peak {m['peak_bytes'] / per / 2**20:6.2f} MiB   "
+          f"retained {m['retained_bytes'] / per / 2**20:6.2f} MiB")
+
+
+def main(args) -> int:
+    random.seed(0)
+    print(f"JSON backend: {'orjson' if orjson is not None else 'json (orjson not installed)'}; "
+          f"figures per 10k readings, best of {args.repeat}")
+    for readings in args.readings:
+        records = make_records(readings)
+        per = readings / 10000
+        print(f"{readings} readings:")
+        for name, fn, body in (
+            ("pydantic", parse_pydantic, records_body(records)),
+            ("records", parse_records, records_body(records)),
+            ("columnar", parse_columnar, columnar_body(records)),
+            ("ndjson", parse_ndjson, ndjson_body(records)),
+        ):
+            report(name, len(body), measure(fn, body, args.repeat), per)
+
+    if orjson is not None:
+        response = BloodPressureAnalysisResponse(
+            analysis="血压评估：" + "收缩压偏高，建议低盐饮食并规律监测。" * 40,
+            recommendations=[f"{i}. 建议{i}" for i in range(1, 6)],
+            alert_level="high",
+        )
+        default = measure(encode_default, response, args.repeat * 200)
+        fast = measure(encode_orjson, response, args.repeat * 200)
+        print("Response encoding (one analysis):")
+        print(f"  default    {default['seconds'] * 1e6:9.1f} us")
+        print(f"  orjson     {fast['seconds'] * 1e6:9.1f} us")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze body serialization benchmark")
+    parser.add_argument("--readings", type=int, nargs="+", default=[10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    raise SystemExit(main(parser.parse_args()))
@@ -0,0 +1,245 @@
+"""
+Vectorized blood pressure statistics
+Records are converted to columnar NumPy arrays once and every statistic is
+computed in array passes, so long histories stay cheap for both the prompt
+and the alert logic. PreparedRecords bundles everything one analysis needs
+(arrays, stats, the most recent readings) so no stage sorts the history again.
+"""
+
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+
+SECONDS_PER_DAY = 86400.0
+
+# Time-of-day buckets (local hours, [start, end))
+TIME_BUCKETS = {
+    "night": (0, 6),
+    "morning": (6, 12),
+    "afternoon": (12, 18),
+    "evening": (18, 24),
+}
+
+# Alert thresholds (systolic, diastolic), checked from most to least severe
+ALERT_THRESHOLDS = (
+    ("critical", 180, 120),
+    ("high", 160, 100),
+    ("elevated", 140, 90),
+)
+
+
+class BPArrays:
+    """Columnar view of a list of readings"""
+
+    def __init__(self, systolic: np.ndarray, diastolic: np.ndarray,
+                 heart_rate: np.ndarray, timestamp: np.ndarray):
+        self.systolic = systolic
+        self.diastolic = diastolic
+        self.heart_rate = heart_rate  # NaN where missing
+        self.timestamp = timestamp    # NaN where missing
+
+    def __len__(self) -> int:
+        return len(self.systolic)
+
+    @classmethod
+    def from_records(cls, records: Sequence) -> "BPArrays":
+        n = len(records)
+        systolic = np.fromiter((r.systolic for r in records), dtype=np.float64, count=n)
+        diastolic = np.fromiter((r.diastolic for r in records), dtype=np.float64, count=n)
+        heart_rate = np.fromiter(
+            (np.nan if r.heart_rate is None else r.heart_rate for r in records),
+            dtype=np.float64, count=n
+        )
+        timestamp = np.fromiter(
+            (np.nan if r.timestamp is None else r.timestamp for r in records),
+            dtype=np.float64, count=n
+        )
+        return cls(systolic, diastolic, heart_rate, timestamp)
+
+    def take(self, indices: np.ndarray) -> "BPArrays":
+        return BPArrays(self.systolic[indices], self.diastolic[indices],
+                        self.heart_rate[indices], self.timestamp[indices])
+
+    def head(self, k: int) -> "BPArrays":
+        """The first k readings (newest first when taken from PreparedRecords.recent_arrays)"""
+        return BPArrays(self.systolic[:k], self.diastolic[:k], self.heart_rate[:k], self.timestamp[:k])
+
+    def newest_first(self, k: int) -> np.ndarray:
+        """
+        Indices of the k newest readings, newest first
+        Matches sorted(key=timestamp or 0, reverse=True)[:k] including its
+        stable tie order, but selects in O(n) instead of sorting the history.
+        """
+        key = np.nan_to_num(self.timestamp, nan=0.0)
+        n = len(key)
+        if k >= n:
+            return np.argsort(-key, kind="stable")
+        kth = np.partition(key, n - k)[n - k]
+        above = np.flatnonzero(key > kth)
+        ties = np.flatnonzero(key == kth)[:k - len(above)]
+        selected = np.concatenate([above, ties])
+        return selected[np.argsort(-key[selected], kind="stable")]
+
+
+@dataclass
+class BPStats:
+    count: int
+    mean_systolic: float
+    mean_diastolic: float
+    std_systolic: float
+    std_diastolic: float
+    min_systolic: float
+    max_systolic: float
+    min_diastolic: float
+    max_diastolic: float
+    mean_pulse_pressure: float
+    mean_heart_rate: Optional[float] = None
+    # Linear trend in mmHg per day (needs timestamps spanning more than a moment)
+    systolic_slope_per_day: Optional[float] = None
+    diastolic_slope_per_day: Optional[float] = None
+    # Mean systolic per time-of-day bucket and morning surge (morning - evening)
+    bucket_mean_systolic: Optional[dict] = None
+    morning_surge: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def compute_stats(arrays: BPArrays) -> Optional[BPStats]:
+    """All summary statistics in vectorized passes (None for an empty history)"""
+    if len(arrays) == 0:
+        return None
+
+    sys_ = arrays.systolic
+    dia = arrays.diastolic
+
+    stats = BPStats(
+        count=len(arrays),
+        mean_systolic=float(sys_.mean()),
+        mean_diastolic=float(dia.mean()),
+        std_systolic=float(sys_.std()),
+        std_diastolic=float(dia.std()),
+        min_systolic=float(sys_.min()),
+        max_systolic=float(sys_.max()),
+        min_diastolic=float(dia.min()),
+        max_diastolic=float(dia.max()),
+        mean_pulse_pressure=float((sys_ - dia).mean()),
+    )
+
+    hr = arrays.heart_rate[~np.isnan(arrays.heart_rate)]
+    if hr.size:
+        stats.mean_heart_rate = float(hr.mean())
+
+    has_ts = ~np.isnan(arrays.timestamp)
+    if has_ts.sum() >= 2:
+        ts = arrays.timestamp[has_ts]
+        days = (ts - ts.min()) / SECONDS_PER_DAY
+        stats.systolic_slope_per_day = _slope(days, sys_[has_ts])
+        stats.diastolic_slope_per_day = _slope(days, dia[has_ts])
+
+    if has_ts.any():
+        hours = local_hours(arrays.timestamp[has_ts])
+        ts_sys = sys_[has_ts]
+        buckets = {}
+        for name, (start, end) in TIME_BUCKETS.items():
+            mask = (hours >= start) & (hours < end)
+            if mask.any():
+                buckets[name] = float(ts_sys[mask].mean())
+        stats.bucket_mean_systolic = buckets
+        if "morning" in buckets and "evening" in buckets:
+            stats.morning_surge = buckets["morning"] - buckets["evening"]
+
+    return stats
+
+
+def alert_level(recent: BPArrays, window: int = 3) -> str:
+    """
+    Alert level of the most recent readings (`recent` must be newest first)
+    The first of the latest `window` readings that crosses a threshold decides the level.
+    """
+    recent = recent.head(window)
+    if len(recent) == 0:
+        return "normal"
+
+    levels = np.full(len(recent), "normal", dtype=object)
+    # Fill from least to most severe so the most severe threshold wins per reading
+    for name, sys_limit, dia_limit in reversed(ALERT_THRESHOLDS):
+        levels[(recent.systolic >= sys_limit) | (recent.diastolic >= dia_limit)] = name
+
+    flagged = np.flatnonzero(levels != "normal")
+    return levels[flagged[0]] if flagged.size else "normal"
+
+
+class PreparedRecords:
+    """One request's readings, prepared once and shared by every analysis stage"""
+
+    def __init__(self, records: Sequence, recent_window: int = 10, stats: Optional["BPStats"] = None,
+                 arrays: Optional[BPArrays] = None):
+        """
+        stats can be passed in when they are already known (e.g. rolling aggregates).
+        With arrays given, records only needs to support records[i] for the recent
+        readings (see from_arrays).
+        """
+        self.records = records
+        self.arrays = arrays if arrays is not None else BPArrays.from_records(records)
+        recent_index = self.arrays.newest_first(recent_window)
+        self.recent_arrays = self.arrays.take(recent_index)
+        self.recent_records = [records[i] for i in recent_index]
+        self.latest = self.recent_records[0] if self.recent_records else None
+        self.stats = stats if stats is not None else compute_stats(self.arrays)
+
+    @classmethod
+    def from_arrays(cls, arrays: BPArrays, notes: Sequence, make_record: Callable,
+                    recent_window: int = 10) -> "PreparedRecords":
+        """
+        Prepare columnar readings without one object per reading
+        Only the recent readings are materialized, via make_record(**fields).
+        """
+        return cls(_LazyRecords(arrays, notes, make_record), recent_window, arrays=arrays)
+
+
+class _LazyRecords:
+    """records[i] view over columnar arrays, building record objects on access"""
+
+    def __init__(self, arrays: BPArrays, notes: Sequence, make_record: Callable):
+        self.arrays = arrays
+        self.notes = notes
+        self.make_record = make_record
+
+    def __len__(self) -> int:
+        return len(self.arrays)
+
+    def __getitem__(self, i):
+        a = self.arrays
+        heart_rate = a.heart_rate[i]
+        timestamp = a.timestamp[i]
+        return self.make_record(
+            systolic=int(a.systolic[i]),
+            diastolic=int(a.diastolic[i]),
+            heart_rate=None if np.isnan(heart_rate) else int(heart_rate),
+            timestamp=None if np.isnan(timestamp) else float(timestamp),
+            notes=self.notes[i] if self.notes is not None else None,
+        )
+
+
+def _slope(x: np.ndarray, y: np.ndarray) -> Optional[float]:
+    """Least-squares slope of y over x"""
+    x_centered = x - x.mean()
+    denom = float(np.dot(x_centered, x_centered))
+    if denom == 0.0:
+        return None
+    return float(np.dot(x_centered, y - y.mean()) / denom)
+
+
+def utc_offset() -> float:
+    """Current local UTC offset in seconds (same timezone as datetime.fromtimestamp)"""
+    return datetime.now().astimezone().utcoffset().total_seconds()
+
+
+def local_hours(timestamps, offset: Optional[float] = None):
+    """Local hour of day for epoch seconds (scalar or array)"""
+    if offset is None:
+        offset = utc_offset()
+    return ((timestamps + offset) % SECONDS_PER_DAY) // 3600
@@ -0,0 +1,318 @@
+"""
+Server-side chat sessions
+Clients send only the new message plus a session id. Each session keeps a
+sliding window of recent turns within a token budget; turns that fall out
+of the window are folded into a running summary, so the context sent to
+Qwen stays bounded. Sessions live in an LRU that evicts the least recently
+used ones once the session count or the memory cap is exceeded. With a
+shared StateBackend every exchange is also saved there (TTL CHAT_SESSION_TTL)
+and reloaded per request, so a conversation can continue on any worker;
+concurrent writes to one session are last-writer-wins.
+
+Session ids are issued by the server (POST /chat/sessions) and carry an
+HMAC of a random token, so clients cannot pick or guess ids: an id the
+server did not sign is treated as unknown. Workers sharing a backend must
+share the secret. During a deprecation window (legacy_ids) the plain UUIDs
+that older app builds generate themselves are still accepted.
+"""
+
+import hashlib
+import hmac
+import re
+import secrets
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Optional
+
+from state_backend import StateBackend, StateBackendError
+
+# Rough per-session bookkeeping cost on top of the message text
+SESSION_OVERHEAD_BYTES = 512
+KEY_PREFIX = "session:"
+# Client-generated ids of older app builds (java.util.UUID.randomUUID())
+LEGACY_ID_PATTERN = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate Qwen token count: one per CJK character, ~4 chars per token otherwise"""
+    cjk = sum(1 for ch in text if "\u2e80" <= ch <= "\u9fff" or "\uf900" <= ch <= "\ufaff")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class Turn:
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role: str, content: str):
+        self.role = role
+        self.content = content
+        self.tokens = estimate_tokens(content)
+
+    def to_message(self) -> dict:
+        return {"role": self.role, "content": self.content}
+
+
+class ChatSession:
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.summary = ""
+        self.turns: List[Turn] = []    # sliding window, oldest first
+        self.pending: List[Turn] = []  # left the window, not yet in the summary
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.summarizing = False
+
+    @property
+    def window_tokens(self) -> int:
+        return sum(turn.tokens for turn in self.turns)
+
+    @property
+    def size_bytes(self) -> int:
+        text = sum(len(t.content.encode("utf-8")) for t in self.turns + self.pending)
+        return SESSION_OVERHEAD_BYTES + text + len(self.summary.encode("utf-8"))
+
+    def to_dict(self) -> dict:
+        return {
+            "session_id": self.id,
+            "turns": len(self.turns),
+            "window_tokens": self.window_tokens,
+            "pending_turns": len(self.pending),
+            "summary": self.summary,
+            "created_at": self.created_at,
+            "last_used": self.last_used,
+        }
+
+    def dump(self) -> dict:
+        """JSON form for a shared backend"""
+        return {
+            "id": self.id,
+            "summary": self.summary,
+            "turns": [[t.role, t.content] for t in self.turns],
+            "pending": [[t.role, t.content] for t in self.pending],
+            "created_at": self.created_at,
+            "last_used": self.last_used,
+        }
+
+    @classmethod
+    def restore(cls, data: dict) -> "ChatSession":
+        session = cls(data["id"])
+        session.summary = data["summary"]
+        session.turns = [Turn(role, content) for role, content in data["turns"]]
+        session.pending = [Turn(role, content) for role, content in data["pending"]]
+        session.created_at = data["created_at"]
+        session.last_used = data["last_used"]
+        return session
+
+
+class SessionStore:
+    def __init__(
+        self,
+        max_sessions: int = 10000,
+        max_bytes: int = 64 * 1024 * 1024,
+        context_tokens: int = 1200,
+        summary_tokens: int = 300,
+        backend: Optional[StateBackend] = None,
+        session_ttl: float = 86400.0,
+        secret: Optional[bytes] = None,
+        legacy_ids: bool = False,
+    ):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.context_tokens = context_tokens
+        self.summary_tokens = summary_tokens
+        self.backend = backend  # None: sessions live in this process only
+        self.session_ttl = session_ttl
+        self.secret = secret or secrets.token_bytes(32)  # random: ids are valid in this process only
+        self.legacy_ids = legacy_ids
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._bytes = 0
+
+        self.created = 0
+        self.evicted = 0
+        self.backend_errors = 0
+        self.rejected_ids = 0
+        self.legacy_requests = 0
+
+    def new_id(self) -> str:
+        token = uuid.uuid4().hex
+        return f"{token}.{self._sign(token)}"
+
+    def issued(self, session_id: Optional[str]) -> bool:
+        """True for ids signed with this store's secret"""
+        token, _, signature = (session_id or "").partition(".")
+        return bool(token) and hmac.compare_digest(signature, self._sign(token))
+
+    def accepts(self, session_id: Optional[str]) -> bool:
+        """Issued ids, plus client UUIDs while legacy_ids is on; counts rejections"""
+        if self.issued(session_id):
+            return True
+        if self.legacy_ids and LEGACY_ID_PATTERN.fullmatch(session_id or ""):
+            self.legacy_requests += 1
+            return True
+        self.rejected_ids += 1
+        return False
+
+    def _sign(self, token: str) -> str:
+        return hmac.new(self.secret, token.encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+    def get(self, session_id: str) -> Optional[ChatSession]:
+        return self._sessions.get(session_id)
+
+    def get_or_create(self, session_id: Optional[str] = None) -> ChatSession:
+        """
+        Existing session (marked as recently used) or a new one
+        An unknown id (e.g. evicted) starts a fresh session under the same id;
+        callers check accepts() first
+        """
+        session = self._sessions.get(session_id) if session_id else None
+        if session is None:
+            session = ChatSession(session_id or self.new_id())
+            self._sessions[session.id] = session
+            self._bytes += session.size_bytes
+            self.created += 1
+            self._enforce_limits(keep=session.id)
+        else:
+            self._sessions.move_to_end(session.id)
+        session.last_used = time.time()
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self._bytes -= session.size_bytes
+        return True
+
+    async def load(self, session_id: Optional[str] = None, create: bool = False) -> Optional[ChatSession]:
+        """
+        Latest copy of a session (from the shared backend, if any)
+        With create=True behaves like get_or_create(). When the backend is
+        unreachable the local copy is used. None for ids the server did not issue.
+        """
+        if session_id and not self.accepts(session_id):
+            return None
+        if self.backend is None or not session_id:
+            return self.get_or_create(session_id) if create else self.get(session_id)
+        try:
+            data = await self.backend.get(KEY_PREFIX + session_id)
+        except StateBackendError as e:
+            self.backend_errors += 1
+            print(f"Chat session load failed, using local copy: {e}")
+            return self.get_or_create(session_id) if create else self.get(session_id)
+        if data is None:
+            # Expired or deleted on another worker
+            self.delete(session_id)
+            return self.get_or_create(session_id) if create else None
+        local = self._sessions.get(session_id)
+        session = ChatSession.restore(data)
+        if local is not None:
+            session.summarizing = local.summarizing
+            self.delete(session_id)
+        self._sessions[session.id] = session
+        self._bytes += session.size_bytes
+        self._enforce_limits(keep=session.id)
+        session.last_used = time.time()
+        return session
+
+    async def save(self, session: ChatSession):
+        """Write a session back to the shared backend (no-op without one)"""
+        if self.backend is None:
+            return
+        try:
+            await self.backend.set(KEY_PREFIX + session.id, session.dump(), self.session_ttl)
+        except StateBackendError as e:
+            self.backend_errors += 1
+            print(f"Chat session save failed: {e}")
+
+    async def remove(self, session_id: str) -> bool:
+        """Forget a session here and in the shared backend"""
+        if not self.accepts(session_id):
+            return False
+        found = self.delete(session_id)
+        if self.backend is not None:
+            try:
+                found = await self.backend.delete(KEY_PREFIX + session_id) or found
+            except StateBackendError as e:
+                self.backend_errors += 1
+                print(f"Chat session delete failed: {e}")
+        return found
+
+    def context_messages(self, session: ChatSession, message: str) -> List[dict]:
+        """Messages for Qwen: summary, turns awaiting summary, window, new message"""
+        messages = []
+        if session.summary:
+            messages.append({"role": "system", "content": f"此前对话的摘要：{session.summary}"})
+        messages.extend(turn.to_message() for turn in session.pending)
+        messages.extend(turn.to_message() for turn in session.turns)
+        messages.append({"role": "user", "content": message})
+        return messages
+
+    def record_turn(self, session: ChatSession, message: str, reply: str) -> bool:
+        """
+        Append a user/assistant exchange and slide the window
+        Returns True when older turns moved to pending and should be summarized
+        """
+        before = session.size_bytes
+        session.turns.append(Turn("user", message))
+        session.turns.append(Turn("assistant", reply))
+        # Keep at least the latest exchange, drop whole exchanges from the front
+        while session.window_tokens > self.context_tokens and len(session.turns) > 2:
+            session.pending.extend(session.turns[:2])
+            del session.turns[:2]
+        session.last_used = time.time()
+        self._resize(session, before)
+        return bool(session.pending) and not session.summarizing
+
+    def apply_summary(self, session: ChatSession, summary: str, folded: List[Turn]):
+        """Replace the summary once the `folded` pending turns are covered by it"""
+        # Compared by content: the session may have been reloaded from the backend meanwhile
+        done = [(t.role, t.content) for t in folded]
+        if [(t.role, t.content) for t in session.pending[:len(done)]] != done:
+            return  # already folded by another worker
+        before = session.size_bytes
+        session.summary = summary
+        del session.pending[:len(done)]
+        self._resize(session, before)
+
+    def extractive_summary(self, session: ChatSession, turns: List[Turn]) -> str:
+        """Summary without the LLM: previous summary plus the start of each turn, trimmed to budget"""
+        parts = [session.summary] if session.summary else []
+        for turn in turns:
+            speaker = "用户" if turn.role == "user" else "助手"
+            parts.append(f"{speaker}：{turn.content[:60]}")
+        summary = "；".join(parts)
+        while estimate_tokens(summary) > self.summary_tokens and "；" in summary:
+            summary = summary.split("；", 1)[1]
+        return summary[:self.summary_tokens * 2]
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "created": self.created,
+            "evicted": self.evicted,
+            "backend": self.backend.name if self.backend is not None else "memory",
+            "backend_errors": self.backend_errors,
+            "rejected_ids": self.rejected_ids,
+            "legacy_ids": self.legacy_ids,
+            "legacy_requests": self.legacy_requests,
+        }
+
+    def _resize(self, session: ChatSession, before: int):
+        if session.id in self._sessions:
+            self._bytes += session.size_bytes - before
+            self._enforce_limits(keep=session.id)
+
+    def _enforce_limits(self, keep: str):
+        """Evict least recently used sessions (never `keep`) until within the caps"""
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes
+        ):
+            oldest_id = next(iter(self._sessions))
+            if oldest_id == keep:
+                self._sessions.move_to_end(keep)
+                continue
+            self._bytes -= self._sessions.pop(oldest_id).size_bytes
+            self.evicted += 1
@@ -0,0 +1,145 @@
+"""
+Circuit breaker for the upstream (Qwen) API
+When dashscope is degraded every call would otherwise wait for the full
+timeout. The breaker opens after consecutive failures or when too many
+recent calls are slow, rejects calls immediately while open, and after a
+cool-down lets a few half-open probes through to decide whether to close.
+"""
+
+import time
+from collections import deque
+from typing import Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling the upstream while the circuit is open"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Upstream circuit is open")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        slow_call_seconds: float = 10.0,
+        slow_call_ratio: float = 0.5,
+        window: int = 20,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 1,
+    ):
+        self.failure_threshold = failure_threshold  # 0 disables the breaker
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_ratio = slow_call_ratio
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        self.state = CLOSED
+        self._consecutive_failures = 0
+        self._slow_calls = deque(maxlen=window)  # True per slow (or failed) call
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.failure_threshold > 0
+
+    def acquire(self) -> bool:
+        """
+        Call before each upstream request; raises CircuitOpen to fail fast
+        Returns True when the call is a half-open probe, pass it to record_*()
+        """
+        if not self.enabled or self.state == CLOSED:
+            return False
+        if self.state == OPEN:
+            remaining = self._opened_at + self.open_seconds - time.monotonic()
+            if remaining > 0:
+                self.rejected += 1
+                raise CircuitOpen(remaining)
+            self.state = HALF_OPEN
+        if self._probes_in_flight >= self.half_open_probes:
+            self.rejected += 1
+            raise CircuitOpen(self.open_seconds)
+        self._probes_in_flight += 1
+        return True
+
+    def record_success(self, duration: float, probe: bool = False):
+        if not self.enabled:
+            return
+        slow = duration >= self.slow_call_seconds
+        if probe:
+            self._probes_in_flight -= 1
+            if slow:
+                self._trip()
+            else:
+                self._close()
+            return
+        if self.state != CLOSED:
+            # Started before the circuit opened; the probes decide
+            return
+        self._consecutive_failures = 0
+        self._slow_calls.append(slow)
+        if self._too_slow():
+            self._trip()
+
+    def record_failure(self, probe: bool = False):
+        if not self.enabled:
+            return
+        if probe:
+            self._probes_in_flight -= 1
+            self._trip()
+            return
+        if self.state != CLOSED:
+            return
+        self._consecutive_failures += 1
+        self._slow_calls.append(True)
+        if self._consecutive_failures >= self.failure_threshold or self._too_slow():
+            self._trip()
+
+    def record_ignored(self, probe: bool = False):
+        """The call ended without a verdict (cancelled, shed before sending)"""
+        if probe:
+            self._probes_in_flight -= 1
+
+    def retry_after(self) -> Optional[float]:
+        if self.state != OPEN:
+            return None
+        return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "state": self.state,
+            "consecutive_failures": self._consecutive_failures,
+            "slow_ratio": round(self._slow_ratio(), 3),
+            "retry_after": round(self.retry_after(), 1) if self.state == OPEN else None,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+    def _slow_ratio(self) -> float:
+        return sum(self._slow_calls) / len(self._slow_calls) if self._slow_calls else 0.0
+
+    def _too_slow(self) -> bool:
+        # Only judge the latency ratio over a full window
+        return len(self._slow_calls) == self._slow_calls.maxlen and self._slow_ratio() >= self.slow_call_ratio
+
+    def _trip(self):
+        if self.state != OPEN:
+            self.opened += 1
+            print(f"Upstream circuit opened for {self.open_seconds:g}s")
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+
+    def _close(self):
+        self.state = CLOSED
+        self._consecutive_failures = 0
+        self._slow_calls.clear()
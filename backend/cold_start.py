@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Cold start benchmark for the Chatbox backend
+Starts the backend as a fresh process and measures the time until it is
+live (`/`), ready (`/ready`) and has answered its first successful /chat,
+once without and once with the upstream prewarm:
+
+    python cold_start.py --tls --runs 3
+
+By default the mock Qwen API (mock_qwen_server.py) is started as well;
+with --tls it serves HTTPS with a throwaway self-signed certificate so the
+first request pays a real TLS handshake. Use --qwen-base-url to measure
+against the real DashScope endpoint (DASHSCOPE_API_KEY must be set).
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_certificate(workdir: str) -> tuple:
+    certfile = os.path.join(workdir, "cert.pem")
+    keyfile = os.path.join(workdir, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+         "-keyout", keyfile, "-out", certfile],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return certfile, keyfile
+
+
+def wait_for(url: str, timeout: float, verify=True) -> Optional[float]:
+    """perf_counter() when GET url first returns 200 (None on timeout)"""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            if httpx.get(url, timeout=1.0, verify=verify).status_code == 200:
+                return time.perf_counter()
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.01)
+    return None
+
+
+def measure_once(args, env: dict, prewarm: int) -> dict:
+    base_url = f"http://127.0.0.1:{args.port}"
+    env = dict(env, QWEN_PREWARM_CONNECTIONS=str(prewarm))
+    spawned = time.perf_counter()
+    backend = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(args.port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL,
+    )
+    try:
+        live = wait_for(f"{base_url}/", args.timeout)
+        ready = wait_for(f"{base_url}/ready", args.timeout) if args.wait_ready else None
+        # The message varies per run so nothing is served from a cache
+        chat_started = time.perf_counter()
+        response = httpx.post(f"{base_url}/chat", json={"message": f"你好 {time.time()}"}, timeout=60.0)
+        done = time.perf_counter()
+        stats = httpx.get(f"{base_url}/stats", timeout=5.0).json()["startup"]
+        return {
+            "live": live - spawned,
+            "ready": None if ready is None else ready - spawned,
+            "first_chat_latency": done - chat_started,
+            "first_chat_total": done - spawned,
+            "ok": response.status_code == 200 and not response.json().get("degraded"),
+            "phases": stats["phases_seconds"],
+        }
+    finally:
+        backend.terminate()
+        backend.wait()
+
+
+def main(args) -> int:
+    workdir = tempfile.mkdtemp(prefix="chatbox-cold-")
+    env = dict(
+        os.environ,
+        READING_STORE_PATH=os.path.join(workdir, "readings.db"),
+        AGGREGATES_SNAPSHOT_PATH=os.path.join(workdir, "aggregates.json"),
+        ANALYSIS_CACHE_SIZE="0",
+    )
+    mock: List[subprocess.Popen] = []
+    if args.qwen_base_url:
+        env["QWEN_BASE_URL"] = args.qwen_base_url
+    else:
+        command = [sys.executable, "mock_qwen_server.py", "--port", str(args.qwen_port),
+                   "--latency-ms", str(args.latency_ms), "--jitter-ms", "0"]
+        scheme = "http"
+        if args.tls:
+            certfile, keyfile = make_certificate(workdir)
+            command += ["--ssl-certfile", certfile, "--ssl-keyfile", keyfile]
+            # httpx honours SSL_CERT_FILE, so the backend trusts the throwaway certificate
+            env["SSL_CERT_FILE"] = certfile
+            scheme = "https"
+        env.setdefault("DASHSCOPE_API_KEY", "mock-key")
+        env["QWEN_BASE_URL"] = f"{scheme}://127.0.0.1:{args.qwen_port}/v1"
+        mock.append(subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL))
+        verify = env.get("SSL_CERT_FILE", True)
+        if wait_for(f"{scheme}://127.0.0.1:{args.qwen_port}/", 30.0, verify=verify) is None:
+            print("Mock Qwen API did not start")
+            return 1
+
+    try:
+        print(f"{'prewarm':<8} {'live':>8} {'ready':>8} {'1st chat':>9} {'spawn→chat':>11} {'import→ready':>13}  ok")
+        for prewarm in (0, args.prewarm_connections):
+            for _ in range(args.runs):
+                r = measure_once(args, env, prewarm)
+                ready = "-" if r["ready"] is None else f"{r['ready'] * 1000:.0f}ms"
+                print(f"{prewarm:<8} {r['live'] * 1000:>6.0f}ms {ready:>8} "
+                      f"{r['first_chat_latency'] * 1000:>7.1f}ms {r['first_chat_total'] * 1000:>9.0f}ms "
+                      f"{r['phases'].get('ready', 0) * 1000:>11.0f}ms  {r['ok']}")
+    finally:
+        for process in mock:
+            process.terminate()
+            process.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chatbox backend cold start benchmark")
+    parser.add_argument("--port", type=int, default=8200, help="backend port")
+    parser.add_argument("--qwen-port", type=int, default=9200, help="mock Qwen API port")
+    parser.add_argument("--qwen-base-url", help="real upstream instead of the mock")
+    parser.add_argument("--tls", action="store_true", help="serve the mock over HTTPS")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="mock response latency")
+    parser.add_argument("--prewarm-connections", type=int, default=2)
+    parser.add_argument("--runs", type=int, default=3, help="runs per setting")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--no-wait-ready", dest="wait_ready", action="store_false",
+                        help="send the first chat as soon as / answers")
+    raise SystemExit(main(parser.parse_args()))
@@ -0,0 +1,189 @@
+"""
+HTTP compression
+Responses are compressed with brotli or gzip as negotiated through
+Accept-Encoding, once the body reaches a minimum size (small JSON is not
+worth the CPU). Streamed responses are compressed chunk by chunk with a
+flush per chunk so NDJSON lines still arrive as they are produced; SSE is
+left alone. gzip request bodies are decompressed incrementally in bounded
+steps, so a small compressed body cannot expand into unbounded memory: the
+caller's size cap applies to the decompressed bytes.
+"""
+
+import zlib
+from typing import AsyncIterator, Optional
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only
+    brotli = None
+
+# Content types worth compressing (prefix match); everything else passes through
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/x-ndjson", "application/problem+json")
+UNCOMPRESSED_TYPES = ("text/event-stream",)
+
+DECOMPRESS_CHUNK_BYTES = 64 * 1024
+
+
+class InvalidContentEncoding(ValueError):
+    def __init__(self, detail: str, status_code: int = 400):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def supported_encodings() -> tuple:
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding: str, available: tuple) -> Optional[str]:
+    """Best of `available` (in server preference order) for an Accept-Encoding header"""
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class _Compressor:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._gzip = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        if self.encoding == "br":
+            out = self._brotli.process(data)
+            return out + self._brotli.flush() if flush else out
+        out = self._gzip.compress(data)
+        return out + self._gzip.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._gzip.flush(zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    """Pure ASGI middleware for negotiated response compression"""
+
+    def __init__(self, app, minimum_size: int = 512, gzip_level: int = 6, brotli_quality: int = 5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.available = supported_encodings()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        encoding = negotiate(accept, self.available) if accept else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor = None  # set once the response is being compressed
+        passthrough = False
+
+        async def compressing_send(message):
+            nonlocal start_message, compressor, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start_message = message
+                if not self._compressible(message["headers"]):
+                    passthrough = True
+                    await send(message)
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+                compressor = _Compressor(encoding, self.gzip_level, self.brotli_quality)
+                headers = [(k, v) for k, v in start_message["headers"] if k != b"content-length"]
+                headers.append((b"content-encoding", encoding.encode("ascii")))
+                headers.append((b"vary", b"Accept-Encoding"))
+                if not more_body:
+                    compressed = compressor.compress(body) + compressor.finish()
+                    headers.append((b"content-length", str(len(compressed)).encode("ascii")))
+                    await send({**start_message, "headers": headers})
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+                await send({**start_message, "headers": headers})
+
+            if more_body:
+                # Flush so each streamed chunk reaches the client now
+                out = compressor.compress(body, flush=True)
+            else:
+                out = compressor.compress(body) + compressor.finish()
+            await send({"type": "http.response.body", "body": out, "more_body": more_body})
+
+        await self.app(scope, receive, compressing_send)
+
+    def _compressible(self, headers) -> bool:
+        content_type = b""
+        for name, value in headers:
+            if name == b"content-encoding":
+                return False
+            if name == b"content-type":
+                content_type = value
+        content_type = content_type.decode("latin-1").lower()
+        if content_type.startswith(UNCOMPRESSED_TYPES):
+            return False
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+async def decode_request_body(chunks: AsyncIterator[bytes], content_encoding: Optional[str]) -> AsyncIterator[bytes]:
+    """
+    Body chunks with Content-Encoding removed (identity or gzip)
+    gzip output is produced at most DECOMPRESS_CHUNK_BYTES at a time; raises
+    InvalidContentEncoding for unsupported encodings (415) or corrupt data (400).
+    """
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding == "identity":
+        async for chunk in chunks:
+            yield chunk
+        return
+    if encoding not in ("gzip", "x-gzip"):
+        raise InvalidContentEncoding(f"Unsupported Content-Encoding: {encoding}", status_code=415)
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        async for chunk in chunks:
+            data = decompressor.decompress(chunk, DECOMPRESS_CHUNK_BYTES)
+            while data:
+                yield data
+                data = decompressor.decompress(decompressor.unconsumed_tail, DECOMPRESS_CHUNK_BYTES)
+    except zlib.error as e:
+        raise InvalidContentEncoding(f"Invalid gzip body: {e}")
+    if not decompressor.eof:
+        raise InvalidContentEncoding("Invalid gzip body: truncated")
@@ -0,0 +1,349 @@
+"""
+Background outbox for alert emails
+smtplib is blocking, so delivery runs on a small thread pool fed by an
+asyncio queue. Requests only enqueue and return; failed sends are retried
+with exponential backoff up to a bounded number of attempts. smtplib and
+email.mime are imported on the first send, not at startup.
+
+Alerts are coalesced per recipient: the first alert is sent at once, and
+follow-ups within the digest window after it are collected into one digest
+sent when the window closes. After that, alerts at the same or a lower level
+are suppressed for the rest of the cooldown (and mentioned in the next
+email). Escalations go out at once together with anything already pending.
+"""
+
+import asyncio
+import itertools
+import random
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from metrics import stage_timer
+
+# Alert levels that are emailed, lowest first
+ALERT_LEVELS = ("high", "critical")
+
+
+class OutboxMessage:
+    def __init__(self, to_email: str, subject: str, body: str):
+        self.id = uuid.uuid4().hex
+        self.to_email = to_email
+        self.subject = subject
+        self.body = body
+        self.status = "queued"  # (pending ->) queued -> sent | retrying -> failed
+        self.alerts = 1
+        self.attempts = 0
+        self.last_error: Optional[str] = None
+        self.created_at = time.time()
+        self.sent_at: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "to": self.to_email,
+            "status": self.status,
+            "alerts": self.alerts,
+            "attempts": self.attempts,
+            "last_error": self.last_error,
+            "created_at": self.created_at,
+            "sent_at": self.sent_at,
+        }
+
+
+class _Recipient:
+    """Coalescing state of one recipient"""
+    __slots__ = ("digest", "alerts", "level", "flush_handle", "sent_level", "sent_at", "window_ends", "suppressed")
+
+    def __init__(self):
+        self.digest: Optional[OutboxMessage] = None  # open digest, status "pending"
+        self.alerts: List[Tuple[str, str]] = []       # (level, section) in the open digest
+        self.level = -1                               # highest level rank in the open digest
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        self.sent_level = -1                          # highest level rank of the last email
+        self.sent_at: Optional[float] = None
+        self.window_ends: Optional[float] = None      # follow-ups until then are digested
+        self.suppressed = 0                           # alerts dropped since the last email
+
+
+class EmailOutbox:
+    def __init__(
+        self,
+        smtp_server: str,
+        smtp_port: int,
+        email_user: Optional[str],
+        email_password: Optional[str],
+        workers: int = 2,
+        max_attempts: int = 4,
+        backoff_base: float = 2.0,
+        backoff_max: float = 60.0,
+        max_queue_size: int = 1000,
+        smtp_timeout: float = 30.0,
+        history_size: int = 1000,
+        starttls: bool = True,
+        digest_window: float = 120.0,
+        alert_cooldown: float = 3600.0,
+        compose_digest: Optional[Callable[[List[Tuple[str, str]], int], Tuple[str, str]]] = None,
+    ):
+        self.smtp_server = smtp_server
+        self.smtp_port = smtp_port
+        self.email_user = email_user
+        self.email_password = email_password
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_queue_size = max_queue_size
+        self.smtp_timeout = smtp_timeout
+        self.starttls = starttls
+        self.history_size = history_size
+        self.digest_window = digest_window
+        self.alert_cooldown = alert_cooldown
+        # (alerts, suppressed) -> (subject, body); alerts are (level, section), oldest first
+        self.compose_digest = compose_digest or _compose_digest
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._tasks = []
+        self._retry_tasks = set()
+        self._history: "OrderedDict[str, OutboxMessage]" = OrderedDict()
+        self._recipients: "OrderedDict[str, _Recipient]" = OrderedDict()
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.alerts = 0
+        self.coalesced = 0
+        self.suppressed = 0
+        self.escalations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.email_user and self.email_password)
+
+    async def start(self):
+        """Start the worker pool (called from the FastAPI lifespan)"""
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="smtp")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0):
+        """Give queued emails a chance to go out, then stop the workers"""
+        if self._queue is None:
+            return
+        # Open digests go out now rather than being lost
+        for to_email in list(self._recipients):
+            self._flush(to_email)
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"Email outbox stopped with {self._queue.qsize()} message(s) undelivered")
+        for task in itertools.chain(self._tasks, self._retry_tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._retry_tasks, return_exceptions=True)
+        self._executor.shutdown(wait=False)
+        self._queue = None
+        self._tasks = []
+        self._retry_tasks = set()
+
+    def enqueue(self, to_email: str, subject: str, body: str) -> Optional[str]:
+        """Queue an email for delivery, returns the outbox id (None if not queued)"""
+        if not self.enabled or self._queue is None:
+            return None
+        message = OutboxMessage(to_email, subject, body)
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            print(f"Email outbox is full, dropping alert to {to_email}")
+            return None
+        self._remember(message)
+        return message.id
+
+    def enqueue_alert(self, to_email: str, level: str, section: str) -> Optional[str]:
+        """
+        Queue an alert for a recipient, coalesced with their other alerts
+        Returns the id of the email that will carry it (status "pending" while
+        a follow-up digest is open); None when the alert is suppressed by the
+        cooldown or cannot be queued.
+        """
+        if not self.enabled or self._queue is None:
+            return None
+        now = time.monotonic()
+        rank = ALERT_LEVELS.index(level) if level in ALERT_LEVELS else 0
+        self.alerts += 1
+        recipient = self._recipients.get(to_email)
+        if recipient is None:
+            recipient = self._recipients[to_email] = _Recipient()
+        self._recipients.move_to_end(to_email)
+        # Keep this recipient: its suppressed count goes into the email sent now
+        self._prune(now, keep=to_email)
+
+        if recipient.digest is not None:
+            message = recipient.digest
+            recipient.alerts.append((level, section))
+            message.alerts += 1
+            self.coalesced += 1
+            escalation = rank > max(recipient.level, recipient.sent_level)
+            recipient.level = max(recipient.level, rank)
+            if escalation:
+                self.escalations += 1
+                self._flush(to_email, immediate=True)
+            return message.id
+
+        cooling = recipient.sent_at is not None and now - recipient.sent_at < self.alert_cooldown
+        in_window = recipient.window_ends is not None and now < recipient.window_ends
+        escalation = cooling and rank > recipient.sent_level
+        if cooling and not in_window and not escalation:
+            recipient.suppressed += 1
+            self.suppressed += 1
+            return None
+
+        message = OutboxMessage(to_email, "", "")
+        message.status = "pending"
+        recipient.digest = message
+        recipient.alerts = [(level, section)]
+        recipient.level = rank
+        self._remember(message)
+        if in_window and not escalation:
+            # Follow-up to an email just sent: wait for the rest of the window
+            self.coalesced += 1
+            loop = asyncio.get_running_loop()
+            recipient.flush_handle = loop.call_later(recipient.window_ends - now, self._flush, to_email)
+        else:
+            self.escalations += escalation
+            self._flush(to_email, immediate=True)
+        return message.id
+
+    def get(self, message_id: str) -> Optional[dict]:
+        message = self._history.get(message_id)
+        return message.to_dict() if message else None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "retry_pending": len(self._retry_tasks),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "alerts": self.alerts,
+            "coalesced": self.coalesced,
+            "suppressed": self.suppressed,
+            "escalations": self.escalations,
+            "pending_digests": sum(1 for r in self._recipients.values() if r.digest is not None),
+        }
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await self._queue.get()
+            try:
+                message.attempts += 1
+                with stage_timer("smtp"):
+                    await loop.run_in_executor(self._executor, self._send_blocking, message)
+                message.status = "sent"
+                message.sent_at = time.time()
+                self.sent += 1
+            except Exception as e:
+                message.last_error = str(e)
+                if message.attempts < self.max_attempts:
+                    message.status = "retrying"
+                    self.retried += 1
+                    self._schedule_retry(message)
+                else:
+                    message.status = "failed"
+                    self.failed += 1
+                    print(f"Email sending failed after {message.attempts} attempts: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _schedule_retry(self, message: OutboxMessage):
+        # Exponential backoff with full jitter
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (message.attempts - 1)))
+        delay = random.uniform(0, delay)
+        task = asyncio.create_task(self._requeue_later(message, delay))
+        self._retry_tasks.add(task)
+        task.add_done_callback(self._retry_tasks.discard)
+
+    async def _requeue_later(self, message: OutboxMessage, delay: float):
+        await asyncio.sleep(delay)
+        await self._queue.put(message)
+
+    def _flush(self, to_email: str, immediate: bool = False):
+        """
+        Close the recipient's open digest and hand it to the workers
+        immediate: sent ahead of any window, opens a new one for follow-ups
+        """
+        recipient = self._recipients.get(to_email)
+        if recipient is None or recipient.digest is None:
+            return
+        if recipient.flush_handle is not None:
+            recipient.flush_handle.cancel()
+            recipient.flush_handle = None
+        message = recipient.digest
+        message.subject, message.body = self.compose_digest(recipient.alerts, recipient.suppressed)
+        message.status = "queued"
+        recipient.digest = None
+        recipient.alerts = []
+        recipient.sent_level = recipient.level if immediate else max(recipient.sent_level, recipient.level)
+        recipient.sent_at = time.monotonic()
+        if immediate:
+            recipient.window_ends = recipient.sent_at + self.digest_window
+        recipient.suppressed = 0
+        if self._queue is None:
+            return
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            message.status = "failed"
+            message.last_error = "Email outbox is full"
+            self.failed += 1
+            print(f"Email outbox is full, dropping alert to {to_email}")
+
+    def _prune(self, now: float, keep: Optional[str] = None):
+        """Forget recipients whose cooldown is over (least recently alerted first)"""
+        while self._recipients:
+            to_email, recipient = next(iter(self._recipients.items()))
+            if to_email == keep or recipient.digest is not None or (
+                recipient.sent_at is not None and now - recipient.sent_at < self.alert_cooldown
+            ) or (recipient.window_ends is not None and now < recipient.window_ends):
+                return
+            self._recipients.popitem(last=False)
+
+    def _send_blocking(self, message: OutboxMessage):
+        """Runs on the SMTP thread pool"""
+        # Imported here so the email stack stays out of the startup path
+        import smtplib
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+
+        msg = MIMEMultipart()
+        msg['From'] = self.email_user
+        msg['To'] = message.to_email
+        msg['Subject'] = message.subject
+        msg.attach(MIMEText(message.body, 'plain', 'utf-8'))
+
+        with smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=self.smtp_timeout) as server:
+            if self.starttls:
+                server.starttls()
+            server.login(self.email_user, self.email_password)
+            server.send_message(msg)
+
+    def _remember(self, message: OutboxMessage):
+        self._history[message.id] = message
+        while len(self._history) > self.history_size:
+            self._history.popitem(last=False)
+
+
+def _compose_digest(alerts: List[Tuple[str, str]], suppressed: int) -> Tuple[str, str]:
+    """Plain default: the sections one after another"""
+    subject = "Blood pressure alert" if len(alerts) == 1 else f"Blood pressure alerts ({len(alerts)})"
+    body = "\n\n".join(section for _, section in alerts)
+    if suppressed:
+        body += f"\n\n{suppressed} similar alert(s) since the previous email were not sent separately."
+    return subject, body
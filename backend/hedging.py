@@ -0,0 +1,189 @@
+"""
+Hedged and retried upstream calls
+A few Qwen calls take several times the median and set the p99. If a call
+has not answered by a percentile of recent latencies, a second identical
+request is sent and the first answer wins (the other is cancelled). The
+hedge needs its own upstream capacity: reserve_hedge() must hand out a
+release callback, or None to skip the hedge.
+Retryable failures (5xx, connection resets) are retried with jittered
+backoff; everything runs within one total deadline.
+"""
+
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+# Reserves capacity for one hedge; returns its release callback, or None when none is free
+HedgeReserver = Callable[[], Optional[Callable[[], None]]]
+
+import httpx
+
+# Connection resets and broken connections; timeouts already used up their budget
+RETRYABLE_ERRORS = (httpx.NetworkError, httpx.RemoteProtocolError)
+
+
+def is_retryable(outcome) -> bool:
+    if isinstance(outcome, httpx.Response):
+        return outcome.status_code >= 500
+    return isinstance(outcome, RETRYABLE_ERRORS) and not isinstance(outcome, httpx.TimeoutException)
+
+
+class LatencyTracker:
+    """Latencies of the last successful calls, for percentile-based hedge delays"""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+
+class HedgedCaller:
+    def __init__(
+        self,
+        hedge: bool = False,
+        hedge_percentile: float = 95.0,
+        hedge_min_delay: float = 0.5,
+        hedge_max_ratio: float = 0.1,
+        min_samples: int = 20,
+        max_retries: int = 2,
+        retry_backoff: float = 0.5,
+        deadline: float = 45.0,
+    ):
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_ratio = hedge_max_ratio  # share of calls allowed to send a hedge
+        self.min_samples = min_samples
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.deadline = deadline
+        self.latencies = LatencyTracker()
+
+        self.calls = 0
+        self.hedges = 0
+        self.hedges_skipped = 0
+        self.hedge_wins = 0
+        self.retries = 0
+        self.deadline_exceeded = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, None while hedging is off or over budget"""
+        if not self.hedge or len(self.latencies) < self.min_samples:
+            return None
+        if self.hedges >= self.hedge_max_ratio * self.calls:
+            return None
+        return max(self.hedge_min_delay, self.latencies.percentile(self.hedge_percentile))
+
+    async def call(
+        self,
+        send: Callable[[], Awaitable[httpx.Response]],
+        reserve_hedge: Optional[HedgeReserver] = None,
+    ) -> httpx.Response:
+        """
+        Run send() with hedging and retries
+        A hedge is only sent when reserve_hedge() grants it capacity (without
+        reserve_hedge the call is never hedged). Returns the first non-retryable response (or the last one when retries
+        are exhausted); raises the last error, or httpx.TimeoutException when
+        the deadline passes.
+        """
+        self.calls += 1
+        try:
+            return await asyncio.wait_for(self._call_with_retries(send, reserve_hedge), self.deadline)
+        except asyncio.TimeoutError:
+            self.deadline_exceeded += 1
+            raise httpx.TimeoutException(f"Upstream deadline of {self.deadline:g}s exceeded")
+
+    async def _call_with_retries(self, send, reserve_hedge) -> httpx.Response:
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            outcome = await self._hedged_attempt(send, reserve_hedge)
+            if not is_retryable(outcome) or attempt >= self.max_retries:
+                break
+            # Full jitter; never sleep past the deadline
+            attempt += 1
+            self.retries += 1
+            delay = random.uniform(0, self.retry_backoff * (2 ** (attempt - 1)))
+            remaining = self.deadline - (time.monotonic() - started)
+            await asyncio.sleep(max(0.0, min(delay, remaining)))
+
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    async def _hedged_attempt(self, send, reserve_hedge=None):
+        """One attempt, possibly hedged; returns a response or an exception"""
+        started = time.monotonic()
+        tasks = [asyncio.ensure_future(send())]
+        hedged = False
+        try:
+            delay = self.hedge_delay() if reserve_hedge is not None else None
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    release = reserve_hedge()
+                    if release is None:
+                        # No free slot or model budget: wait for the first request alone
+                        self.hedges_skipped += 1
+                    else:
+                        self.hedges += 1
+                        hedged = True
+                        tasks.append(asyncio.ensure_future(self._send_hedge(send, release)))
+
+            outcome = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.exception() or task.result()
+                    if outcome is None or is_retryable(outcome):
+                        outcome = result
+                        winner = task
+                if not is_retryable(outcome):
+                    # First good answer wins; the other request is cancelled below
+                    break
+
+            if hedged and winner is tasks[1]:
+                self.hedge_wins += 1
+            if isinstance(outcome, httpx.Response) and outcome.status_code < 500:
+                self.latencies.add(time.monotonic() - started)
+            return outcome
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    async def _send_hedge(send, release):
+        try:
+            return await send()
+        finally:
+            release()
+
+    def stats(self) -> dict:
+        p = self.latencies.percentile(self.hedge_percentile)
+        return {
+            "hedging": self.hedge,
+            "hedge_delay_seconds": round(self.hedge_delay() or 0.0, 3) if self.hedge else None,
+            "latency_percentile_seconds": round(p, 3) if p is not None else None,
+            "calls": self.calls,
+            "hedges": self.hedges,
+            "hedges_skipped": self.hedges_skipped,
+            "hedge_wins": self.hedge_wins,
+            "retries": self.retries,
+            "deadline_exceeded": self.deadline_exceeded,
+        }
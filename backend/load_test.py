@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Async load generator for the Chatbox backend
+Reports throughput (RPS) and p50/p95/p99 latency for /chat and
+/blood-pressure/analyze at a fixed concurrency.
+
+With --spawn it starts the mock Qwen API, the stub SMTP server and the
+backend as subprocesses, so the whole run is offline and reproducible:
+
+    python load_test.py --spawn --concurrency 50 --requests 500
+
+Results can be saved and compared against a previous run to catch regressions:
+
+    python load_test.py --spawn --save baseline.json
+    python load_test.py --spawn --compare baseline.json --tolerance 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def chat_payload(i: int, unique: bool) -> dict:
+    suffix = f" #{i}" if unique else ""
+    return {"message": f"你好，请介绍一下血压的正常范围{suffix}"}
+
+
+def analyze_payload(i: int, unique: bool) -> dict:
+    # Elevated readings so the request is escalated to the LLM tier
+    now = time.time()
+    records = [
+        {
+            "systolic": 150 + (k % 5),
+            "diastolic": 95,
+            "heart_rate": 72,
+            "timestamp": now - k * 3600,
+        }
+        for k in range(20)
+    ]
+    if unique:
+        # Notes of the latest reading are part of the prompt, so each request misses the cache
+        records[0]["notes"] = f"bench #{i}"
+    return {"records": records, "email": "family@example.com"}
+
+
+SCENARIOS = {
+    "chat": ("/chat", chat_payload),
+    "analyze": ("/blood-pressure/analyze", analyze_payload),
+}
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, total: int,
+                       concurrency: int, unique: bool) -> dict:
+    path, make_payload = SCENARIOS[name]
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                response = await client.post(path, json=make_payload(i, unique))
+                key = None if response.status_code == 200 else str(response.status_code)
+            except httpx.HTTPError as e:
+                key = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            if key is not None:
+                errors[key] = errors.get(key, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "rps": round(total / duration, 2) if duration else 0.0,
+        "mean_ms": round(1000 * sum(latencies) / len(latencies), 1) if latencies else 0.0,
+        "p50_ms": round(1000 * percentile(latencies, 50), 1),
+        "p95_ms": round(1000 * percentile(latencies, 95), 1),
+        "p99_ms": round(1000 * percentile(latencies, 99), 1),
+        "max_ms": round(1000 * latencies[-1], 1) if latencies else 0.0,
+    }
+
+
+def print_results(results: dict):
+    print(f"{'scenario':<10} {'reqs':>6} {'errors':>7} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for name, r in results.items():
+        print(
+            f"{name:<10} {r['requests']:>6} {sum(r['errors'].values()):>7} {r['rps']:>8.1f} "
+            f"{r['p50_ms']:>7.1f}ms {r['p95_ms']:>7.1f}ms {r['p99_ms']:>7.1f}ms {r['max_ms']:>7.1f}ms"
+        )
+
+
+def compare_results(results: dict, baseline: dict, tolerance: float) -> bool:
+    """True when no scenario is slower than the baseline beyond the tolerance"""
+    ok = True
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if r["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            print(f"❌ {name}: p95 {r['p95_ms']}ms vs baseline {base['p95_ms']}ms")
+            ok = False
+        if r["rps"] < base["rps"] * (1 - tolerance):
+            print(f"❌ {name}: {r['rps']} RPS vs baseline {base['rps']} RPS")
+            ok = False
+    if ok:
+        print(f"✅ No regression beyond {tolerance:.0%} of the baseline")
+    return ok
+
+
+def spawn_stack(args) -> List[subprocess.Popen]:
+    """Start mock Qwen, stub SMTP and the backend as subprocesses"""
+    workdir = tempfile.mkdtemp(prefix="chatbox-bench-")
+    env = dict(
+        os.environ,
+        DASHSCOPE_API_KEY="mock-key",
+        QWEN_BASE_URL=f"http://127.0.0.1:{args.qwen_port}/v1",
+        SMTP_SERVER="127.0.0.1",
+        SMTP_PORT=str(args.smtp_port),
+        SMTP_STARTTLS="false",
+        EMAIL_USER="bench@example.com",
+        EMAIL_PASSWORD="bench",
+        READING_STORE_PATH=os.path.join(workdir, "readings.db"),
+        AGGREGATES_SNAPSHOT_PATH=os.path.join(workdir, "aggregates.json"),
+    )
+    commands = [
+        [sys.executable, "mock_qwen_server.py", "--port", str(args.qwen_port),
+         "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+         "--error-rate", str(args.error_rate)],
+        [sys.executable, "stub_smtp_server.py", "--port", str(args.smtp_port),
+         "--latency-ms", str(args.smtp_latency_ms)],
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(args.port), "--log-level", "warning"],
+    ]
+    return [
+        subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL)
+        for cmd in commands
+    ]
+
+
+async def wait_until_ready(base_url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url, timeout=2.0) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Backend at {base_url} did not become ready within {timeout:.0f}s")
+
+
+async def main(args) -> int:
+    base_url = args.base_url or f"http://127.0.0.1:{args.port}"
+    await wait_until_ready(base_url)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results = {}
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        for name in args.scenario:
+            print(f"⚡ Running {name}: {args.requests} requests at concurrency {args.concurrency}...")
+            results[name] = await run_scenario(client, name, args.requests, args.concurrency, not args.repeat)
+
+    print()
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print()
+        return 0 if compare_results(results, baseline, args.tolerance) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chatbox backend load test")
+    parser.add_argument("--base-url", help="backend to test (default http://127.0.0.1:PORT)")
+    parser.add_argument("--port", type=int, default=8100, help="backend port (used with --spawn)")
+    parser.add_argument("--scenario", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--repeat", action="store_true",
+                        help="send identical payloads (exercises caching/coalescing)")
+    parser.add_argument("--save", help="write results as JSON")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression ratio")
+
+    spawn = parser.add_argument_group("offline stack (--spawn)")
+    spawn.add_argument("--spawn", action="store_true", help="start mock Qwen, stub SMTP and the backend")
+    spawn.add_argument("--qwen-port", type=int, default=9100)
+    spawn.add_argument("--smtp-port", type=int, default=2525)
+    spawn.add_argument("--latency-ms", type=float, default=800.0, help="mock Qwen mean latency")
+    spawn.add_argument("--jitter-ms", type=float, default=200.0, help="mock Qwen latency std deviation")
+    spawn.add_argument("--error-rate", type=float, default=0.0, help="mock Qwen 503 share")
+    spawn.add_argument("--smtp-latency-ms", type=float, default=50.0, help="stub SMTP per-command delay")
+    args = parser.parse_args()
+
+    processes = spawn_stack(args) if args.spawn else []
+    try:
+        exit_code = asyncio.run(main(args))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+    sys.exit(exit_code)
@@ -1,24 +1,327 @@
-from fastapi import FastAPI, HTTPException
+from startup import StartupTracker  # first, so startup times include the imports below
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from starlette.background import BackgroundTask
 import httpx
+import numpy as np
 import os
 from dotenv import load_dotenv
 import json
+import time
+import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from typing import List, Optional
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+
+from admission import UPSTREAM_ENDPOINT, AdmissionController, AdmissionRejected, parse_endpoint_limits
+from analysis_cache import TTLCache, make_cache_key
+from auth import AdminAuth, UserTokens
+from bp_stats import BPStats, PreparedRecords, alert_level as compute_alert_level
+from chat_sessions import ChatSession, SessionStore
+from circuit_breaker import CircuitBreaker, CircuitOpen
+from compression import CompressionMiddleware, InvalidContentEncoding, decode_request_body
+from email_outbox import EmailOutbox
+from hedging import HedgedCaller
+from metrics import (
+    REGISTRY, REQUEST_START, STAGE_DURATION, UPSTREAM_RESPONSES, MetricsMiddleware, stage_timer
+)
+from model_router import ModelRouter, prompt_chars
+from qwen_client import QwenClient
+from rate_limit import RateLimiter, parse_trusted_proxies
+from record_codec import (
+    BodyTooLarge, FastJSONResponse, RecordColumns, RecordError, decode_analysis_payload,
+    decode_columnar_payload, is_columnar, is_ndjson, loads as loads_json, read_body, read_ndjson
+)
+from reading_store import ReadingStore
+from recommendations import RecommendationExtractor, extract_recommendations
+from rolling_aggregates import MAX_WINDOW_DAYS, RollingAggregates, UserAggregates, window_start
+from singleflight import SingleFlight
+from state_backend import MemoryBackend, create_backend
+from tiered_analysis import (
+    LEVEL_ASSESSMENTS, TIER_FALLBACK, TIER_LLM, TIER_RULE, fallback_analysis, is_routine,
+    rule_based_analysis
+)
 
 
 env_path = os.path.join(os.path.dirname(__file__), ".env")
-print(env_path)
 # Load environment variables
 load_dotenv(dotenv_path= env_path)
 
 
-app = FastAPI(title="Chatbox API", version="1.0.0")
+# Qwen API configuration
+QWEN_API_KEY = os.getenv("DASHSCOPE_API_KEY")
+QWEN_BASE_URL = os.getenv("QWEN_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
+
+# Upstream connection pool configuration
+QWEN_TIMEOUT = float(os.getenv("QWEN_TIMEOUT", "30"))
+QWEN_MAX_CONNECTIONS = int(os.getenv("QWEN_MAX_CONNECTIONS", "100"))
+QWEN_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("QWEN_MAX_KEEPALIVE_CONNECTIONS", "20"))
+QWEN_KEEPALIVE_EXPIRY = float(os.getenv("QWEN_KEEPALIVE_EXPIRY", "30"))
+QWEN_HTTP2 = os.getenv("QWEN_HTTP2", "false").lower() in ("1", "true", "yes")
+# Connections opened during startup so the first requests skip the TLS handshake (0 disables)
+QWEN_PREWARM_CONNECTIONS = int(os.getenv("QWEN_PREWARM_CONNECTIONS", "2"))
+QWEN_PREWARM_TIMEOUT = float(os.getenv("QWEN_PREWARM_TIMEOUT", "5"))
+
+# Upstream admission control (QWEN_MAX_CONCURRENT=0 disables it)
+QWEN_MAX_CONCURRENT = int(os.getenv("QWEN_MAX_CONCURRENT", "20"))
+QWEN_QUEUE_SIZE = int(os.getenv("QWEN_QUEUE_SIZE", "100"))
+QWEN_QUEUE_TIMEOUT = float(os.getenv("QWEN_QUEUE_TIMEOUT", "5"))
+QWEN_ENDPOINT_LIMITS = parse_endpoint_limits(os.getenv("QWEN_ENDPOINT_LIMITS", "chat_stream=10,batch=10"))
+
+# Hedged requests and retries for /chat and analysis calls
+QWEN_HEDGE = os.getenv("QWEN_HEDGE", "false").lower() in ("1", "true", "yes")
+QWEN_HEDGE_PERCENTILE = float(os.getenv("QWEN_HEDGE_PERCENTILE", "95"))
+QWEN_HEDGE_MIN_DELAY = float(os.getenv("QWEN_HEDGE_MIN_DELAY", "0.5"))
+QWEN_HEDGE_MAX_RATIO = float(os.getenv("QWEN_HEDGE_MAX_RATIO", "0.1"))
+QWEN_MAX_RETRIES = int(os.getenv("QWEN_MAX_RETRIES", "2"))
+QWEN_RETRY_BACKOFF = float(os.getenv("QWEN_RETRY_BACKOFF", "0.5"))
+QWEN_DEADLINE = float(os.getenv("QWEN_DEADLINE", "45"))
+
+# Model routing: QWEN_MODELS lists models fastest first; routine chat uses the
+# first, long prompts and high/critical analyses prefer stronger ones
+QWEN_MODELS = [m.strip() for m in os.getenv("QWEN_MODELS", "qwen-turbo,qwen-plus,qwen-max").split(",") if m.strip()]
+QWEN_MODEL_BUDGETS = parse_endpoint_limits(os.getenv("QWEN_MODEL_BUDGETS", "qwen-plus=10,qwen-max=4"))
+QWEN_ROUTE_LONG_PROMPT = int(os.getenv("QWEN_ROUTE_LONG_PROMPT", "1500"))
+QWEN_ROUTE_MAX_LATENCY = float(os.getenv("QWEN_ROUTE_MAX_LATENCY", "20"))
+
+# Upstream circuit breaker (QWEN_BREAKER_FAILURES=0 disables it)
+QWEN_BREAKER_FAILURES = int(os.getenv("QWEN_BREAKER_FAILURES", "5"))
+QWEN_BREAKER_SLOW_SECONDS = float(os.getenv("QWEN_BREAKER_SLOW_SECONDS", "10"))
+QWEN_BREAKER_SLOW_RATIO = float(os.getenv("QWEN_BREAKER_SLOW_RATIO", "0.5"))
+QWEN_BREAKER_WINDOW = int(os.getenv("QWEN_BREAKER_WINDOW", "20"))
+QWEN_BREAKER_OPEN_SECONDS = float(os.getenv("QWEN_BREAKER_OPEN_SECONDS", "30"))
+QWEN_BREAKER_HALF_OPEN_PROBES = int(os.getenv("QWEN_BREAKER_HALF_OPEN_PROBES", "1"))
+
+# Email configuration
+SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes")
+EMAIL_USER = os.getenv("EMAIL_USER")
+EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
+
+# Email outbox configuration
+EMAIL_WORKERS = int(os.getenv("EMAIL_WORKERS", "2"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "4"))
+EMAIL_BACKOFF_BASE = float(os.getenv("EMAIL_BACKOFF_BASE", "2"))
+EMAIL_BACKOFF_MAX = float(os.getenv("EMAIL_BACKOFF_MAX", "60"))
+EMAIL_QUEUE_SIZE = int(os.getenv("EMAIL_QUEUE_SIZE", "1000"))
+# Follow-up alerts within this many seconds of an email go out as one digest (0 suppresses them)
+EMAIL_DIGEST_WINDOW = float(os.getenv("EMAIL_DIGEST_WINDOW", "120"))
+# After an alert email, same-or-lower level alerts are not emailed for this long (0 disables)
+EMAIL_ALERT_COOLDOWN = float(os.getenv("EMAIL_ALERT_COOLDOWN", "3600"))
+
+# Analysis mode: "tiered" answers stable normal readings with rules and only
+# escalates to Qwen when needed, "llm" always calls Qwen
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "tiered").lower()
+
+# Batch analysis configuration
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+
+# Server-side reading store
+READING_STORE_PATH = os.getenv("READING_STORE_PATH", os.path.join(os.path.dirname(__file__), "readings.db"))
+STORED_ANALYSIS_DAYS = int(os.getenv("STORED_ANALYSIS_DAYS", "30"))
+STORED_ANALYSIS_MAX_READINGS = int(os.getenv("STORED_ANALYSIS_MAX_READINGS", "10000"))
+
+# Reading uploads (JSON, columnar JSON, NDJSON): hard cap on the body size
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(32 * 1024 * 1024)))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "1000"))
+
+# Negotiated gzip/brotli response compression for bodies of at least COMPRESSION_MIN_BYTES
+RESPONSE_COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "true").lower() in ("1", "true", "yes")
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "512"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "5"))
+
+# Rolling per-user aggregates (kept in memory, snapshotted periodically)
+AGGREGATES_SNAPSHOT_PATH = os.getenv("AGGREGATES_SNAPSHOT_PATH", os.path.join(os.path.dirname(__file__), "aggregates.json"))
+AGGREGATES_SNAPSHOT_INTERVAL = float(os.getenv("AGGREGATES_SNAPSHOT_INTERVAL", "60"))
+
+# State shared by the uvicorn workers: analysis cache, chat sessions, rate limits
+# memory (per process), sqlite:///path.db (one host) or redis://host:6379/0
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+# Requests per client per minute on the Qwen-backed endpoints (0 disables the limit)
+RATE_LIMIT_PER_MINUTE = int(os.getenv("RATE_LIMIT_PER_MINUTE", "0"))
+# Reverse proxies (IPs or CIDRs) whose X-Forwarded-For is believed; empty: key on the peer address
+TRUSTED_PROXIES = parse_trusted_proxies(os.getenv("TRUSTED_PROXIES", ""))
+# Bearer token for operator endpoints (DELETE /blood-pressure/analyze/cache); empty disables them
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# Signs the user tokens of the /blood-pressure/users/{user_id}/ endpoints; same value on every worker
+USER_TOKEN_SECRET = os.getenv("USER_TOKEN_SECRET", "")
+USER_TOKEN_TTL = float(os.getenv("USER_TOKEN_TTL", str(30 * 86400)))
+
+# Analysis cache configuration (ANALYSIS_CACHE_SIZE=0 disables it)
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "512"))
+ANALYSIS_CACHE_TTL = float(os.getenv("ANALYSIS_CACHE_TTL", "600"))
+# Expired analyses are still served for this long while the upstream circuit is open
+ANALYSIS_CACHE_STALE_TTL = float(os.getenv("ANALYSIS_CACHE_STALE_TTL", "3600"))
+
+# Server-side chat sessions (sliding context window + summary, LRU under a memory cap)
+CHAT_SESSION_MAX = int(os.getenv("CHAT_SESSION_MAX", "10000"))
+CHAT_SESSION_MEMORY_MB = float(os.getenv("CHAT_SESSION_MEMORY_MB", "64"))
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "1200"))
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "300"))
+# Idle time before a session expires from a shared STATE_BACKEND
+CHAT_SESSION_TTL = float(os.getenv("CHAT_SESSION_TTL", "86400"))
+# Key that signs session ids; must be the same on every worker sharing STATE_BACKEND
+CHAT_SESSION_SECRET = os.getenv("CHAT_SESSION_SECRET", "")
+# Deprecation window: also accept the UUIDs older app builds generate themselves
+CHAT_LEGACY_SESSION_IDS = os.getenv("CHAT_LEGACY_SESSION_IDS", "true").lower() in ("1", "true", "yes")
+
+# Reply of /chat and /chat/stream while the upstream circuit is open
+CHAT_UNAVAILABLE_REPLY = "抱歉，AI助手暂时不可用，请稍后再试。"
+
+if not QWEN_API_KEY:
+    raise ValueError("DASHSCOPE_API_KEY environment variable is required")
+
+# One pooled client shared by every Qwen call
+qwen_client = QwenClient(
+    api_key=QWEN_API_KEY,
+    base_url=QWEN_BASE_URL,
+    timeout=QWEN_TIMEOUT,
+    max_connections=QWEN_MAX_CONNECTIONS,
+    max_keepalive_connections=QWEN_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=QWEN_KEEPALIVE_EXPIRY,
+    http2=QWEN_HTTP2,
+)
+
+# Bounds concurrent Qwen calls; excess load is queued briefly, then shed
+upstream_admission = AdmissionController(
+    max_concurrent=QWEN_MAX_CONCURRENT,
+    max_queue=QWEN_QUEUE_SIZE,
+    queue_timeout=QWEN_QUEUE_TIMEOUT,
+    endpoint_limits=QWEN_ENDPOINT_LIMITS,
+)
+
+# Slow calls are hedged past a latency percentile, 5xx/resets retried within a deadline
+upstream_hedger = HedgedCaller(
+    hedge=QWEN_HEDGE,
+    hedge_percentile=QWEN_HEDGE_PERCENTILE,
+    hedge_min_delay=QWEN_HEDGE_MIN_DELAY,
+    hedge_max_ratio=QWEN_HEDGE_MAX_RATIO,
+    max_retries=QWEN_MAX_RETRIES,
+    retry_backoff=QWEN_RETRY_BACKOFF,
+    deadline=QWEN_DEADLINE,
+)
+
+# Picks the model per call from prompt length, severity, moving latency and budgets
+model_router = ModelRouter(
+    QWEN_MODELS,
+    budgets=QWEN_MODEL_BUDGETS,
+    long_prompt_chars=QWEN_ROUTE_LONG_PROMPT,
+    max_latency=QWEN_ROUTE_MAX_LATENCY,
+)
+
+# Fails upstream calls fast while dashscope is down or degraded
+upstream_breaker = CircuitBreaker(
+    failure_threshold=QWEN_BREAKER_FAILURES,
+    slow_call_seconds=QWEN_BREAKER_SLOW_SECONDS,
+    slow_call_ratio=QWEN_BREAKER_SLOW_RATIO,
+    window=QWEN_BREAKER_WINDOW,
+    open_seconds=QWEN_BREAKER_OPEN_SECONDS,
+    half_open_probes=QWEN_BREAKER_HALF_OPEN_PROBES,
+)
+
+# Alert emails are delivered in the background so SMTP never blocks the event loop
+email_outbox = EmailOutbox(
+    smtp_server=SMTP_SERVER,
+    smtp_port=SMTP_PORT,
+    starttls=SMTP_STARTTLS,
+    email_user=EMAIL_USER,
+    email_password=EMAIL_PASSWORD,
+    workers=EMAIL_WORKERS,
+    max_attempts=EMAIL_MAX_ATTEMPTS,
+    backoff_base=EMAIL_BACKOFF_BASE,
+    backoff_max=EMAIL_BACKOFF_MAX,
+    max_queue_size=EMAIL_QUEUE_SIZE,
+    digest_window=EMAIL_DIGEST_WINDOW,
+    alert_cooldown=EMAIL_ALERT_COOLDOWN,
+    # The email text is defined with queue_alert_email below
+    compose_digest=lambda alerts, suppressed: compose_alert_email(alerts, suppressed),
+)
+
+# Per-user reading history, so clients only upload new readings
+reading_store = ReadingStore(READING_STORE_PATH)
+rolling_aggregates = RollingAggregates(AGGREGATES_SNAPSHOT_PATH, AGGREGATES_SNAPSHOT_INTERVAL)
+
+# Identical concurrent Qwen requests share one upstream call
+upstream_flight = SingleFlight()
+
+# Key/value store for state that should be shared by every worker
+state_backend = create_backend(STATE_BACKEND, memory_max_entries=100000)
+# In memory mode the cache and sessions keep their own bounded LRUs
+shared_state = None if isinstance(state_backend, MemoryBackend) else state_backend
+
+# Identical analysis requests are served from the cache instead of calling Qwen again
+analysis_cache = TTLCache(
+    max_size=ANALYSIS_CACHE_SIZE,
+    ttl=ANALYSIS_CACHE_TTL,
+    stale_ttl=ANALYSIS_CACHE_STALE_TTL,
+    backend=shared_state,
+)
+
+# Conversation history kept on the server, so clients send only the new message
+chat_sessions = SessionStore(
+    max_sessions=CHAT_SESSION_MAX,
+    max_bytes=int(CHAT_SESSION_MEMORY_MB * 1024 * 1024),
+    context_tokens=CHAT_CONTEXT_TOKENS,
+    summary_tokens=CHAT_SUMMARY_TOKENS,
+    backend=shared_state,
+    session_ttl=CHAT_SESSION_TTL,
+    secret=CHAT_SESSION_SECRET.encode("utf-8") or None,
+    legacy_ids=CHAT_LEGACY_SESSION_IDS,
+)
+if not CHAT_SESSION_SECRET and shared_state is not None:
+    print("CHAT_SESSION_SECRET is not set: chat session ids will only be valid on the worker that issued them")
+summary_tasks = set()
+
+# Per-client request budget on the endpoints that call Qwen
+rate_limiter = RateLimiter(state_backend, limit=RATE_LIMIT_PER_MINUTE, trusted_proxies=TRUSTED_PROXIES)
+admin_auth = AdminAuth(ADMIN_TOKEN)
+# Per-user endpoints take the user id from a signed bearer token
+user_tokens = UserTokens(USER_TOKEN_SECRET.encode("utf-8") or None, ttl=USER_TOKEN_TTL)
+if not USER_TOKEN_SECRET and admin_auth.enabled:
+    print("USER_TOKEN_SECRET is not set: user tokens will only be valid on the worker that issued them")
+
+# Startup phases and readiness (/ready); / stays a plain liveness check
+startup = StartupTracker()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup.mark("lifespan")
+    await qwen_client.start()
+    await email_outbox.start()
+    await reading_store.open()
+    await state_backend.open()
+    await rolling_aggregates.start()
+    startup.mark("components")
+    # Serve liveness right away; /ready turns 200 once the pool is warm
+    prewarm_task = asyncio.create_task(prewarm_upstream())
+    try:
+        yield
+    finally:
+        prewarm_task.cancel()
+        for task in summary_tasks:
+            task.cancel()
+        await rolling_aggregates.stop()
+        await state_backend.close()
+        await reading_store.close()
+        await email_outbox.stop()
+        await qwen_client.close()
+
+async def prewarm_upstream():
+    """Open upstream connections ahead of the first request, then report ready"""
+    result = None
+    connections = min(QWEN_PREWARM_CONNECTIONS, QWEN_MAX_KEEPALIVE_CONNECTIONS)
+    if connections > 0:
+        result = await qwen_client.prewarm(connections, QWEN_PREWARM_TIMEOUT)
+        print(f"Upstream prewarm: {result}")
+    startup.mark_ready(result)
+
+app = FastAPI(title="Chatbox API", version="1.0.0", lifespan=lifespan)
 
 # CORS configuration for Android app
 app.add_middleware(
@@ -29,12 +332,36 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip/brotli for long analyses and NDJSON batches (inside metrics, so latency includes it)
+if RESPONSE_COMPRESSION:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=COMPRESSION_MIN_BYTES,
+        gzip_level=COMPRESSION_GZIP_LEVEL,
+        brotli_quality=COMPRESSION_BROTLI_QUALITY,
+    )
+
+# Request counts, latency and in-flight gauge for /metrics
+app.add_middleware(MetricsMiddleware)
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request, exc: AdmissionRejected):
+    """Shed load fast: 429 (endpoint limit) / 503 (queue full) with Retry-After"""
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 # Request/Response models
 class ChatRequest(BaseModel):
     message: str
+    session_id: Optional[str] = Field(None, max_length=128)  # multi-turn when set
 
 class ChatResponse(BaseModel):
     reply: str
+    degraded: bool = False  # True when the reply is the "unavailable" notice
+    session_id: Optional[str] = None
 
 class BloodPressureRecord(BaseModel):
     systolic: int
@@ -52,74 +379,264 @@ class BloodPressureAnalysisResponse(BaseModel):
     recommendations: List[str]
     alert_level: str
     email_sent: bool = False
+    email_queued: bool = False
+    email_outbox_id: Optional[str] = None
+    analysis_tier: str = TIER_LLM
 
-# Qwen API configuration
-QWEN_API_KEY = os.getenv("DASHSCOPE_API_KEY")
-QWEN_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+class ReadingIngestRequest(BaseModel):
+    records: List[BloodPressureRecord]
 
-# Email configuration
-SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
-SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
-EMAIL_USER = os.getenv("EMAIL_USER")
-EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
+class ReadingIngestResponse(BaseModel):
+    received: int
+    inserted: int
+    duplicates: int
+    total: int
 
-if not QWEN_API_KEY:
-    raise ValueError("DASHSCOPE_API_KEY environment variable is required")
+class StoredAnalysisRequest(BaseModel):
+    since: Optional[float] = None
+    until: Optional[float] = None
+    days: Optional[int] = None  # window length when since is not given
+    email: Optional[str] = None
+
+class BloodPressureBatchRequest(BaseModel):
+    items: List[BloodPressureAnalysisRequest]
+
+class BloodPressureBatchItemResult(BaseModel):
+    index: int
+    status_code: int = 200
+    result: Optional[BloodPressureAnalysisResponse] = None
+    error: Optional[str] = None
+
+class BloodPressureBatchResponse(BaseModel):
+    results: List[BloodPressureBatchItemResult]
+    succeeded: int
+    failed: int
 
 @app.get("/")
 async def root():
     return {"message": "Chatbox API is running"}
 
-@app.post("/chat", response_model=ChatResponse)
+@app.get("/ready")
+async def ready():
+    """Readiness: 503 until the lifespan has started everything and prewarmed the upstream pool"""
+    status_code = 200 if startup.ready else 503
+    return JSONResponse(status_code=status_code, content=startup.stats())
+
+@app.get("/stats")
+async def stats():
+    """Runtime statistics (upstream pool, admission and single-flight, email outbox, analysis cache, shared state)"""
+    return {
+        "upstream_pool": qwen_client.pool_stats(),
+        "upstream_admission": upstream_admission.stats(),
+        "upstream_hedging": upstream_hedger.stats(),
+        "upstream_breaker": upstream_breaker.stats(),
+        "upstream_models": model_router.stats(),
+        "chat_sessions": chat_sessions.stats(),
+        "startup": startup.stats(),
+        "upstream_singleflight": upstream_flight.stats(),
+        "email_outbox": email_outbox.stats(),
+        "analysis_cache": analysis_cache.stats(),
+        "state_backend": state_backend.stats(),
+        "rate_limit": rate_limiter.stats(),
+        "admin_auth": admin_auth.stats(),
+        "user_tokens": user_tokens.stats(),
+        "rolling_aggregates": rolling_aggregates.stats(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics (text exposition format)"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+def collect_runtime_metrics():
+    """Expose the component stats shown in /stats as Prometheus gauges/counters"""
+    pool = qwen_client.pool_stats()
+    flight = upstream_flight.stats()
+    admission = upstream_admission.stats()
+    hedging = upstream_hedger.stats()
+    breaker = upstream_breaker.stats()
+    models = model_router.stats()
+    sessions = chat_sessions.stats()
+    cache = analysis_cache.stats()
+    limits = rate_limiter.stats()
+    outbox = email_outbox.stats()
+    yield "chatbox_ready", "gauge", "1 once startup and the upstream prewarm finished", [({}, int(startup.ready))]
+    yield "chatbox_startup_seconds", "gauge", "Seconds from import to each startup phase (incl. first_chat)", [
+        ({"phase": phase}, seconds) for phase, seconds in startup.phases.items()
+    ]
+    yield "chatbox_upstream_connections", "gauge", "Open upstream connections", [({}, pool["connections"])]
+    yield "chatbox_upstream_idle_connections", "gauge", "Idle upstream connections", [({}, pool["idle_connections"])]
+    yield "chatbox_upstream_in_flight", "gauge", "Upstream requests in flight", [({}, pool["in_flight"])]
+    yield "chatbox_upstream_requests_total", "counter", "Upstream requests sent", [({}, pool["total_requests"])]
+    yield "chatbox_upstream_admitted_in_flight", "gauge", "Upstream slots held", [({}, admission["in_flight"])]
+    yield "chatbox_upstream_admission_queued", "gauge", "Requests waiting for an upstream slot", [({}, admission["queued"])]
+    yield "chatbox_upstream_admission_rejected_total", "counter", "Upstream calls shed by admission control", [
+        ({"reason": reason}, count) for reason, count in admission["rejected"].items()
+    ]
+    yield "chatbox_upstream_hedges_total", "counter", "Hedge requests sent", [({}, hedging["hedges"])]
+    yield "chatbox_upstream_hedges_skipped_total", "counter", "Hedges skipped for lack of a free slot or model budget", [({}, hedging["hedges_skipped"])]
+    yield "chatbox_upstream_hedge_wins_total", "counter", "Hedge requests that answered first", [({}, hedging["hedge_wins"])]
+    yield "chatbox_upstream_retries_total", "counter", "Upstream retries after 5xx or connection errors", [({}, hedging["retries"])]
+    yield "chatbox_upstream_deadline_exceeded_total", "counter", "Upstream calls that hit QWEN_DEADLINE", [({}, hedging["deadline_exceeded"])]
+    yield "chatbox_upstream_circuit_state", "gauge", "Upstream circuit state (0 closed, 1 half-open, 2 open)", [
+        ({}, {"closed": 0, "half_open": 1, "open": 2}[breaker["state"]])
+    ]
+    yield "chatbox_upstream_circuit_opened_total", "counter", "Times the upstream circuit opened", [({}, breaker["opened"])]
+    yield "chatbox_upstream_circuit_rejected_total", "counter", "Calls rejected by the open circuit", [({}, breaker["rejected"])]
+    yield "chatbox_model_in_flight", "gauge", "Upstream calls in flight per model", [
+        ({"model": name}, m["in_flight"]) for name, m in models.items()
+    ]
+    yield "chatbox_model_latency_seconds", "gauge", "Moving average upstream latency per model", [
+        ({"model": name}, m["latency_seconds"]) for name, m in models.items() if m["latency_seconds"] is not None
+    ]
+    yield "chatbox_model_routed_total", "counter", "Upstream calls routed per model", [
+        ({"model": name}, m["routed"]) for name, m in models.items()
+    ]
+    yield "chatbox_chat_sessions", "gauge", "Chat sessions in memory", [({}, sessions["sessions"])]
+    yield "chatbox_chat_sessions_bytes", "gauge", "Approximate memory held by chat sessions", [({}, sessions["bytes"])]
+    yield "chatbox_chat_sessions_evicted_total", "counter", "Chat sessions evicted by the LRU", [({}, sessions["evicted"])]
+    yield "chatbox_singleflight_calls_total", "counter", "Upstream calls started by single-flight", [({}, flight["calls"])]
+    yield "chatbox_singleflight_shared_total", "counter", "Requests that joined an in-flight call", [({}, flight["shared"])]
+    # Size and evictions are unknown (None) for a shared backend
+    if cache["size"] is not None:
+        yield "chatbox_analysis_cache_size", "gauge", "Entries in the analysis cache", [({}, cache["size"])]
+        yield "chatbox_analysis_cache_evictions_total", "counter", "Analysis cache evictions", [({}, cache["evictions"])]
+    yield "chatbox_analysis_cache_hits_total", "counter", "Analysis cache hits", [({}, cache["hits"])]
+    yield "chatbox_analysis_cache_misses_total", "counter", "Analysis cache misses", [({}, cache["misses"])]
+    yield "chatbox_state_backend_errors_total", "counter", "Shared state operations that failed (treated as misses)", [
+        ({"user": "analysis_cache"}, cache["errors"]),
+        ({"user": "chat_sessions"}, sessions["backend_errors"]),
+        ({"user": "rate_limit"}, limits["errors"]),
+    ]
+    yield "chatbox_rate_limited_total", "counter", "Requests rejected by RATE_LIMIT_PER_MINUTE", [({}, limits["rejected"])]
+    yield "chatbox_email_outbox_queued", "gauge", "Alert emails waiting in the outbox", [({}, outbox["queued"])]
+    yield "chatbox_email_outbox_total", "counter", "Alert email outcomes", [
+        ({"result": "sent"}, outbox["sent"]),
+        ({"result": "failed"}, outbox["failed"]),
+        ({"result": "retried"}, outbox["retried"]),
+    ]
+    yield "chatbox_email_alerts_total", "counter", "Alerts by outcome (digests merge several, the cooldown suppresses repeats)", [
+        ({"result": "coalesced"}, outbox["coalesced"]),
+        ({"result": "suppressed"}, outbox["suppressed"]),
+        ({"result": "escalated"}, outbox["escalations"]),
+    ]
+
+REGISTRY.add_collector(collect_runtime_metrics)
+
+async def call_qwen(qwen_request: dict, severity: Optional[str] = None) -> dict:
+    """
+    Send a chat completion request to Qwen over the shared pool
+    Concurrent calls with the same canonical payload are coalesced into one.
+    The model is chosen by the router when the call is sent (severity is the
+    alert level of an analysis, None for chat).
+    """
+    return await upstream_flight.do(
+        make_cache_key(qwen_request),
+        lambda: _post_qwen(qwen_request, severity)
+    )
+
+async def _post_qwen(qwen_request: dict, severity: Optional[str] = None) -> dict:
+    probe = upstream_breaker.acquire()
+    try:
+        async with upstream_admission.slot():
+            lease = model_router.acquire(prompt_chars(qwen_request), severity)
+            payload = {**qwen_request, "model": lease.model}
+            started = time.perf_counter()
+            try:
+                with stage_timer("upstream"):
+                    response = await upstream_hedger.call(
+                        lambda: qwen_client.chat_completion(payload),
+                        lambda: reserve_hedge(lease.model),
+                    )
+            except BaseException:
+                lease.release(observe=False)
+                raise
+            lease.release(observe=response.status_code == 200)
+    except httpx.TimeoutException:
+        upstream_breaker.record_failure(probe)
+        UPSTREAM_RESPONSES.inc("timeout")
+        raise
+    except httpx.RequestError:
+        upstream_breaker.record_failure(probe)
+        UPSTREAM_RESPONSES.inc("error")
+        raise
+    except BaseException:
+        upstream_breaker.record_ignored(probe)
+        raise
+    UPSTREAM_RESPONSES.inc(str(response.status_code))
+    record_upstream_outcome(response.status_code, time.perf_counter() - started, probe)
+
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=f"Qwen API error: {response.text}"
+        )
+
+    return response.json()
+
+def reserve_hedge(model: str):
+    """Extra admission slot and model budget for a hedged call; None skips the hedge"""
+    ticket = upstream_admission.try_acquire()
+    if ticket is None:
+        return None
+    lease = model_router.try_acquire(model)
+    if lease is None:
+        ticket.release()
+        return None
+
+    def release():
+        lease.release(observe=False)
+        ticket.release()
+    return release
+
+def record_upstream_outcome(status_code: int, duration: float, probe: bool):
+    """5xx and 429 count as failures for the circuit breaker"""
+    if status_code >= 500 or status_code == 429:
+        upstream_breaker.record_failure(probe)
+    else:
+        upstream_breaker.record_success(duration, probe)
+
+async def load_chat_session(session_id: Optional[str]) -> Optional[ChatSession]:
+    """Session of a /chat request (None when single-turn); 404 for ids the server did not issue"""
+    if not session_id:
+        return None
+    session = await chat_sessions.load(session_id, create=True)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown chat session, create one with POST /chat/sessions")
+    return session
+
+@app.post("/chat", response_model=ChatResponse, dependencies=[Depends(rate_limiter)])
 async def chat(request: ChatRequest):
     """
     Chat endpoint that integrates with Alibaba Cloud Qwen API
     Based on: https://help.aliyun.com/zh/model-studio/use-qwen-by-calling-api
     """
+    UPSTREAM_ENDPOINT.set("chat")
+    session = await load_chat_session(request.session_id)
     try:
         # Prepare the request for Qwen API
-        qwen_request = {
-            "model": "qwen-turbo",  # You can change this to other models like qwen-plus, qwen-max
-            "messages": [
-                {
-                    "role": "user",
-                    "content": request.message
-                }
-            ],
-            "temperature": 0.7,
-            "max_tokens": 1000
-        }
+        qwen_request = build_chat_request(request.message, session)
         
-        headers = {
-            "Authorization": f"Bearer {QWEN_API_KEY}",
-            "Content-Type": "application/json"
-        }
+        result = await call_qwen(qwen_request)
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{QWEN_BASE_URL}/chat/completions",
-                headers=headers,
-                json=qwen_request
+        # Extract the reply from Qwen API response
+        if "choices" in result and len(result["choices"]) > 0:
+            reply = result["choices"][0]["message"]["content"]
+            if session is not None:
+                await record_chat_turn(session, request.message, reply)
+            startup.mark("first_chat")
+            return ChatResponse(reply=reply, session_id=request.session_id)
+        else:
+            raise HTTPException(
+                status_code=500,
+                detail="Invalid response format from Qwen API"
             )
             
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Qwen API error: {response.text}"
-                )
-            
-            result = response.json()
-            
-            # Extract the reply from Qwen API response
-            if "choices" in result and len(result["choices"]) > 0:
-                reply = result["choices"][0]["message"]["content"]
-                return ChatResponse(reply=reply)
-            else:
-                raise HTTPException(
-                    status_code=500,
-                    detail="Invalid response format from Qwen API"
-                )
-                
+    except CircuitOpen:
+        # Answer at once instead of waiting on a failing upstream
+        return ChatResponse(reply=CHAT_UNAVAILABLE_REPLY, degraded=True, session_id=request.session_id)
+    except AdmissionRejected:
+        raise
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Request timeout")
     except httpx.RequestError as e:
@@ -127,49 +644,691 @@ async def chat(request: ChatRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-@app.post("/blood-pressure/analyze", response_model=BloodPressureAnalysisResponse)
-async def analyze_blood_pressure(request: BloodPressureAnalysisRequest):
+@app.post("/chat/stream", dependencies=[Depends(rate_limiter)])
+async def chat_stream(request: ChatRequest):
+    """
+    Streaming chat endpoint (Server-Sent Events)
+    Each event carries {"delta": "..."} as soon as Qwen produces it,
+    the stream ends with "data: [DONE]". /chat keeps the single-response contract.
+    """
+    session = await load_chat_session(request.session_id)
+    qwen_request = build_chat_request(request.message, session)
+
+    try:
+        response, release_slot = await open_qwen_stream(qwen_request, "chat_stream")
+    except CircuitOpen:
+        return sse_response(unavailable_stream())
+
+    async def event_stream():
+        deltas = []
+        try:
+            async for delta in qwen_client.iter_deltas(response):
+                deltas.append(delta)
+                yield sse_event({"delta": delta})
+            if session is not None:
+                await record_chat_turn(session, request.message, "".join(deltas))
+            yield "data: [DONE]\n\n"
+        except httpx.HTTPError as e:
+            yield sse_event({"detail": str(e)}, "error")
+        finally:
+            release_slot()
+
+    return sse_response(event_stream(), response, release_slot)
+
+async def open_qwen_stream(qwen_request: dict, endpoint: str, severity: Optional[str] = None):
+    """
+    Open a streaming Qwen call through the circuit breaker, admission control
+    and model router. Returns (response, release_slot); the slot and model
+    budget are held until release_slot() is called after the stream is relayed.
+    Raises CircuitOpen, AdmissionRejected or HTTPException.
+    """
+    qwen_request = {**qwen_request, "stream": True}
+    probe = upstream_breaker.acquire()
+    try:
+        ticket = await upstream_admission.acquire(endpoint)
+    except BaseException:
+        upstream_breaker.record_ignored(probe)
+        raise
+    lease = model_router.acquire(prompt_chars(qwen_request), severity)
+    qwen_request["model"] = lease.model
+
+    def release_slot():
+        lease.release(observe=False)
+        ticket.release()
+
+    started = time.perf_counter()
+    try:
+        response = await qwen_client.open_stream(qwen_request)
+    except httpx.TimeoutException:
+        release_slot()
+        upstream_breaker.record_failure(probe)
+        UPSTREAM_RESPONSES.inc("timeout")
+        raise HTTPException(status_code=504, detail="Request timeout")
+    except httpx.RequestError as e:
+        release_slot()
+        upstream_breaker.record_failure(probe)
+        UPSTREAM_RESPONSES.inc("error")
+        raise HTTPException(status_code=502, detail=f"Network error: {str(e)}")
+    except BaseException:
+        release_slot()
+        upstream_breaker.record_ignored(probe)
+        raise
+    UPSTREAM_RESPONSES.inc(str(response.status_code))
+    # Time to the response headers is what the breaker judges for streams
+    record_upstream_outcome(response.status_code, time.perf_counter() - started, probe)
+
+    if response.status_code != 200:
+        error_text = (await response.aread()).decode("utf-8", errors="replace")
+        await qwen_client.release_stream(response)
+        release_slot()
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=f"Qwen API error: {error_text}"
+        )
+    return response, release_slot
+
+def sse_response(events, response: Optional[httpx.Response] = None, release_slot=None) -> StreamingResponse:
+    """Server-Sent Events response; the upstream stream is released even if the client left early"""
+    async def release_upstream():
+        await qwen_client.release_stream(response)
+        release_slot()
+
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release_upstream) if response is not None else None
+    )
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def unavailable_stream():
+    """SSE body of /chat/stream while the upstream circuit is open"""
+    yield sse_event({"delta": CHAT_UNAVAILABLE_REPLY, "degraded": True})
+    yield "data: [DONE]\n\n"
+
+def build_chat_request(message: str, session: Optional[ChatSession] = None) -> dict:
+    """Build the Qwen request body for a chat message (with the session context, if any)"""
+    if session is not None:
+        messages = chat_sessions.context_messages(session, message)
+    else:
+        messages = [
+            {
+                "role": "user",
+                "content": message
+            }
+        ]
+    return {
+        "model": model_router.fastest,  # the router picks the model when the call is sent
+        "messages": messages,
+        "temperature": 0.7,
+        "max_tokens": 1000
+    }
+
+async def record_chat_turn(session: ChatSession, message: str, reply: str):
+    """Add an exchange to the session; turns leaving the window are summarized in the background"""
+    if chat_sessions.record_turn(session, message, reply):
+        task = asyncio.ensure_future(summarize_session(session))
+        summary_tasks.add(task)
+        task.add_done_callback(summary_tasks.discard)
+    await chat_sessions.save(session)
+
+async def summarize_session(session: ChatSession):
+    """Fold the turns that left the context window into the session summary"""
+    session.summarizing = True
+    try:
+        while session.pending:
+            folded = list(session.pending)
+            try:
+                summary = await summarize_turns(session.summary, folded)
+            except Exception as e:
+                # Qwen unavailable: keep a trimmed extract instead
+                print(f"Chat summary failed, using extract: {e}")
+                summary = chat_sessions.extractive_summary(session, folded)
+            if chat_sessions.backend is not None:
+                # More turns may have been saved (on any worker) while Qwen was summarizing
+                latest = await chat_sessions.load(session.id)
+                if latest is None:
+                    return
+                session.summarizing = False
+                session = latest
+                session.summarizing = True
+            chat_sessions.apply_summary(session, summary, folded)
+            await chat_sessions.save(session)
+    finally:
+        session.summarizing = False
+
+async def summarize_turns(previous_summary: str, turns: list) -> str:
+    transcript = "\n".join(
+        f"{'用户' if turn.role == 'user' else '助手'}：{turn.content}" for turn in turns
+    )
+    prompt = f"""
+    请把下面的对话概括成一段不超过{CHAT_SUMMARY_TOKENS}字的摘要，保留用户的健康状况、关心的问题和已经给出的建议。
+
+    已有摘要：{previous_summary or "无"}
+
+    新的对话：
+    {transcript}
+    """
+    result = await call_qwen({
+        "model": model_router.fastest,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": 0.3,
+        "max_tokens": CHAT_SUMMARY_TOKENS * 2
+    })
+    summary = result["choices"][0]["message"]["content"].strip()
+    if not summary:
+        raise ValueError("Empty summary")
+    return summary
+
+@app.post("/chat/sessions")
+async def create_chat_session():
+    """Start a conversation; pass the returned session_id with each /chat message"""
+    session = chat_sessions.get_or_create()
+    await chat_sessions.save(session)
+    return {"session_id": session.id}
+
+@app.get("/chat/sessions/{session_id}")
+async def get_chat_session(session_id: str):
+    """Context window and summary of a conversation"""
+    session = await chat_sessions.load(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return session.to_dict()
+
+@app.delete("/chat/sessions/{session_id}")
+async def delete_chat_session(session_id: str):
+    """Forget a conversation"""
+    if not await chat_sessions.remove(session_id):
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return {"deleted": session_id}
+
+@app.get("/email/outbox/{outbox_id}")
+async def get_outbox_status(outbox_id: str):
+    """Delivery status of a queued alert email"""
+    message = email_outbox.get(outbox_id)
+    if message is None:
+        raise HTTPException(status_code=404, detail="Outbox message not found")
+    return message
+
+@app.delete("/blood-pressure/analyze/cache", dependencies=[Depends(admin_auth)])
+async def invalidate_analysis_cache():
+    """Drop all cached analyses (e.g. after a prompt or model change); needs ADMIN_TOKEN"""
+    return {"invalidated": await analysis_cache.invalidate()}
+
+def upload_openapi(schema: str) -> dict:
+    """Request body docs of the endpoints reading uploads through decode_upload"""
+    return {"requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": {"$ref": f"#/components/schemas/{schema}"}},
+            "application/x-ndjson": {"schema": {"$ref": "#/components/schemas/BloodPressureRecord"}},
+        },
+    }}
+
+@app.post(
+    "/blood-pressure/analyze",
+    response_model=BloodPressureAnalysisResponse,
+    response_class=FastJSONResponse,
+    dependencies=[Depends(rate_limiter)],
+    openapi_extra=upload_openapi("BloodPressureAnalysisRequest"),
+)
+async def analyze_blood_pressure(http_request: Request):
     """
     Analyze blood pressure data and provide AI recommendations
+    The body is decoded straight into arrays (record_codec.py); bodies the
+    fast path does not handle are validated by BloodPressureAnalysisRequest.
+    Columnar JSON and NDJSON bodies are accepted too (email as ?email= for NDJSON).
     """
+    request, prepared = await decode_analysis_request(http_request)
+    request_start = REQUEST_START.get()
+    if request_start is not None:
+        # Time from the request entering the app until the body is decoded
+        STAGE_DURATION.observe(time.perf_counter() - request_start, "parse")
+    UPSTREAM_ENDPOINT.set("analyze")
     try:
-        if not request.records:
-            raise HTTPException(status_code=400, detail="No blood pressure records provided")
-        
-        # Analyze the data
-        analysis_result = await analyze_bp_data(request.records)
-        
-        # Check for alerts
-        alert_level = determine_alert_level(request.records)
-        
-        # Send email if needed
-        email_sent = False
-        if alert_level in ["high", "critical"] and request.email:
-            email_sent = await send_alert_email(request.email, analysis_result, request.records)
-        
-        return BloodPressureAnalysisResponse(
-            analysis=analysis_result["analysis"],
-            recommendations=analysis_result["recommendations"],
-            alert_level=alert_level,
-            email_sent=email_sent
+        result = await run_analysis(request, prepared)
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Analysis error: {str(e)}")
+    return FastJSONResponse(result.model_dump())
+
+async def decode_analysis_request(http_request: Request):
+    """
+    (request, prepared) for an analyze body
+    On the fast path prepared holds the arrays and request.records is a lazy
+    view that only builds the few recent readings; otherwise prepared is None.
+    Invalid bodies raise the same 422 as a pydantic body parameter.
+    """
+    payload, columns = await decode_upload(http_request)
+    if columns is None:
+        columns = decode_analysis_payload(payload)
+    if columns is not None:
+        prepared = PreparedRecords.from_arrays(columns.arrays, columns.notes, BloodPressureRecord.model_construct)
+        request = BloodPressureAnalysisRequest.model_construct(records=prepared.records, email=columns.email)
+        return request, prepared
+    return validate_body(BloodPressureAnalysisRequest, payload), None
+
+async def decode_upload(http_request: Request):
+    """
+    (payload, columns) of a reading upload, read under UPLOAD_MAX_BYTES
+    NDJSON and columnar bodies are decoded to RecordColumns (payload None);
+    other JSON bodies are returned parsed for the caller to decode.
+    gzip bodies are inflated as they stream in; the cap applies to the
+    inflated size, so compression bombs stop at UPLOAD_MAX_BYTES.
+    """
+    if is_ndjson(http_request.headers.get("content-type")):
+        chunks = upload_chunks(http_request)
+        try:
+            columns = await read_ndjson(chunks, UPLOAD_MAX_BYTES, BloodPressureRecord.model_validate)
+        except BodyTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except InvalidContentEncoding as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        except RecordError as e:
+            raise RequestValidationError([{**error, "loc": ("body",) + tuple(error["loc"])} for error in e.errors])
+        columns.email = http_request.query_params.get("email")
+        return None, columns
+
+    payload = await read_json_body(http_request)
+    if is_columnar(payload):
+        try:
+            return None, decode_columnar_payload(payload)
+        except RecordError as e:
+            raise RequestValidationError([{**error, "loc": ("body",) + tuple(error["loc"])} for error in e.errors])
+    return payload, None
+
+def upload_chunks(http_request: Request):
+    """Body chunks with Content-Encoding removed; 413 up front for an oversized Content-Length"""
+    declared = http_request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Request body exceeds {UPLOAD_MAX_BYTES} bytes")
+    return decode_request_body(http_request.stream(), http_request.headers.get("content-encoding"))
+
+async def read_json_body(http_request: Request):
+    """
+    Parsed JSON body (identity or gzip) read under UPLOAD_MAX_BYTES
+    Errors match a pydantic body parameter (422) plus 413/400/415 for size and encoding.
+    """
+    try:
+        body = await read_body(upload_chunks(http_request), UPLOAD_MAX_BYTES)
+    except BodyTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidContentEncoding as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    if not body:
+        raise RequestValidationError([{"type": "missing", "loc": ("body",), "msg": "Field required", "input": None}])
+    try:
+        return loads_json(body)
+    except json.JSONDecodeError as e:
+        raise RequestValidationError(
+            [{"type": "json_invalid", "loc": ("body", e.pos), "msg": "JSON decode error",
+              "input": {}, "ctx": {"error": e.msg}}],
+            body=e.doc,
         )
-        
+
+def validate_body(model, payload):
+    """model.model_validate with the 422 of a pydantic body parameter"""
+    try:
+        return model.model_validate(payload)
+    except ValidationError as e:
+        errors = [{**error, "loc": ("body",) + tuple(error["loc"])} for error in e.errors()]
+        raise RequestValidationError(errors, body=payload)
+
+@app.post(
+    "/blood-pressure/analyze/batch",
+    dependencies=[Depends(rate_limiter)],
+    openapi_extra={"requestBody": {"required": True, "content": {
+        "application/json": {"schema": {"$ref": "#/components/schemas/BloodPressureBatchRequest"}},
+    }}},
+)
+async def analyze_blood_pressure_batch(http_request: Request, stream: bool = False):
+    """
+    Analyze many patients in one call
+    Items run with bounded concurrency (BATCH_CONCURRENCY); a failing item is
+    reported in its own result and does not fail the batch. With ?stream=true
+    results are sent as NDJSON lines in completion order. The body may be gzip.
+    """
+    request = validate_body(BloodPressureBatchRequest, await read_json_body(http_request))
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many items in batch (max {BATCH_MAX_ITEMS})"
+        )
+
+    # Never more items in flight than the batch endpoint limit admits at once
+    semaphore = asyncio.Semaphore(min(BATCH_CONCURRENCY, QWEN_ENDPOINT_LIMITS.get("batch", BATCH_CONCURRENCY)))
+    UPSTREAM_ENDPOINT.set("batch")
+
+    async def run_item(index: int, item: BloodPressureAnalysisRequest) -> BloodPressureBatchItemResult:
+        async with semaphore:
+            try:
+                result = await run_analysis(item)
+                return BloodPressureBatchItemResult(index=index, result=result)
+            except (HTTPException, AdmissionRejected) as e:
+                return BloodPressureBatchItemResult(index=index, status_code=e.status_code, error=str(e.detail))
+            except Exception as e:
+                return BloodPressureBatchItemResult(index=index, status_code=500, error=f"Analysis error: {str(e)}")
+
+    if stream:
+        async def ndjson_stream():
+            # Started here, so a client that leaves before the body is sent never starts them
+            tasks = [asyncio.ensure_future(run_item(i, item)) for i, item in enumerate(request.items)]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    item_result = await next_done
+                    yield item_result.model_dump_json() + "\n"
+            finally:
+                # Client went away: stop the remaining items
+                for task in tasks:
+                    task.cancel()
+
+        return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+    results = await asyncio.gather(*(run_item(i, item) for i, item in enumerate(request.items)))
+    failed = sum(1 for r in results if r.error is not None)
+    return BloodPressureBatchResponse(
+        results=results,
+        succeeded=len(results) - failed,
+        failed=failed
+    )
+
+@app.post(
+    "/blood-pressure/analyze/stream",
+    dependencies=[Depends(rate_limiter)],
+    openapi_extra=upload_openapi("BloodPressureAnalysisRequest"),
+)
+async def analyze_blood_pressure_stream(http_request: Request):
+    """
+    Streaming analysis (Server-Sent Events)
+    The analysis text arrives as {"delta": "..."} events. Each recommendation is
+    sent as an `event: recommendation` as soon as its line is complete. An
+    `event: result` with the full BloodPressureAnalysisResponse comes last,
+    followed by "data: [DONE]". Accepts the same bodies as /blood-pressure/analyze.
+    """
+    request, prepared = await decode_analysis_request(http_request)
+    UPSTREAM_ENDPOINT.set("analyze")
+    if not request.records:
+        raise HTTPException(status_code=400, detail="No blood pressure records provided")
+    if prepared is None:
+        with stage_timer("prepare"):
+            prepared = PreparedRecords(request.records)
+    alert_level = determine_alert_level(prepared)
+
+    analysis_tier, analysis_result = TIER_LLM, None
+    if ANALYSIS_MODE == "tiered" and is_routine(prepared, alert_level):
+        analysis_tier, analysis_result = TIER_RULE, rule_based_analysis(prepared)
+    else:
+        qwen_request = build_analysis_request(prepared)
+        cache_key = make_cache_key(qwen_request)
+        analysis_result = await analysis_cache.get(cache_key)
+        if analysis_result is None:
+            try:
+                response, release_slot = await open_qwen_stream(qwen_request, "analyze", severity=alert_level)
+            except CircuitOpen:
+                analysis_result = await analysis_cache.get_stale(cache_key)
+                if analysis_result is None:
+                    analysis_tier, analysis_result = TIER_FALLBACK, fallback_analysis(prepared, alert_level)
+
+    if analysis_result is not None:
+        # Rule-based, cached or fallback: everything is known up front
+        async def complete_stream():
+            yield sse_event({"delta": analysis_result["analysis"]})
+            for recommendation in analysis_result["recommendations"]:
+                yield sse_event({"recommendation": recommendation}, "recommendation")
+            result = finish_analysis(request, prepared, alert_level, analysis_result, analysis_tier)
+            yield sse_event(result.model_dump(), "result")
+            yield "data: [DONE]\n\n"
+
+        return sse_response(complete_stream())
+
+    async def event_stream():
+        extractor = RecommendationExtractor()
+        parts = []
+        try:
+            async for delta in qwen_client.iter_deltas(response):
+                parts.append(delta)
+                yield sse_event({"delta": delta})
+                for recommendation in extractor.feed(delta):
+                    yield sse_event({"recommendation": recommendation}, "recommendation")
+            for recommendation in extractor.close():
+                yield sse_event({"recommendation": recommendation}, "recommendation")
+
+            streamed_result = {"analysis": "".join(parts), "recommendations": extractor.recommendations}
+            await analysis_cache.set(cache_key, streamed_result)
+            result = finish_analysis(request, prepared, alert_level, streamed_result, TIER_LLM)
+            yield sse_event(result.model_dump(), "result")
+            yield "data: [DONE]\n\n"
+        except httpx.HTTPError as e:
+            yield sse_event({"detail": str(e)}, "error")
+        finally:
+            release_slot()
+
+    return sse_response(event_stream(), response, release_slot)
+
+@app.post("/blood-pressure/users/{user_id}/token", dependencies=[Depends(admin_auth)])
+async def issue_user_token(user_id: str):
+    """Token for a user's /blood-pressure/users/{user_id}/ endpoints (called by the account service)"""
+    token, expires_at = user_tokens.issue(user_id)
+    return {"user_id": user_id, "token": token, "expires_at": expires_at}
+
+@app.post(
+    "/blood-pressure/users/{user_id}/readings",
+    response_model=ReadingIngestResponse,
+    openapi_extra=upload_openapi("ReadingIngestRequest"),
+)
+async def ingest_readings(http_request: Request, user_id: str = Depends(user_tokens)):
+    """
+    Store new readings for a user
+    Only readings not yet on the server need to be sent; duplicates
+    (same timestamp and values) are ignored, so retries are safe.
+    Columnar JSON and NDJSON bodies are stored INGEST_BATCH_SIZE readings at a time.
+    """
+    payload, columns = await decode_upload(http_request)
+    if columns is None:
+        request = validate_body(ReadingIngestRequest, payload)
+        if any(r.timestamp is None for r in request.records):
+            raise HTTPException(status_code=400, detail="Every stored reading needs a timestamp")
+        received = len(request.records)
+        batches = [[r.model_dump() for r in request.records]]
+    else:
+        if np.isnan(columns.arrays.timestamp).any():
+            raise HTTPException(status_code=400, detail="Every stored reading needs a timestamp")
+        received = len(columns)
+        # Oldest first, so the rolling aggregates see every batch in time order
+        batches = columns.rows(np.argsort(columns.arrays.timestamp, kind="stable"), INGEST_BATCH_SIZE)
+
+    inserted, total = await store_readings(user_id, batches)
+    return ReadingIngestResponse(
+        received=received,
+        inserted=inserted,
+        duplicates=received - inserted,
+        total=total
+    )
+
+async def store_readings(user_id: str, batches) -> tuple:
+    """Insert batches of readings and keep the rolling aggregates in step; returns (inserted, total)"""
+    inserted = 0
+    for batch in batches:
+        added = await reading_store.add_readings(user_id, batch)
+        inserted += len(added)
+        # Skipped if another worker wrote in between; the next read applies the delta
+        rolling_aggregates.add_readings(user_id, added)
+    # Readings are never deleted, so the version is the number stored
+    total = await reading_store.version(user_id)
+    return inserted, total
+
+@app.get("/blood-pressure/users/{user_id}/summary")
+async def get_user_summary(user_id: str = Depends(user_tokens)):
+    """Rolling statistics of a user (all-time and 7/30/90-day windows)"""
+    aggregates = await get_user_aggregates(user_id)
+    if aggregates.count == 0:
+        raise HTTPException(status_code=404, detail="No stored readings for this user")
+    return aggregates.summary()
+
+async def get_user_aggregates(user_id: str) -> UserAggregates:
+    """
+    Rolling aggregates of a user, caught up with the reading store
+    Costs one version lookup; readings stored since (e.g. by another worker)
+    are applied as a delta, the full history is only read to build them.
+    """
+    version = await reading_store.version(user_id)
+    aggregates = rolling_aggregates.get(user_id)
+    if aggregates is None or aggregates.version > version:
+        return rolling_aggregates.rebuild(user_id, await reading_store.get_readings_after(user_id))
+    while aggregates.version < version:
+        delta = await reading_store.get_readings_after(user_id, aggregates.version)
+        if not delta:
+            break
+        # None when a concurrent request applied part of the delta first: fetch again
+        aggregates = rolling_aggregates.add_readings(user_id, delta) or rolling_aggregates.get(user_id)
+    return aggregates
+
+@app.post(
+    "/blood-pressure/users/{user_id}/analyze",
+    response_model=BloodPressureAnalysisResponse,
+    dependencies=[Depends(rate_limiter)],
+)
+async def analyze_stored_readings(request: StoredAnalysisRequest, user_id: str = Depends(user_tokens)):
+    """Analyze a user's stored readings in a time window instead of a full upload"""
+    until = request.until
+    since = request.since
+    days = request.days or STORED_ANALYSIS_DAYS
+    prepared = None
+
+    if since is None and until is None and days <= MAX_WINDOW_DAYS:
+        # Recent window: statistics come from the rolling aggregates, so only
+        # the latest readings are loaded regardless of history length
+        stats = (await get_user_aggregates(user_id)).window_stats(days)
+        rows = await reading_store.get_readings(user_id, since=window_start(days), limit=10)
+        records = [BloodPressureRecord.model_construct(**row) for row in rows]
+        if records:
+            prepared = PreparedRecords(records, stats=stats)
+    else:
+        if since is None:
+            since = (until if until is not None else time.time()) - days * 86400
+        rows = await reading_store.get_readings(
+            user_id, since=since, until=until, limit=STORED_ANALYSIS_MAX_READINGS
+        )
+        records = [BloodPressureRecord.model_construct(**row) for row in rows]
+
+    if not rows:
+        raise HTTPException(status_code=404, detail="No stored readings in the requested window")
+
+    UPSTREAM_ENDPOINT.set("analyze")
+    try:
+        return await run_analysis(
+            BloodPressureAnalysisRequest(records=records, email=request.email),
+            prepared
+        )
+    except AdmissionRejected:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Analysis error: {str(e)}")
 
-async def analyze_bp_data(records: List[BloodPressureRecord]) -> dict:
+async def run_analysis(request: BloodPressureAnalysisRequest,
+                       prepared: Optional[PreparedRecords] = None) -> BloodPressureAnalysisResponse:
+    """Full analysis pipeline for one patient: AI analysis, alert level, email"""
+    if not request.records:
+        raise HTTPException(status_code=400, detail="No blood pressure records provided")
+    
+    # Order the readings once; every stage below reuses this view
+    if prepared is None:
+        with stage_timer("prepare"):
+            prepared = PreparedRecords(request.records)
+    
+    # Check for alerts
+    alert_level = determine_alert_level(prepared)
+    
+    # Analyze the data: routine readings skip the LLM in tiered mode
+    if ANALYSIS_MODE == "tiered" and is_routine(prepared, alert_level):
+        analysis_tier = TIER_RULE
+        analysis_result = rule_based_analysis(prepared)
+    else:
+        try:
+            analysis_tier = TIER_LLM
+            analysis_result = await analyze_bp_data(prepared, alert_level)
+        except CircuitOpen:
+            # Qwen is unavailable and nothing is cached: degrade to rules
+            analysis_tier = TIER_FALLBACK
+            analysis_result = fallback_analysis(prepared, alert_level)
+    
+    return finish_analysis(request, prepared, alert_level, analysis_result, analysis_tier)
+
+def finish_analysis(request: BloodPressureAnalysisRequest, prepared: PreparedRecords, alert_level: str,
+                    analysis_result: dict, analysis_tier: str) -> BloodPressureAnalysisResponse:
+    """Queue the alert email if needed and build the response"""
+    # Queue email if needed (delivered by the background outbox)
+    email_outbox_id = None
+    if alert_level in ["high", "critical"] and request.email:
+        with stage_timer("email_queue"):
+            email_outbox_id = queue_alert_email(request.email, alert_level, analysis_result, prepared)
+    
+    return BloodPressureAnalysisResponse(
+        analysis=analysis_result["analysis"],
+        recommendations=analysis_result["recommendations"],
+        alert_level=alert_level,
+        email_queued=email_outbox_id is not None,
+        email_outbox_id=email_outbox_id,
+        analysis_tier=analysis_tier
+    )
+
+async def analyze_bp_data(prepared: PreparedRecords, alert_level: Optional[str] = None) -> dict:
     """Use AI to analyze blood pressure data"""
+    qwen_request = build_analysis_request(prepared)
+
+    # The canonical request (prompt + model parameters) identifies the analysis
+    cache_key = make_cache_key(qwen_request)
+    cached = await analysis_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        result = await call_qwen(qwen_request, severity=alert_level)
+    except CircuitOpen:
+        # An expired analysis of the same readings beats a generic fallback
+        stale = await analysis_cache.get_stale(cache_key)
+        if stale is not None:
+            return stale
+        raise
+
+    if "choices" in result and len(result["choices"]) > 0:
+        ai_response = result["choices"][0]["message"]["content"]
+
+        # Parse the response to extract analysis and recommendations
+        analysis = ai_response
+        with stage_timer("extract"):
+            recommendations = extract_recommendations(ai_response)
+
+        analysis_result = {
+            "analysis": analysis,
+            "recommendations": recommendations
+        }
+        await analysis_cache.set(cache_key, analysis_result)
+        return analysis_result
+    else:
+        raise HTTPException(
+            status_code=500,
+            detail="Invalid response format from Qwen API"
+        )
+
+def build_analysis_request(prepared: PreparedRecords) -> dict:
+    """Build the Qwen request body (prompt + parameters) for a blood pressure analysis"""
+    prompt_started = time.perf_counter()
     
     # Prepare data summary for AI
-    recent_records = sorted(records, key=lambda x: x.timestamp or 0, reverse=True)[:10]
-    avg_systolic = sum(r.systolic for r in recent_records) / len(recent_records)
-    avg_diastolic = sum(r.diastolic for r in recent_records) / len(recent_records)
+    recent_records = prepared.recent_records
+    avg_systolic = prepared.recent_arrays.systolic.mean()
+    avg_diastolic = prepared.recent_arrays.diastolic.mean()
     
     data_summary = f"""
     最近{len(recent_records)}次血压记录：
     平均收缩压: {avg_systolic:.1f} mmHg
     平均舒张压: {avg_diastolic:.1f} mmHg
-    
+    {format_stats_summary(prepared.stats)}
     最近记录详情：
     """
 
@@ -201,7 +1360,7 @@ async def analyze_bp_data(records: List[BloodPressureRecord]) -> dict:
 
     # Call Qwen API for analysis
     qwen_request = {
-        "model": "qwen-turbo",
+        "model": model_router.fastest,  # routed by alert_level when sent
         "messages": [
             {
                 "role": "user",
@@ -211,143 +1370,90 @@ async def analyze_bp_data(records: List[BloodPressureRecord]) -> dict:
         "temperature": 0.3,  # Lower temperature for more consistent medical advice
         "max_tokens": 1500
     }
+    STAGE_DURATION.observe(time.perf_counter() - prompt_started, "prompt")
+    return qwen_request
 
-    headers = {
-        "Authorization": f"Bearer {QWEN_API_KEY}",
-        "Content-Type": "application/json"
-    }
-
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        response = await client.post(
-            f"{QWEN_BASE_URL}/chat/completions",
-            headers=headers,
-            json=qwen_request
+def format_stats_summary(stats: BPStats) -> str:
+    """Describe the whole-history statistics for the AI prompt"""
+    lines = [
+        f"整体统计（共{stats.count}次记录）：",
+        f"收缩压: 平均 {stats.mean_systolic:.1f} ± {stats.std_systolic:.1f} mmHg，范围 {stats.min_systolic:.0f}-{stats.max_systolic:.0f} mmHg",
+        f"舒张压: 平均 {stats.mean_diastolic:.1f} ± {stats.std_diastolic:.1f} mmHg，范围 {stats.min_diastolic:.0f}-{stats.max_diastolic:.0f} mmHg",
+        f"平均脉压差: {stats.mean_pulse_pressure:.1f} mmHg",
+    ]
+    if stats.mean_heart_rate is not None:
+        lines.append(f"平均心率: {stats.mean_heart_rate:.0f} bpm")
+    if stats.systolic_slope_per_day is not None and stats.diastolic_slope_per_day is not None:
+        lines.append(
+            f"趋势: 收缩压每天 {stats.systolic_slope_per_day:+.2f} mmHg，"
+            f"舒张压每天 {stats.diastolic_slope_per_day:+.2f} mmHg"
         )
+    if stats.morning_surge is not None:
+        lines.append(f"晨峰: 早晨收缩压比傍晚高 {stats.morning_surge:+.1f} mmHg")
+    return "\n    ".join(lines) + "\n"
 
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=response.status_code,
-                detail=f"Qwen API error: {response.text}"
-            )
-
-        result = response.json()
+def determine_alert_level(prepared: PreparedRecords) -> str:
+    """Determine alert level based on the most recent blood pressure readings"""
+    return compute_alert_level(prepared.recent_arrays, window=3)
 
-    if "choices" in result and len(result["choices"]) > 0:
-        ai_response = result["choices"][0]["message"]["content"]
-
-        # Parse the response to extract analysis and recommendations
-        analysis = ai_response
-        recommendations = extract_recommendations(ai_response)
+def queue_alert_email(email: str, alert_level: str, analysis: dict, prepared: PreparedRecords) -> Optional[str]:
+    """
+    Queue an alert email to family members, returns the outbox id
+    The first alert to an address is sent at once, follow-ups are merged
+    into one digest or suppressed during the cooldown (None); escalations
+    are sent at once.
+    """
+    if not email_outbox.enabled:
+        return None
+    
+    # Details of this alert; compose_alert_email wraps one or more of them
+    recent_record = prepared.latest
+    timestamp = datetime.fromtimestamp(recent_record.timestamp or 0).strftime("%Y-%m-%d %H:%M") if recent_record.timestamp else "未知时间"
+    
+    section = f"""最新血压记录：
+    时间：{timestamp}
+    血压：{recent_record.systolic}/{recent_record.diastolic} mmHg
+    {"心率：" + str(recent_record.heart_rate) + " bpm" if recent_record.heart_rate else ""}
+    
+    AI分析结果：
+    {analysis['analysis']}
+    
+    建议措施：
+    {chr(10).join(analysis['recommendations']) if analysis['recommendations'] else "请及时关注血压变化"}"""
+    
+    return email_outbox.enqueue_alert(email, alert_level, section)
 
-        return {
-            "analysis": analysis,
-            "recommendations": recommendations
-        }
+def compose_alert_email(alerts: list, suppressed: int) -> tuple:
+    """(subject, body) of an alert email; alerts are (alert_level, section), oldest first"""
+    if len(alerts) == 1:
+        subject = "血压异常提醒 - 老人健康监测"
+        details = alerts[0][1]
     else:
-        raise HTTPException(
-            status_code=500,
-            detail="Invalid response format from Qwen API"
+        subject = f"血压异常提醒（{len(alerts)}次）- 老人健康监测"
+        details = "\n\n    ".join(
+            f"第{i}次提醒（{LEVEL_ASSESSMENTS.get(level, level)}）\n    {section}"
+            for i, (level, section) in enumerate(alerts, 1)
         )
-
-def extract_recommendations(ai_response: str) -> List[str]:
-    """Extract recommendations from AI response"""
-    recommendations = []
+    if suppressed:
+        details += f"\n\n    上次提醒后另有{suppressed}次同等级的异常记录，未单独发送邮件。"
     
-    # Simple extraction - look for numbered lists or bullet points
-    lines = ai_response.split('\n')
-    for line in lines:
-        line = line.strip()
-        if line.startswith(('1.', '2.', '3.', '4.', '5.', '•', '-', '建议', '推荐')):
-            recommendations.append(line)
+    body = f"""
+    尊敬的家庭成员，
     
-    return recommendations[:5]  # Limit to 5 recommendations
-
-def determine_alert_level(records: List[BloodPressureRecord]) -> str:
-    """Determine alert level based on blood pressure readings"""
-    if not records:
-        return "normal"
+    您的家人的血压监测系统检测到异常情况，请关注：
     
-    recent_records = sorted(records, key=lambda x: x.timestamp or 0, reverse=True)[:3]
+    {details}
     
-    for record in recent_records:
-        # Critical levels
-        if record.systolic >= 180 or record.diastolic >= 120:
-            return "critical"
-        # High levels
-        if record.systolic >= 160 or record.diastolic >= 100:
-            return "high"
-        # Elevated levels
-        if record.systolic >= 140 or record.diastolic >= 90:
-            return "elevated"
+    建议：
+    1. 密切关注血压变化
+    2. 如有必要，请及时就医
+    3. 保持健康的生活方式
     
-    return "normal"
-
-async def send_alert_email(email: str, analysis: dict, records: List[BloodPressureRecord]) -> bool:
-    """Send alert email to family members"""
-    try:
-        if not EMAIL_USER or not EMAIL_PASSWORD:
-            return False
-        
-        # Create message
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_USER
-        msg['To'] = email
-        msg['Subject'] = "血压异常提醒 - 老人健康监测"
-        
-        # Email body
-        recent_record = sorted(records, key=lambda x: x.timestamp or 0, reverse=True)[0]
-        timestamp = datetime.fromtimestamp(recent_record.timestamp or 0).strftime("%Y-%m-%d %H:%M") if recent_record.timestamp else "未知时间"
-        
-        body = f"""
-        尊敬的家庭成员，
-        
-        您的家人的血压监测系统检测到异常情况，请关注：
-        
-        最新血压记录：
-        时间：{timestamp}
-        血压：{recent_record.systolic}/{recent_record.diastolic} mmHg
-        {"心率：" + str(recent_record.heart_rate) + " bpm" if recent_record.heart_rate else ""}
-        
-        AI分析结果：
-        {analysis['analysis']}
-        
-        建议措施：
-        {chr(10).join(analysis['recommendations']) if analysis['recommendations'] else "请及时关注血压变化"}
-        
-        建议：
-        1. 密切关注血压变化
-        2. 如有必要，请及时就医
-        3. 保持健康的生活方式
-        
-        此邮件由AI血压监测系统自动发送。
-        
-        祝您和家人身体健康！
-        """
-        
-        msg.attach(MIMEText(body, 'plain', 'utf-8'))
-        
-        # Send email
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(EMAIL_USER, EMAIL_PASSWORD)
-            # text = msg.as_string()
-            server.send_message(msg)
-        #
-        # server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-
-        # server.starttls()  # 启用TLS加密
-
-        # server.login(EMAIL_USER, EMAIL_PASSWORD)
-        # text = msg.as_string()
-        #
-        # server.sendmail(EMAIL_USER, email, text)
-        # server.quit()
-        
-        return True
-        
-    except Exception as e:
-        print(f"Email sending failed: {e}")
-        return False
+    此邮件由AI血压监测系统自动发送。
+    
+    祝您和家人身体健康！
+    """
+    return subject, body
 
 if __name__ == "__main__":
     import uvicorn
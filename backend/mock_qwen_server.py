@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the DashScope compatible-mode /chat/completions API
+Used by load_test.py so benchmarks need neither a network nor an API key.
+
+Usage:
+    python mock_qwen_server.py --port 9100 --latency-ms 800 --jitter-ms 300
+Then start the backend with QWEN_BASE_URL=http://127.0.0.1:9100/v1
+"""
+
+import argparse
+import asyncio
+import json
+import random
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+MOCK_REPLY = """血压水平评估：最近的血压略高于正常范围，需要注意。
+趋势分析：整体比较平稳，没有明显恶化。
+健康风险提示：长期偏高会增加心脑血管疾病风险。
+1. 饮食清淡，每天盐摄入不超过5克
+2. 每天散步30分钟，避免剧烈运动
+3. 保证充足睡眠，避免熬夜
+4. 按时测量血压并记录
+5. 如持续偏高，请及时就医咨询"""
+
+
+def create_app(latency_ms: float = 800.0, jitter_ms: float = 200.0,
+               token_delay_ms: float = 20.0, error_rate: float = 0.0) -> FastAPI:
+    app = FastAPI(title="Mock Qwen API")
+    app.state.requests = 0
+
+    async def simulate_latency():
+        delay = max(0.0, random.gauss(latency_ms, jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+
+    @app.get("/")
+    async def root():
+        return {"message": "Mock Qwen API is running", "requests": app.state.requests}
+
+    @app.get("/v1/models")
+    async def models():
+        # Used by the backend's startup prewarm
+        return {"object": "list", "data": [{"id": name, "object": "model"}
+                                            for name in ("qwen-turbo", "qwen-plus", "qwen-max")]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        app.state.requests += 1
+        body = await request.json()
+
+        if error_rate and random.random() < error_rate:
+            await simulate_latency()
+            return JSONResponse(status_code=503, content={"error": "mock upstream error"})
+
+        if body.get("stream"):
+            return StreamingResponse(stream_reply(body), media_type="text/event-stream")
+
+        await simulate_latency()
+        return {
+            "id": f"mock-{app.state.requests}",
+            "object": "chat.completion",
+            "model": body.get("model", "qwen-turbo"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": MOCK_REPLY},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 100, "completion_tokens": len(MOCK_REPLY), "total_tokens": 100 + len(MOCK_REPLY)},
+        }
+
+    async def stream_reply(body: dict):
+        # Time to first token, then one chunk every token_delay_ms
+        await simulate_latency()
+        for i in range(0, len(MOCK_REPLY), 4):
+            chunk = {"choices": [{"index": 0, "delta": {"content": MOCK_REPLY[i:i + 4]}}]}
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(token_delay_ms / 1000)
+        yield "data: [DONE]\n\n"
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Mock Qwen chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="mean response latency")
+    parser.add_argument("--jitter-ms", type=float, default=200.0, help="latency standard deviation")
+    parser.add_argument("--token-delay-ms", type=float, default=20.0, help="delay between streamed chunks")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--ssl-certfile", help="serve HTTPS with this certificate (PEM)")
+    parser.add_argument("--ssl-keyfile", help="private key for --ssl-certfile")
+    args = parser.parse_args()
+
+    app = create_app(args.latency_ms, args.jitter_ms, args.token_delay_ms, args.error_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning",
+                ssl_certfile=args.ssl_certfile, ssl_keyfile=args.ssl_keyfile)
@@ -0,0 +1,137 @@
+"""
+Latency-aware routing across Qwen models
+Models are configured fastest first (e.g. turbo, plus, max). Routine chat
+goes to the fastest one; long prompts and high/critical analyses prefer a
+stronger one. A model is skipped in favour of the next faster one when its
+concurrency budget is used up or its moving latency is over the target, so
+a burst of critical analyses cannot slow everything else down. A slow
+model is tried again once its latency sample is older than latency_ttl.
+"""
+
+import time
+from typing import Dict, List, Optional
+
+# Preferred position in the model list by alert severity
+SEVERITY_RANK = {"high": 1, "critical": 2}
+
+
+class ModelState:
+    __slots__ = ("name", "budget", "in_flight", "latency", "observed_at", "routed")
+
+    def __init__(self, name: str, budget: Optional[int]):
+        self.name = name
+        self.budget = budget  # None = unlimited
+        self.in_flight = 0
+        self.latency: Optional[float] = None  # EWMA of call latency in seconds
+        self.observed_at = 0.0
+        self.routed = 0
+
+    @property
+    def saturated(self) -> bool:
+        return self.budget is not None and self.in_flight >= self.budget
+
+
+class ModelLease:
+    """A routed call holding one unit of its model's budget; release() is idempotent"""
+    __slots__ = ("router", "model", "started", "released")
+
+    def __init__(self, router: "ModelRouter", model: str):
+        self.router = router
+        self.model = model
+        self.started = time.perf_counter()
+        self.released = False
+
+    def release(self, observe: bool = True):
+        """Return the budget; observe=False skips the latency sample (failed calls)"""
+        if not self.released:
+            self.released = True
+            self.router._release(self, observe)
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        models: List[str],
+        budgets: Optional[Dict[str, int]] = None,
+        long_prompt_chars: int = 1500,
+        max_latency: float = 20.0,
+        latency_alpha: float = 0.2,
+        latency_ttl: float = 60.0,
+    ):
+        if not models:
+            raise ValueError("At least one model must be configured")
+        budgets = budgets or {}
+        self._models = [ModelState(name, budgets.get(name)) for name in models]
+        self._by_name = {state.name: state for state in self._models}
+        self.long_prompt_chars = long_prompt_chars
+        self.max_latency = max_latency
+        self.latency_alpha = latency_alpha
+        self.latency_ttl = latency_ttl
+
+    @property
+    def fastest(self) -> str:
+        return self._models[0].name
+
+    def preferred_rank(self, prompt_chars: int, severity: Optional[str] = None) -> int:
+        rank = SEVERITY_RANK.get(severity, 0)
+        if prompt_chars > self.long_prompt_chars:
+            rank = max(rank, 1)
+        return min(rank, len(self._models) - 1)
+
+    def choose(self, prompt_chars: int, severity: Optional[str] = None) -> str:
+        """
+        Preferred model for the request, stepping down to faster models while
+        the candidate is over budget or slower than max_latency
+        """
+        now = time.monotonic()
+        for state in reversed(self._models[:self.preferred_rank(prompt_chars, severity) + 1]):
+            if state.saturated:
+                continue
+            if (state.latency is not None and state.latency > self.max_latency
+                    and now - state.observed_at < self.latency_ttl):
+                continue
+            return state.name
+        return self.fastest
+
+    def acquire(self, prompt_chars: int, severity: Optional[str] = None) -> ModelLease:
+        """Choose a model and hold one unit of its budget until the lease is released"""
+        model = self.choose(prompt_chars, severity)
+        state = self._by_name[model]
+        state.in_flight += 1
+        state.routed += 1
+        return ModelLease(self, model)
+
+    def try_acquire(self, model: str) -> Optional[ModelLease]:
+        """One more unit of this model's budget (hedged calls), None when it is used up"""
+        state = self._by_name[model]
+        if state.saturated:
+            return None
+        state.in_flight += 1
+        return ModelLease(self, model)
+
+    def stats(self) -> dict:
+        return {
+            state.name: {
+                "in_flight": state.in_flight,
+                "budget": state.budget,
+                "latency_seconds": round(state.latency, 3) if state.latency is not None else None,
+                "routed": state.routed,
+            }
+            for state in self._models
+        }
+
+    def _release(self, lease: ModelLease, observe: bool):
+        state = self._by_name[lease.model]
+        state.in_flight -= 1
+        if observe:
+            elapsed = time.perf_counter() - lease.started
+            state.observed_at = time.monotonic()
+            if state.latency is None:
+                state.latency = elapsed
+            else:
+                state.latency += self.latency_alpha * (elapsed - state.latency)
+
+
+def prompt_chars(qwen_request: dict) -> int:
+    """Total characters of the message contents in a chat completion request"""
+    return sum(len(message.get("content") or "") for message in qwen_request.get("messages", []))
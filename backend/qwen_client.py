@@ -0,0 +1,175 @@
+"""
+Shared upstream client for the DashScope (Qwen) compatible-mode API
+One httpx.AsyncClient lives for the whole app lifetime so keep-alive
+connections are reused instead of paying DNS/TCP/TLS on every request.
+"""
+
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Optional
+
+import httpx
+
+
+class QwenClient:
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str,
+        timeout: float = 30.0,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool = False,
+    ):
+        """Store the pool settings; the client itself is created in start()"""
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2 and _http2_available()
+        self._client: Optional[httpx.AsyncClient] = None
+
+        # Counters for pool stats
+        self.in_flight = 0
+        self.total_requests = 0
+        self._open_streams = set()
+
+    @property
+    def headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            raise RuntimeError("QwenClient is not started")
+        return self._client
+
+    async def start(self):
+        """Create the pooled client (called from the FastAPI lifespan)"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=self.http2,
+            )
+
+    async def close(self):
+        """Close all pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def prewarm(self, connections: int = 2, timeout: float = 5.0) -> dict:
+        """
+        Open `connections` keep-alive connections before the first real request
+        Concurrent GET /models requests each take their own connection and pay
+        DNS/TCP/TLS now; any HTTP status counts, the connection stays pooled.
+        """
+        started = time.perf_counter()
+
+        async def touch():
+            response = await self.client.get("/models", timeout=timeout)
+            await response.aclose()
+            return response.status_code
+
+        results = await asyncio.gather(*(touch() for _ in range(connections)), return_exceptions=True)
+        errors = [repr(r) for r in results if isinstance(r, BaseException)]
+        return {
+            "connections": len(results) - len(errors),
+            "seconds": round(time.perf_counter() - started, 3),
+            "error": errors[0] if errors else None,
+        }
+
+    async def chat_completion(self, payload: dict) -> httpx.Response:
+        """POST /chat/completions over the shared pool"""
+        self.in_flight += 1
+        self.total_requests += 1
+        try:
+            return await self.client.post("/chat/completions", json=payload)
+        finally:
+            self.in_flight -= 1
+
+    async def open_stream(self, payload: dict) -> httpx.Response:
+        """
+        Start a streaming /chat/completions request (payload must set stream=True)
+        The caller checks the status code, then consumes iter_deltas()
+        """
+        self.in_flight += 1
+        self.total_requests += 1
+        try:
+            request = self.client.build_request("POST", "/chat/completions", json=payload)
+            response = await self.client.send(request, stream=True)
+        except BaseException:
+            self.in_flight -= 1
+            raise
+        self._open_streams.add(response)
+        return response
+
+    async def iter_deltas(self, response: httpx.Response) -> AsyncIterator[str]:
+        """Yield content deltas from an SSE stream opened by open_stream()"""
+        try:
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                except json.JSONDecodeError:
+                    continue
+                for choice in chunk.get("choices") or []:
+                    content = (choice.get("delta") or {}).get("content")
+                    if content:
+                        yield content
+        finally:
+            await self.release_stream(response)
+
+    async def release_stream(self, response: httpx.Response):
+        """Close a stream from open_stream() and return its connection to the pool"""
+        await response.aclose()
+        if response in self._open_streams:
+            self._open_streams.discard(response)
+            self.in_flight -= 1
+
+    def pool_stats(self) -> dict:
+        """Snapshot of the connection pool for the /stats endpoint"""
+        stats = {
+            "started": self._client is not None,
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "in_flight": self.in_flight,
+            "total_requests": self.total_requests,
+            "connections": 0,
+            "idle_connections": 0,
+        }
+        # httpx does not expose pool state publicly; read it from httpcore
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is not None:
+            stats["connections"] = len(connections)
+            stats["idle_connections"] = sum(1 for c in connections if c.is_idle())
+        return stats
+
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the `h2` package from requirements.txt"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        print("QWEN_HTTP2 is enabled but the 'h2' package is missing, falling back to HTTP/1.1")
+        return False
+    return True
@@ -0,0 +1,98 @@
+"""
+Per-client request rate limit
+Fixed one-minute windows counted in the StateBackend, so the limit holds
+for the deployment as a whole rather than per uvicorn worker. Clients are
+identified by their peer address. X-Forwarded-For is only honoured when the
+peer is one of TRUSTED_PROXIES (anyone else could send a new value with each
+request): the client is then the right-most address not added by a trusted
+proxy. If the shared store is unreachable requests are let through:
+the limit protects the upstream budget, it must not take the API down.
+"""
+
+import ipaddress
+import math
+import time
+from typing import List, Optional
+
+from fastapi import Request
+
+from admission import AdmissionRejected
+from state_backend import StateBackend, StateBackendError
+
+KEY_PREFIX = "ratelimit:"
+
+
+def parse_trusted_proxies(value: str) -> List[ipaddress._BaseNetwork]:
+    """Parse "10.0.0.1,172.16.0.0/12" into networks"""
+    return [ipaddress.ip_network(item.strip(), strict=False) for item in (value or "").split(",") if item.strip()]
+
+
+def _is_trusted(address: str, trusted_proxies: List[ipaddress._BaseNetwork]) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted_proxies)
+
+
+def client_id(request: Request, trusted_proxies: Optional[List[ipaddress._BaseNetwork]] = None) -> str:
+    """Peer address, or the forwarded client address when the peer is a trusted proxy"""
+    peer = request.client.host if request.client else "unknown"
+    if not trusted_proxies or not _is_trusted(peer, trusted_proxies):
+        return peer
+    forwarded = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    # Walk back from the nearest hop; the first untrusted address is the client
+    for hop in reversed(forwarded):
+        if not _is_trusted(hop, trusted_proxies):
+            return hop
+    return forwarded[0] if forwarded else peer
+
+
+class RateLimiter:
+    def __init__(self, backend: StateBackend, limit: int, window: float = 60.0,
+                 trusted_proxies: Optional[List[ipaddress._BaseNetwork]] = None):
+        """limit <= 0 disables the limiter"""
+        self.backend = backend
+        self.limit = limit
+        self.window = window
+        self.trusted_proxies = trusted_proxies or []
+
+        self.allowed = 0
+        self.rejected = 0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit > 0
+
+    async def check(self, client: str, now: Optional[float] = None):
+        """Count one request; raises AdmissionRejected(429) past the limit"""
+        if not self.enabled:
+            return
+        now = time.time() if now is None else now
+        window = int(now // self.window)
+        try:
+            count = await self.backend.incr(f"{KEY_PREFIX}{client}:{window}", self.window)
+        except StateBackendError as e:
+            self.errors += 1
+            print(f"Rate limit check failed, allowing request: {e}")
+            return
+        if count > self.limit:
+            self.rejected += 1
+            retry_after = max(1, math.ceil((window + 1) * self.window - now))
+            raise AdmissionRejected(429, "Too many requests, please slow down", retry_after)
+        self.allowed += 1
+
+    async def __call__(self, request: Request):
+        """FastAPI dependency"""
+        await self.check(client_id(request, self.trusted_proxies))
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "window": self.window,
+            "backend": self.backend.name,
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "errors": self.errors,
+        }
@@ -0,0 +1,196 @@
+"""
+Persistent per-user blood pressure reading store
+SQLite in WAL mode; all queries run on one dedicated thread so the event
+loop never blocks on disk I/O. Readings are deduplicated by
+(user, timestamp, systolic, diastolic), which makes ingest idempotent.
+
+Every inserted reading gets the next per-user sequence number (seq) and the
+user's version is the highest seq so far. Rolling aggregates remember the
+version they include, so a worker can catch up by applying only the readings
+after it instead of recounting or reloading the whole history.
+"""
+
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    user_id    TEXT    NOT NULL,
+    timestamp  REAL    NOT NULL,
+    systolic   INTEGER NOT NULL,
+    diastolic  INTEGER NOT NULL,
+    heart_rate INTEGER,
+    notes      TEXT,
+    seq        INTEGER,
+    PRIMARY KEY (user_id, timestamp, systolic, diastolic)
+) WITHOUT ROWID
+"""
+
+VERSIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reading_versions (
+    user_id TEXT    PRIMARY KEY,
+    version INTEGER NOT NULL
+) WITHOUT ROWID
+"""
+
+SEQ_INDEX = "CREATE INDEX IF NOT EXISTS readings_seq ON readings (user_id, seq)"
+
+
+class ReadingStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def open(self):
+        """Open the database (called from the FastAPI lifespan)"""
+        if self._conn is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reading-store")
+        await self._run(self._open_blocking)
+
+    async def close(self):
+        if self._conn is None:
+            return
+        await self._run(self._conn.close)
+        self._conn = None
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    async def add_readings(self, user_id: str, readings: Iterable[dict]) -> List[dict]:
+        """
+        Insert new readings, skipping duplicates
+        Returns the readings actually inserted, each with its "seq"; the seqs
+        of one call are consecutive.
+        """
+        return await self._run(self._insert_blocking, user_id, list(readings))
+
+    async def get_readings(self, user_id: str, since: Optional[float] = None,
+                           until: Optional[float] = None, limit: Optional[int] = None) -> List[dict]:
+        """Readings of one user in [since, until], newest first"""
+        return await self._run(self._select_blocking, user_id, since, until, limit)
+
+    async def get_readings_after(self, user_id: str, seq: int = 0) -> List[dict]:
+        """Readings inserted after `seq` (0: all of them) with their "seq", oldest insert first"""
+        return await self._run(self._select_after_blocking, user_id, seq)
+
+    async def version(self, user_id: str) -> int:
+        """Highest seq of the user (0 without readings); one primary-key lookup"""
+        return await self._run(self._version_blocking, user_id)
+
+    async def count(self, user_id: str) -> int:
+        return await self._run(self._count_blocking, user_id)
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _open_blocking(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(SCHEMA)
+        conn.execute(VERSIONS_SCHEMA)
+        self._migrate_seq(conn)
+        conn.execute(SEQ_INDEX)
+        conn.commit()
+        self._conn = conn
+
+    @staticmethod
+    def _migrate_seq(conn: sqlite3.Connection):
+        """Number the readings of a database created before seq existed (in timestamp order)"""
+        if "seq" not in [row[1] for row in conn.execute("PRAGMA table_info(readings)")]:
+            conn.execute("ALTER TABLE readings ADD COLUMN seq INTEGER")
+            conn.commit()
+        if conn.execute("SELECT 1 FROM readings WHERE seq IS NULL LIMIT 1").fetchone() is None:
+            return
+        conn.execute("BEGIN IMMEDIATE")  # another worker may be migrating too
+        try:
+            rows = conn.execute(
+                "SELECT user_id, timestamp, systolic, diastolic FROM readings WHERE seq IS NULL "
+                "ORDER BY user_id, timestamp"
+            ).fetchall()
+            versions = dict(conn.execute("SELECT user_id, version FROM reading_versions"))
+            updates = []
+            for user_id, timestamp, systolic, diastolic in rows:
+                versions[user_id] = versions.get(user_id, 0) + 1
+                updates.append((versions[user_id], user_id, timestamp, systolic, diastolic))
+            conn.executemany(
+                "UPDATE readings SET seq = ? WHERE user_id = ? AND timestamp = ? AND systolic = ? AND diastolic = ?",
+                updates
+            )
+            conn.executemany("INSERT OR REPLACE INTO reading_versions (user_id, version) VALUES (?, ?)",
+                             versions.items())
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def _insert_blocking(self, user_id: str, readings: List[dict]) -> List[dict]:
+        inserted = []
+        conn = self._conn
+        # Write lock up front: workers in other processes must not hand out the same seq
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = self._version_blocking(user_id)
+            for r in readings:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO readings "
+                    "(user_id, timestamp, systolic, diastolic, heart_rate, notes, seq) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (user_id, r["timestamp"], r["systolic"], r["diastolic"], r.get("heart_rate"), r.get("notes"),
+                     version + 1)
+                )
+                if cursor.rowcount:
+                    version += 1
+                    inserted.append({**r, "seq": version})
+            if inserted:
+                conn.execute("INSERT OR REPLACE INTO reading_versions (user_id, version) VALUES (?, ?)",
+                             (user_id, version))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return inserted
+
+    def _select_blocking(self, user_id: str, since: Optional[float],
+                         until: Optional[float], limit: Optional[int]) -> List[dict]:
+        query = ("SELECT timestamp, systolic, diastolic, heart_rate, notes "
+                 "FROM readings WHERE user_id = ?")
+        params = [user_id]
+        if since is not None:
+            query += " AND timestamp >= ?"
+            params.append(since)
+        if until is not None:
+            query += " AND timestamp <= ?"
+            params.append(until)
+        query += " ORDER BY timestamp DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        cursor = self._conn.execute(query, params)
+        return [
+            {"timestamp": ts, "systolic": sys_, "diastolic": dia, "heart_rate": hr, "notes": notes}
+            for ts, sys_, dia, hr, notes in cursor
+        ]
+
+    def _select_after_blocking(self, user_id: str, seq: int) -> List[dict]:
+        cursor = self._conn.execute(
+            "SELECT timestamp, systolic, diastolic, heart_rate, notes, seq "
+            "FROM readings WHERE user_id = ? AND seq > ? ORDER BY seq",
+            (user_id, seq)
+        )
+        return [
+            {"timestamp": ts, "systolic": sys_, "diastolic": dia, "heart_rate": hr, "notes": notes, "seq": seq_}
+            for ts, sys_, dia, hr, notes, seq_ in cursor
+        ]
+
+    def _version_blocking(self, user_id: str) -> int:
+        row = self._conn.execute("SELECT version FROM reading_versions WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def _count_blocking(self, user_id: str) -> int:
+        row = self._conn.execute("SELECT COUNT(*) FROM readings WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0]
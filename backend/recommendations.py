@@ -0,0 +1,84 @@
+"""
+Incremental recommendation extraction
+Recommendations are the numbered or bulleted lines of the AI analysis
+(1. / 1、 / （1） / 一、 / （一） / • / - / 建议...). The extractor consumes
+the completion chunk by chunk as it streams in, emits each recommendation
+as soon as its line is complete and stops scanning once the limit is
+reached. Each character is looked at once, so cost is linear in the output.
+"""
+
+import re
+from typing import List
+
+DEFAULT_LIMIT = 5
+
+_CN_NUM = "一二三四五六七八九十"
+
+# Matched against the start of a stripped line (optional markdown bold/heading first)
+RECOMMENDATION_PATTERN = re.compile(
+    r"(?:#+\s*|\*\*)?"
+    r"(?:"
+    r"\d{1,2}\s*[.．、)）](?!\d)"                   # 1.  1、  1)  (not decimals like 10.5)
+    r"|[（(]\s*\d{1,2}\s*[)）]"                     # （1）  (1)
+    rf"|[{_CN_NUM}]{{1,3}}\s*[、.．]"               # 一、
+    rf"|[（(]\s*[{_CN_NUM}]{{1,3}}\s*[)）]"         # （一）
+    r"|[•·●▪]|-(?!-)|\*\s"                          # bullets (not "---" rules or **bold**)
+    r"|建议|推荐"
+    r")"
+)
+
+
+def is_recommendation(line: str) -> bool:
+    return RECOMMENDATION_PATTERN.match(line) is not None
+
+
+class RecommendationExtractor:
+    def __init__(self, limit: int = DEFAULT_LIMIT):
+        self.limit = limit
+        self.recommendations: List[str] = []
+        self._partial: List[str] = []  # pieces of the current, unfinished line
+
+    @property
+    def done(self) -> bool:
+        return len(self.recommendations) >= self.limit
+
+    def feed(self, chunk: str) -> List[str]:
+        """Consume a chunk of streamed text, returns the recommendations it completed"""
+        found = []
+        if self.done:
+            return found
+        start = 0
+        while True:
+            newline = chunk.find("\n", start)
+            if newline < 0:
+                break
+            self._partial.append(chunk[start:newline])
+            self._finish_line(found)
+            if self.done:
+                return found
+            start = newline + 1
+        if start < len(chunk):
+            self._partial.append(chunk[start:])
+        return found
+
+    def close(self) -> List[str]:
+        """End of the text: the last line counts even without a trailing newline"""
+        found = []
+        if not self.done and self._partial:
+            self._finish_line(found)
+        return found
+
+    def _finish_line(self, found: List[str]):
+        line = "".join(self._partial).strip()
+        self._partial = []
+        if line and is_recommendation(line):
+            self.recommendations.append(line)
+            found.append(line)
+
+
+def extract_recommendations(text: str, limit: int = DEFAULT_LIMIT) -> List[str]:
+    """Recommendations of a complete response"""
+    extractor = RecommendationExtractor(limit)
+    extractor.feed(text)
+    extractor.close()
+    return extractor.recommendations
@@ -0,0 +1,303 @@
+"""
+Columnar decoding of blood pressure uploads
+A pydantic BloodPressureRecord per reading dominates parse time and memory
+for large histories. The fast path parses the body with orjson (json when
+it is not installed), checks each column with a handful of C-level passes
+and keeps the readings as NumPy arrays (see bp_stats.BPArrays). Anything
+the fast path does not recognize is left to the pydantic models, so the
+accepted input and the 422 errors stay the same.
+
+Besides {"records": [...]} two bulk formats are accepted:
+- columnar JSON: parallel arrays {"timestamp": [...], "systolic": [...], ...},
+  read whole (under the cap) and parsed in one call; unknown keys are errors
+- NDJSON: one reading object per line, decoded chunk by chunk as the body
+  streams in, so only the float64 columns are kept in memory
+Only NDJSON is parsed incrementally. Every body is read under a hard size cap.
+"""
+
+import json
+from typing import AsyncIterator, Callable, List, Optional
+
+import numpy as np
+from fastapi.responses import JSONResponse
+from pydantic import ValidationError
+
+from bp_stats import BPArrays
+
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+except ImportError:  # optional, falls back to the standard library
+    orjson = None
+    FastJSONResponse = JSONResponse
+
+COLUMNAR_KEYS = ("timestamp", "systolic", "diastolic", "heart_rate", "notes", "email")
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+# One reading is well under a kilobyte; longer lines are rejected, not buffered
+MAX_LINE_BYTES = 64 * 1024
+
+_NONE = type(None)
+_NUMBER = {int, float}
+
+
+class BodyTooLarge(Exception):
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Request body exceeds {max_bytes} bytes")
+        self.max_bytes = max_bytes
+
+
+class RecordError(ValueError):
+    """Invalid upload; errors are pydantic-style dicts with loc relative to the body"""
+
+    def __init__(self, errors: List[dict]):
+        super().__init__(errors[0]["msg"])
+        self.errors = errors
+
+
+def _record_error(loc: tuple, msg: str, value=None) -> RecordError:
+    return RecordError([{"type": "value_error", "loc": loc, "msg": msg, "input": value}])
+
+
+def loads(body: bytes):
+    """Parse a JSON body; raises json.JSONDecodeError (orjson's is a subclass)"""
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def is_ndjson(content_type: Optional[str]) -> bool:
+    return (content_type or "").split(";", 1)[0].strip().lower() in NDJSON_CONTENT_TYPES
+
+
+def is_columnar(payload) -> bool:
+    """{"systolic": [...], ...} rather than {"records": [...]}"""
+    return type(payload) is dict and "records" not in payload and type(payload.get("systolic")) is list
+
+
+async def read_body(chunks: AsyncIterator[bytes], max_bytes: int) -> bytes:
+    """Whole body, raising BodyTooLarge as soon as it passes max_bytes"""
+    parts = []
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > max_bytes:
+            raise BodyTooLarge(max_bytes)
+        parts.append(chunk)
+    return b"".join(parts)
+
+
+class RecordColumns:
+    """Decoded upload: readings as arrays plus the notes column"""
+    __slots__ = ("arrays", "notes", "email")
+
+    def __init__(self, arrays: BPArrays, notes: Optional[List[Optional[str]]], email: Optional[str]):
+        self.arrays = arrays
+        self.notes = notes  # None when no reading has notes
+        self.email = email
+
+    def __len__(self) -> int:
+        return len(self.arrays)
+
+    def rows(self, order: Optional[np.ndarray] = None, batch_size: int = 1000):
+        """Readings as dicts (for the reading store), batch_size at a time"""
+        a = self.arrays
+        order = np.arange(len(a)) if order is None else order
+        for start in range(0, len(order), batch_size):
+            index = order[start:start + batch_size]
+            yield [
+                {
+                    "timestamp": None if np.isnan(timestamp) else float(timestamp),
+                    "systolic": int(systolic),
+                    "diastolic": int(diastolic),
+                    "heart_rate": None if np.isnan(heart_rate) else int(heart_rate),
+                    "notes": self.notes[i] if self.notes is not None else None,
+                }
+                for i, systolic, diastolic, heart_rate, timestamp in zip(
+                    index.tolist(), a.systolic[index].tolist(), a.diastolic[index].tolist(),
+                    a.heart_rate[index].tolist(), a.timestamp[index].tolist()
+                )
+            ]
+
+
+def _to_array(values: list, allowed: set, integer: bool) -> Optional[np.ndarray]:
+    """float64 column (NaN for null), None when a value needs pydantic's coercion or errors"""
+    if not set(map(type, values)) <= allowed:
+        return None
+    column = np.array(values, dtype=np.float64)
+    if integer:
+        present = column[~np.isnan(column)]
+        if not np.all(present == np.trunc(present)):
+            return None
+    return column
+
+
+def _notes(notes: list) -> Optional[list]:
+    """The notes column, None when no reading has notes; raises TypeError for non-strings"""
+    note_types = set(map(type, notes))
+    if not note_types <= {str, _NONE}:
+        raise TypeError("notes must be strings or null")
+    return notes if str in note_types else None
+
+
+def decode_analysis_payload(payload) -> Optional[RecordColumns]:
+    """
+    Columns of an already parsed {"records": [...], "email": ...} body
+    Returns None when the payload does not match the plain shape, the caller
+    then validates it with the pydantic model instead.
+    """
+    if type(payload) is not dict:
+        return None
+    records = payload.get("records")
+    email = payload.get("email")
+    if type(records) is not list or type(email) not in (str, _NONE):
+        return None
+    if not set(map(type, records)) <= {dict}:
+        return None
+
+    systolic = _to_array([r.get("systolic") for r in records], _NUMBER, integer=True)
+    diastolic = _to_array([r.get("diastolic") for r in records], _NUMBER, integer=True)
+    heart_rate = _to_array([r.get("heart_rate") for r in records], _NUMBER | {_NONE}, integer=True)
+    timestamp = _to_array([r.get("timestamp") for r in records], _NUMBER | {_NONE}, integer=False)
+    if systolic is None or diastolic is None or heart_rate is None or timestamp is None:
+        return None
+    try:
+        notes = _notes([r.get("notes") for r in records])
+    except TypeError:
+        return None
+
+    return RecordColumns(BPArrays(systolic, diastolic, heart_rate, timestamp), notes, email)
+
+
+def decode_columnar_payload(payload: dict) -> RecordColumns:
+    """
+    Columns of a parsed columnar body
+    systolic and diastolic are required; timestamp, heart_rate and notes are
+    optional and may contain null. Raises RecordError on invalid or unknown
+    columns (a misspelt "timestamps" must not silently mean "no timestamps").
+    """
+    unknown = [key for key in payload if key not in COLUMNAR_KEYS]
+    if unknown:
+        raise _record_error(
+            (unknown[0],), f"Unknown column {unknown[0]!r}; expected {', '.join(COLUMNAR_KEYS)}"
+        )
+    n = len(payload["systolic"])
+    email = payload.get("email")
+    if type(email) not in (str, _NONE):
+        raise _record_error(("email",), "email must be a string or null", email)
+
+    columns = {}
+    for key, required, integer in (
+        ("systolic", True, True),
+        ("diastolic", True, True),
+        ("heart_rate", False, True),
+        ("timestamp", False, False),
+    ):
+        values = payload.get(key)
+        if values is None and not required:
+            columns[key] = np.full(n, np.nan)
+            continue
+        if type(values) is not list or len(values) != n:
+            raise _record_error((key,), f"{key} must be an array of {n} values (the length of systolic)")
+        allowed = _NUMBER if required else _NUMBER | {_NONE}
+        column = _to_array(values, allowed, integer)
+        if column is None:
+            kind = "integers" if integer else "numbers"
+            raise _record_error((key,), f"{key} must contain {kind}" + ("" if required else " or null"))
+        columns[key] = column
+
+    notes = payload.get("notes")
+    if notes is not None:
+        if type(notes) is not list or len(notes) != n:
+            raise _record_error(("notes",), f"notes must be an array of {n} values (the length of systolic)")
+        try:
+            notes = _notes(notes)
+        except TypeError as e:
+            raise _record_error(("notes",), str(e))
+
+    arrays = BPArrays(columns["systolic"], columns["diastolic"], columns["heart_rate"], columns["timestamp"])
+    return RecordColumns(arrays, notes, email)
+
+
+def _concat(parts: List[RecordColumns]) -> RecordColumns:
+    arrays = BPArrays(*(
+        np.concatenate([getattr(part.arrays, key) for part in parts]) if parts else np.empty(0)
+        for key in ("systolic", "diastolic", "heart_rate", "timestamp")
+    ))
+    notes = None
+    if any(part.notes is not None for part in parts):
+        notes = []
+        for part in parts:
+            notes.extend(part.notes if part.notes is not None else [None] * len(part))
+    return RecordColumns(arrays, notes, None)
+
+
+def _decode_lines(lines: List[bytes], first_line: int, validate: Callable) -> Optional[RecordColumns]:
+    """Columns of a run of complete NDJSON lines; readings needing coercion go through validate"""
+    readings = []
+    line_numbers = []
+    for line_no, line in enumerate(lines, first_line):
+        if not line.strip():
+            continue
+        try:
+            readings.append(loads(line))
+        except json.JSONDecodeError as e:
+            raise RecordError([{"type": "json_invalid", "loc": (line_no,), "msg": "JSON decode error",
+                                "input": {}, "ctx": {"error": e.msg}}])
+        line_numbers.append(line_no)
+    if not readings:
+        return None
+
+    columns = decode_analysis_payload({"records": readings})
+    if columns is None:
+        for i, reading in enumerate(readings):
+            if _needs_validation(reading):
+                try:
+                    readings[i] = validate(reading).model_dump()
+                except ValidationError as e:
+                    raise RecordError([{**error, "loc": (line_numbers[i],) + tuple(error["loc"])}
+                                       for error in e.errors()])
+        columns = decode_analysis_payload({"records": readings})
+    return columns
+
+
+def _needs_validation(reading) -> bool:
+    """True unless the reading is a dict of plain values (see decode_analysis_payload)"""
+    if type(reading) is not dict:
+        return True
+    return not (
+        type(reading.get("systolic")) is int and type(reading.get("diastolic")) is int
+        and type(reading.get("heart_rate")) in (int, _NONE)
+        and type(reading.get("timestamp")) in (int, float, _NONE)
+        and type(reading.get("notes")) in (str, _NONE)
+    )
+
+
+async def read_ndjson(chunks: AsyncIterator[bytes], max_bytes: int, validate: Callable) -> RecordColumns:
+    """
+    Decode an NDJSON body as it arrives
+    Each chunk's complete lines are decoded into arrays and dropped, so only
+    the columns stay in memory. Readings needing coercion go through validate
+    (BloodPressureRecord.model_validate); errors are reported with the 1-based
+    line number as loc. Blank lines are skipped.
+    """
+    parts = []
+    size = 0
+    next_line = 1
+    partial = b""
+
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > max_bytes:
+            raise BodyTooLarge(max_bytes)
+        lines = (partial + chunk).split(b"\n") if partial else chunk.split(b"\n")
+        partial = lines.pop()
+        for offset, line in enumerate(lines + [partial]):
+            if len(line) > MAX_LINE_BYTES:
+                raise _record_error((next_line + offset,), f"Line longer than {MAX_LINE_BYTES} bytes")
+        columns = _decode_lines(lines, next_line, validate)
+        if columns is not None:
+            parts.append(columns)
+        next_line += len(lines)
+
+    columns = _decode_lines([partial], next_line, validate)
+    if columns is not None:
+        parts.append(columns)
+    return parts[0] if len(parts) == 1 else _concat(parts)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Minimal Redis-protocol stand-in for local runs
+Speaks enough RESP2 for the redis:// state backend (PING, GET, SET with
+EX/PX/NX, DEL, INCR, PEXPIRE, PTTL, SCAN, KEYS, SELECT, AUTH, FLUSHDB) and
+keeps everything in memory, so several backend workers can share state
+without a real Redis. Start the workers with STATE_BACKEND=redis://127.0.0.1:6380/0.
+
+Usage:
+    python redis_standin.py --port 6380
+"""
+
+import argparse
+import asyncio
+import fnmatch
+import time
+from typing import Dict, Optional, Tuple
+
+from state_backend import read_reply
+
+
+def _bulk(value: Optional[bytes]) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def _array(encoded: list) -> bytes:
+    return b"*%d\r\n" % len(encoded) + b"".join(encoded)
+
+
+class RedisStandIn:
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000
+        self.data: Dict[bytes, Tuple[bytes, Optional[float]]] = {}  # key -> (value, expires_at)
+        self.commands = 0
+        self.connections = 0
+
+    def _get(self, key: bytes) -> Optional[bytes]:
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return entry[0]
+
+    def execute(self, args: list) -> bytes:
+        self.commands += 1
+        name = args[0].upper()
+        if name == b"PING":
+            return b"+PONG\r\n"
+        if name in (b"SELECT", b"AUTH"):
+            return b"+OK\r\n"
+        if name == b"GET":
+            return _bulk(self._get(args[1]))
+        if name == b"SET":
+            key, value = args[1], args[2]
+            expires_at = None
+            options = [a.upper() for a in args[3:]]
+            if b"NX" in options and self._get(key) is not None:
+                return b"$-1\r\n"
+            for option, unit in ((b"PX", 1000), (b"EX", 1)):
+                if option in options:
+                    expires_at = time.monotonic() + int(args[3 + options.index(option) + 1]) / unit
+            self.data[key] = (value, expires_at)
+            return b"+OK\r\n"
+        if name == b"DEL":
+            removed = 0
+            for key in args[1:]:
+                removed += self._get(key) is not None
+                self.data.pop(key, None)
+            return b":%d\r\n" % removed
+        if name == b"INCR":
+            current = self._get(args[1])
+            try:
+                count = int(current or b"0") + 1
+            except ValueError:
+                return b"-ERR value is not an integer or out of range\r\n"
+            self.data[args[1]] = (str(count).encode(), self.data.get(args[1], (None, None))[1])
+            return b":%d\r\n" % count
+        if name == b"PEXPIRE":
+            if self._get(args[1]) is None:
+                return b":0\r\n"
+            self.data[args[1]] = (self.data[args[1]][0], time.monotonic() + int(args[2]) / 1000)
+            return b":1\r\n"
+        if name == b"PTTL":
+            if self._get(args[1]) is None:
+                return b":-2\r\n"
+            expires_at = self.data[args[1]][1]
+            return b":%d\r\n" % (-1 if expires_at is None else int((expires_at - time.monotonic()) * 1000))
+        if name in (b"KEYS", b"SCAN"):
+            pattern = (args[1] if name == b"KEYS" else b"*").decode()
+            if name == b"SCAN" and b"MATCH" in [a.upper() for a in args]:
+                pattern = args[[a.upper() for a in args].index(b"MATCH") + 1].decode()
+            keys = [key for key in list(self.data) if self._get(key) is not None
+                    and fnmatch.fnmatchcase(key.decode(), pattern)]
+            # One SCAN pass returns everything with cursor 0
+            keys = _array([_bulk(key) for key in keys])
+            return keys if name == b"KEYS" else _array([_bulk(b"0"), keys])
+        if name == b"FLUSHDB":
+            self.data.clear()
+            return b"+OK\r\n"
+        return b"-ERR unknown command '%s'\r\n" % args[0]
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    args = await read_reply(reader)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    break
+                if not isinstance(args, list) or not args:
+                    writer.write(b"-ERR protocol error\r\n")
+                    break
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                writer.write(self.execute(args))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Redis-protocol stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6380)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay before each reply")
+    args = parser.parse_args()
+
+    standin = RedisStandIn(args.latency_ms)
+    print(f"Redis stand-in listening on {args.host}:{args.port}")
+    try:
+        asyncio.run(standin.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print(f"Served {standin.commands} command(s) on {standin.connections} connection(s)")
@@ -0,0 +1,398 @@
+"""
+Incremental per-user blood pressure aggregates
+Every stored reading updates the user's aggregates in O(1): all-time count,
+mean, Welford variance and EWMA, plus per-day buckets of sums that are
+combined into 7/30/90-day window statistics (mean, std, min/max, trend,
+time-of-day means). Reading a window costs at most 90 bucket merges no
+matter how long the history is. Aggregates live in memory and are
+snapshotted to a JSON file periodically.
+
+Aggregates carry the reading store version (highest reading seq) they
+include. Readings inserted by another worker are applied as a delta of the
+rows after that version; nothing is recounted or reloaded in full.
+
+Each uvicorn worker keeps its own aggregates, so each writes its own
+snapshot (aggregates.<pid>.json next to the configured path) and moves it
+onto the configured path when it stops. At startup all snapshots are merged,
+keeping the most recent version of each user.
+"""
+
+import asyncio
+import glob
+import json
+import math
+import os
+import time
+from typing import Dict, Iterable, Optional
+
+from bp_stats import BPStats, TIME_BUCKETS, local_hours, utc_offset
+
+SECONDS_PER_DAY = 86400.0
+WINDOWS = (7, 30, 90)
+MAX_WINDOW_DAYS = max(WINDOWS)
+EWMA_ALPHA = 0.2
+
+_TIME_BUCKET_NAMES = list(TIME_BUCKETS)
+
+
+class RunningStats:
+    """Welford mean/variance, EWMA and min/max of one series"""
+
+    __slots__ = ("count", "mean", "m2", "ewma", "min", "max")
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, ewma=None, min=None, max=None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.ewma = ewma
+        self.min = min
+        self.max = max
+
+    def update(self, x: float, in_order: bool = True):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.min = x if self.min is None else min(self.min, x)
+        self.max = x if self.max is None else max(self.max, x)
+        # EWMA only follows readings that arrive in time order
+        if in_order:
+            self.ewma = x if self.ewma is None else EWMA_ALPHA * x + (1 - EWMA_ALPHA) * self.ewma
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / self.count) if self.count else 0.0
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class DayBucket:
+    """Sums of one calendar day (UTC) that merge into window statistics"""
+
+    __slots__ = ("n", "sys_sum", "sys_sq", "dia_sum", "dia_sq", "sys_min", "sys_max",
+                 "dia_min", "dia_max", "pp_sum", "hr_n", "hr_sum",
+                 "t_sum", "t_sq", "t_sys", "t_dia", "tod_n", "tod_sys")
+
+    def __init__(self, **values):
+        self.n = 0
+        self.sys_sum = self.sys_sq = self.dia_sum = self.dia_sq = 0.0
+        self.sys_min = self.dia_min = math.inf
+        self.sys_max = self.dia_max = -math.inf
+        self.pp_sum = 0.0
+        self.hr_n = 0
+        self.hr_sum = 0.0
+        # t is in days since the user's origin day, for the trend regression
+        self.t_sum = self.t_sq = self.t_sys = self.t_dia = 0.0
+        self.tod_n = [0] * len(_TIME_BUCKET_NAMES)
+        self.tod_sys = [0.0] * len(_TIME_BUCKET_NAMES)
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    def add(self, t: float, hour: int, systolic: float, diastolic: float, heart_rate: Optional[float]):
+        self.n += 1
+        self.sys_sum += systolic
+        self.sys_sq += systolic * systolic
+        self.dia_sum += diastolic
+        self.dia_sq += diastolic * diastolic
+        self.sys_min = min(self.sys_min, systolic)
+        self.sys_max = max(self.sys_max, systolic)
+        self.dia_min = min(self.dia_min, diastolic)
+        self.dia_max = max(self.dia_max, diastolic)
+        self.pp_sum += systolic - diastolic
+        if heart_rate is not None:
+            self.hr_n += 1
+            self.hr_sum += heart_rate
+        self.t_sum += t
+        self.t_sq += t * t
+        self.t_sys += t * systolic
+        self.t_dia += t * diastolic
+        for i, name in enumerate(_TIME_BUCKET_NAMES):
+            start, end = TIME_BUCKETS[name]
+            if start <= hour < end:
+                self.tod_n[i] += 1
+                self.tod_sys[i] += systolic
+                break
+
+    def merge(self, other: "DayBucket"):
+        for name in ("n", "sys_sum", "sys_sq", "dia_sum", "dia_sq", "pp_sum", "hr_n", "hr_sum",
+                     "t_sum", "t_sq", "t_sys", "t_dia"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.sys_min = min(self.sys_min, other.sys_min)
+        self.sys_max = max(self.sys_max, other.sys_max)
+        self.dia_min = min(self.dia_min, other.dia_min)
+        self.dia_max = max(self.dia_max, other.dia_max)
+        self.tod_n = [a + b for a, b in zip(self.tod_n, other.tod_n)]
+        self.tod_sys = [a + b for a, b in zip(self.tod_sys, other.tod_sys)]
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class UserAggregates:
+    def __init__(self):
+        self.version = 0  # highest reading seq included
+        self.systolic = RunningStats()
+        self.diastolic = RunningStats()
+        self.origin_day: Optional[int] = None
+        self.last_timestamp: Optional[float] = None
+        self.days: Dict[int, DayBucket] = {}
+
+    @property
+    def count(self) -> int:
+        return self.systolic.count
+
+    def add(self, timestamp: float, systolic: float, diastolic: float,
+            heart_rate: Optional[float] = None, offset: float = 0.0):
+        """Add one reading; offset is the local UTC offset used for time-of-day buckets"""
+        in_order = self.last_timestamp is None or timestamp >= self.last_timestamp
+        self.systolic.update(systolic, in_order)
+        self.diastolic.update(diastolic, in_order)
+        if in_order:
+            self.last_timestamp = timestamp
+
+        day = int(timestamp // SECONDS_PER_DAY)
+        if self.origin_day is None:
+            self.origin_day = day
+        newest_day = int(self.last_timestamp // SECONDS_PER_DAY)
+        if day <= newest_day - MAX_WINDOW_DAYS:
+            return  # older than every window
+
+        bucket = self.days.get(day)
+        if bucket is None:
+            bucket = self.days[day] = DayBucket()
+            self._prune(newest_day)
+        t = timestamp / SECONDS_PER_DAY - self.origin_day
+        hour = int(local_hours(timestamp, offset))
+        bucket.add(t, hour, systolic, diastolic, heart_rate)
+
+    def window_stats(self, days: int, now: Optional[float] = None) -> Optional[BPStats]:
+        """Statistics of the last `days` calendar days (at most MAX_WINDOW_DAYS buckets)"""
+        first_day = _first_day(days, now)
+        total = DayBucket()
+        for day, bucket in self.days.items():
+            if day >= first_day:
+                total.merge(bucket)
+        if total.n == 0:
+            return None
+
+        n = total.n
+        mean_sys = total.sys_sum / n
+        mean_dia = total.dia_sum / n
+        stats = BPStats(
+            count=n,
+            mean_systolic=mean_sys,
+            mean_diastolic=mean_dia,
+            std_systolic=math.sqrt(max(0.0, total.sys_sq / n - mean_sys * mean_sys)),
+            std_diastolic=math.sqrt(max(0.0, total.dia_sq / n - mean_dia * mean_dia)),
+            min_systolic=total.sys_min,
+            max_systolic=total.sys_max,
+            min_diastolic=total.dia_min,
+            max_diastolic=total.dia_max,
+            mean_pulse_pressure=total.pp_sum / n,
+        )
+        if total.hr_n:
+            stats.mean_heart_rate = total.hr_sum / total.hr_n
+
+        t_var = total.t_sq - total.t_sum * total.t_sum / n
+        if n >= 2 and t_var > 1e-9:
+            stats.systolic_slope_per_day = (total.t_sys - total.t_sum * total.sys_sum / n) / t_var
+            stats.diastolic_slope_per_day = (total.t_dia - total.t_sum * total.dia_sum / n) / t_var
+
+        buckets = {
+            name: total.tod_sys[i] / total.tod_n[i]
+            for i, name in enumerate(_TIME_BUCKET_NAMES) if total.tod_n[i]
+        }
+        stats.bucket_mean_systolic = buckets
+        if "morning" in buckets and "evening" in buckets:
+            stats.morning_surge = buckets["morning"] - buckets["evening"]
+        return stats
+
+    def summary(self, now: Optional[float] = None) -> dict:
+        windows = {}
+        for days in WINDOWS:
+            stats = self.window_stats(days, now)
+            windows[f"{days}d"] = stats.to_dict() if stats else None
+        return {
+            "count": self.count,
+            "last_timestamp": self.last_timestamp,
+            "systolic": {**self.systolic.to_dict(), "std": self.systolic.std},
+            "diastolic": {**self.diastolic.to_dict(), "std": self.diastolic.std},
+            "windows": windows,
+        }
+
+    def _prune(self, newest_day: int):
+        for day in [d for d in self.days if d <= newest_day - MAX_WINDOW_DAYS]:
+            del self.days[day]
+
+    def to_dict(self) -> dict:
+        return {
+            "version": self.version,
+            "systolic": self.systolic.to_dict(),
+            "diastolic": self.diastolic.to_dict(),
+            "origin_day": self.origin_day,
+            "last_timestamp": self.last_timestamp,
+            "days": {str(day): bucket.to_dict() for day, bucket in self.days.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "UserAggregates":
+        agg = cls()
+        agg.version = data["version"]
+        agg.systolic = RunningStats(**data["systolic"])
+        agg.diastolic = RunningStats(**data["diastolic"])
+        agg.origin_day = data["origin_day"]
+        agg.last_timestamp = data["last_timestamp"]
+        agg.days = {int(day): DayBucket(**values) for day, values in data["days"].items()}
+        return agg
+
+
+def window_start(days: int, now: Optional[float] = None) -> float:
+    """Epoch seconds where a `days` window starts (windows are whole UTC days)"""
+    return _first_day(days, now) * SECONDS_PER_DAY
+
+
+def _first_day(days: int, now: Optional[float]) -> int:
+    today = int((now if now is not None else time.time()) // SECONDS_PER_DAY)
+    return today - min(days, MAX_WINDOW_DAYS) + 1
+
+
+class RollingAggregates:
+    """All users' aggregates plus periodic JSON snapshots"""
+
+    def __init__(self, snapshot_path: Optional[str] = None, snapshot_interval: float = 60.0):
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        # This process's snapshot; several workers must not replace one file
+        self.worker_path = _worker_path(snapshot_path, str(os.getpid())) if snapshot_path else None
+        self.users: Dict[str, UserAggregates] = {}
+        self._dirty = False
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, user_id: str) -> Optional[UserAggregates]:
+        return self.users.get(user_id)
+
+    def add_readings(self, user_id: str, readings: Iterable[dict]) -> Optional[UserAggregates]:
+        """
+        Apply newly stored readings (dicts with their "seq")
+        Only readings that directly follow the user's version are applied;
+        otherwise another worker wrote in between, nothing changes and None is
+        returned (the next read catches up through the store's delta).
+        """
+        readings = list(readings)
+        if not readings:
+            return self.users.get(user_id)
+        agg = self.users.get(user_id)
+        if min(r["seq"] for r in readings) != (agg.version if agg else 0) + 1:
+            return None
+        if agg is None:
+            agg = self.users[user_id] = UserAggregates()
+        offset = utc_offset()
+        # Oldest first so the EWMA follows time order within a batch
+        for r in sorted(readings, key=lambda r: r["timestamp"]):
+            agg.add(r["timestamp"], r["systolic"], r["diastolic"], r.get("heart_rate"), offset)
+        agg.version = max(r["seq"] for r in readings)
+        self._dirty = True
+        return agg
+
+    def rebuild(self, user_id: str, readings: Iterable[dict]) -> UserAggregates:
+        """Recompute a user's aggregates from the full history (get_readings_after(user_id, 0))"""
+        self.users.pop(user_id, None)
+        agg = self.add_readings(user_id, readings)
+        return agg if agg is not None else UserAggregates()
+
+    def drop(self, user_id: str):
+        if self.users.pop(user_id, None) is not None:
+            self._dirty = True
+
+    async def start(self):
+        """Merge the snapshots (newest version of each user) and start periodic snapshots"""
+        snapshots = self._snapshot_files()
+        for path in snapshots:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                users = {uid: UserAggregates.from_dict(d) for uid, d in data["users"].items()}
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                # Also snapshots written before versions existed: rebuilt on first read
+                print(f"Ignoring unreadable aggregates snapshot {path}: {e}")
+                continue
+            for uid, agg in users.items():
+                if uid not in self.users or agg.version > self.users[uid].version:
+                    self.users[uid] = agg
+        if snapshots:
+            # The other worker snapshots (e.g. left by a crash) are merged into
+            # ours; live workers write theirs again on the next snapshot
+            self._dirty = len(snapshots) > 1
+            for path in snapshots[1:]:
+                if path != self.snapshot_path:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+        if self.snapshot_path and self._task is None:
+            self._task = asyncio.create_task(self._snapshot_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.worker_path and self.users and not os.path.exists(self.worker_path):
+            self._dirty = True  # removed by a newer worker's startup
+        await self.snapshot()
+        # Hand this worker's snapshot over to the configured path
+        if self.worker_path and os.path.exists(self.worker_path):
+            os.replace(self.worker_path, self.snapshot_path)
+
+    async def snapshot(self):
+        if not self.snapshot_path or not self._dirty:
+            return
+        data = {"users": {uid: agg.to_dict() for uid, agg in self.users.items()}}
+        self._dirty = False
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._write_blocking, data)
+        except OSError:
+            self._dirty = True
+            raise
+
+    async def _snapshot_loop(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            try:
+                await self.snapshot()
+            except OSError as e:
+                print(f"Aggregates snapshot failed: {e}")
+
+    def _write_blocking(self, data: dict):
+        tmp_path = self.worker_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, self.worker_path)
+
+    def _snapshot_files(self) -> list:
+        """Existing snapshots (configured path and per-worker ones), newest first"""
+        if not self.snapshot_path:
+            return []
+        root, ext = os.path.splitext(self.snapshot_path)
+        paths = [self.snapshot_path] + [
+            path for path in glob.glob(glob.escape(root) + ".*" + glob.escape(ext))
+            if path[len(root) + 1:len(path) - len(ext)].isdigit()
+        ]
+        mtimes = {}
+        for path in paths:
+            try:
+                mtimes[path] = os.path.getmtime(path)
+            except OSError:
+                pass
+        return sorted(mtimes, key=mtimes.get, reverse=True)
+
+    def stats(self) -> dict:
+        return {"users": len(self.users), "snapshot_path": self.snapshot_path, "worker_snapshot": self.worker_path}
+
+
+def _worker_path(snapshot_path: str, worker: str) -> str:
+    """aggregates.json -> aggregates.<worker>.json"""
+    root, ext = os.path.splitext(snapshot_path)
+    return f"{root}.{worker}{ext}"
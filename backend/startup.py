@@ -0,0 +1,40 @@
+"""
+Startup tracking and readiness
+`/` only says the process is alive. The app is ready once the lifespan has
+opened every component and the upstream pool has been prewarmed (or the
+prewarm gave up), so a load balancer does not send the first chats to a
+process that still has to set up TLS to dashscope. Times are measured from
+the start of the main import, including the first successful /chat.
+"""
+
+import time
+from typing import Dict, Optional
+
+# Set when this module is first imported (main imports it before the heavy modules)
+IMPORT_STARTED = time.perf_counter()
+
+
+class StartupTracker:
+    def __init__(self, started: float = IMPORT_STARTED):
+        self.started = started
+        self.phases: Dict[str, float] = {}  # phase -> seconds since started
+        self.prewarm: Optional[dict] = None
+        self.ready = False
+
+    def mark(self, phase: str) -> float:
+        """Record the first time a phase is reached (later calls are ignored)"""
+        if phase not in self.phases:
+            self.phases[phase] = time.perf_counter() - self.started
+        return self.phases[phase]
+
+    def mark_ready(self, prewarm: Optional[dict] = None):
+        self.prewarm = prewarm
+        self.ready = True
+        self.mark("ready")
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "phases_seconds": {phase: round(seconds, 3) for phase, seconds in self.phases.items()},
+            "prewarm": self.prewarm,
+        }
@@ -0,0 +1,455 @@
+"""
+Cache and state backends
+The analysis cache, chat sessions and rate limit counters keep their state
+behind one small async key/value interface, so several uvicorn workers can
+share it instead of each holding (and missing on) a private copy:
+
+- memory://            in-process LRU, the single-worker default
+- sqlite:///path.db    one file shared by the workers of one host (WAL)
+- redis://host:6379/0  any Redis-protocol server (redis_standin.py locally)
+
+Values are JSON-serializable; every key can carry a TTL in seconds. Shared
+backends raise StateBackendError when the store is unreachable, callers
+treat that as a miss rather than failing the request.
+"""
+
+import abc
+import asyncio
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional
+from urllib.parse import unquote, urlparse
+
+
+class StateBackendError(Exception):
+    """The shared store could not be reached or answered with an error"""
+
+
+class StateBackend(abc.ABC):
+    """Async key/value store with per-key TTL"""
+
+    name = "abstract"
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def incr(self, key: str, ttl: float) -> int:
+        """Increment a counter; a new counter starts at 1 and expires after ttl"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def delete_prefix(self, prefix: str) -> int:
+        """Drop every key starting with prefix; returns the number removed"""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class MemoryBackend(StateBackend):
+    """In-process LRU + TTL; values are kept as the objects passed in"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: Optional[int] = None):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at or None, value)
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry[1]
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self._store(key, None if ttl is None else time.monotonic() + ttl, value)
+
+    async def delete(self, key: str) -> bool:
+        return self._data.pop(key, None) is not None
+
+    async def incr(self, key: str, ttl: float) -> int:
+        entry = self._data.get(key)
+        if entry is None or (entry[0] is not None and entry[0] < time.monotonic()):
+            entry = (time.monotonic() + ttl, 0)
+        count = entry[1] + 1
+        self._store(key, entry[0], count)
+        return count
+
+    async def delete_prefix(self, prefix: str) -> int:
+        keys = [key for key in self._data if key.startswith(prefix)]
+        for key in keys:
+            del self._data[key]
+        return len(keys)
+
+    def _store(self, key: str, expires_at: Optional[float], value: Any):
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while self.max_entries is not None and len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def count(self, prefix: str = "") -> int:
+        """Entries under prefix (expired ones not yet dropped included)"""
+        if not prefix:
+            return len(self._data)
+        return sum(1 for key in self._data if key.startswith(prefix))
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "evictions": self.evictions,
+        }
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    key        TEXT PRIMARY KEY,
+    value      TEXT NOT NULL,
+    expires_at REAL
+) WITHOUT ROWID
+"""
+
+# Expired rows are purged after this many writes
+SQLITE_PURGE_EVERY = 1000
+
+
+class SQLiteBackend(StateBackend):
+    """
+    One SQLite file shared by the workers of a host
+    WAL lets readers proceed while another process writes; every worker runs
+    its queries on one dedicated thread (as ReadingStore does).
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._writes = 0
+        self.errors = 0
+
+    async def open(self):
+        if self._conn is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-sqlite")
+        await self._run(self._open_blocking)
+
+    async def close(self):
+        if self._conn is None:
+            return
+        await self._run(self._conn.close)
+        self._conn = None
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    async def get(self, key: str) -> Optional[Any]:
+        raw = await self._run(self._get_blocking, key)
+        return None if raw is None else json.loads(raw)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        await self._run(self._set_blocking, key, _dumps(value), ttl)
+
+    async def delete(self, key: str) -> bool:
+        return await self._run(self._delete_blocking, "DELETE FROM state WHERE key = ?", (key,)) > 0
+
+    async def incr(self, key: str, ttl: float) -> int:
+        return await self._run(self._incr_blocking, key, ttl)
+
+    async def delete_prefix(self, prefix: str) -> int:
+        return await self._run(
+            self._delete_blocking, "DELETE FROM state WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+        )
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "path": self.path, "errors": self.errors}
+
+    async def _run(self, fn, *args):
+        if self._conn is None and fn != self._open_blocking:
+            raise StateBackendError("SQLite state backend is not open")
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, fn, *args)
+        except sqlite3.Error as e:
+            self.errors += 1
+            raise StateBackendError(f"SQLite state backend: {e}") from e
+
+    def _open_blocking(self):
+        # Autocommit; incr opens its own write transaction
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(SQLITE_SCHEMA)
+        self._conn = conn
+
+    def _get_blocking(self, key: str) -> Optional[str]:
+        row = self._conn.execute(
+            "SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at >= ?)",
+            (key, time.time())
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def _set_blocking(self, key: str, raw: str, ttl: Optional[float]):
+        expires_at = None if ttl is None else time.time() + ttl
+        self._conn.execute(
+            "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)", (key, raw, expires_at)
+        )
+        self._wrote()
+
+    def _delete_blocking(self, sql: str, params: tuple) -> int:
+        return self._conn.execute(sql, params).rowcount
+
+    def _incr_blocking(self, key: str, ttl: float) -> int:
+        now = time.time()
+        conn = self._conn
+        # BEGIN IMMEDIATE takes the write lock up front, so workers cannot lose increments
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at >= ?)", (key, now)
+            ).fetchone()
+            if row is None:
+                count = 1
+                conn.execute(
+                    "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, '1', ?)", (key, now + ttl)
+                )
+            else:
+                count = int(row[0]) + 1
+                conn.execute("UPDATE state SET value = ? WHERE key = ?", (str(count), key))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._wrote()
+        return count
+
+    def _wrote(self):
+        self._writes += 1
+        if self._writes % SQLITE_PURGE_EVERY == 0:
+            self._conn.execute("DELETE FROM state WHERE expires_at < ?", (time.time(),))
+
+
+class RedisError(StateBackendError):
+    """Error reply from the Redis server"""
+
+
+def encode_command(*args) -> bytes:
+    """RESP array of bulk strings"""
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode("utf-8")
+        out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(out)
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    """One RESP2 reply; error replies are returned as RedisError instances"""
+    line = await reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("Connection closed by the Redis server")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode("utf-8")
+    if kind == b"-":
+        return RedisError(rest.decode("utf-8", errors="replace"))
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        length = int(rest)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise RedisError(f"Unexpected reply: {line[:40]!r}")
+
+
+class _RedisConnection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    async def execute(self, *commands: tuple) -> list:
+        """Send commands pipelined in one write, return their replies in order"""
+        self.writer.write(b"".join(encode_command(*command) for command in commands))
+        await self.writer.drain()
+        return [await read_reply(self.reader) for _ in commands]
+
+    def close(self):
+        self.writer.close()
+
+
+class RedisBackend(StateBackend):
+    """
+    Minimal asyncio RESP2 client (GET/SET/DEL/INCR/SCAN) over a small
+    connection pool; keys are stored under `namespace` so one Redis can serve
+    several deployments.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str = "redis://127.0.0.1:6379/0", max_connections: int = 10,
+                 timeout: float = 2.0, namespace: str = "chatbox:"):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.strip("/") or 0)
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.namespace = namespace
+        self._idle: List[_RedisConnection] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.connections_opened = 0
+        self.errors = 0
+
+    async def open(self):
+        self._slots = asyncio.Semaphore(self.max_connections)
+        # Fail early on a wrong URL, but let the app start while Redis is down
+        try:
+            await self._execute(("PING",))
+        except StateBackendError as e:
+            print(f"Redis state backend not reachable yet: {e}")
+
+    async def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+    async def get(self, key: str) -> Optional[Any]:
+        (raw,) = await self._execute(("GET", self.namespace + key))
+        return None if raw is None else json.loads(raw)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        command = ("SET", self.namespace + key, _dumps(value))
+        if ttl is not None:
+            command += ("PX", max(1, int(ttl * 1000)))
+        await self._execute(command)
+
+    async def delete(self, key: str) -> bool:
+        (removed,) = await self._execute(("DEL", self.namespace + key))
+        return removed > 0
+
+    async def incr(self, key: str, ttl: float) -> int:
+        key = self.namespace + key
+        # SET NX creates the counter with its TTL, so it can never exist without one
+        _, count = await self._execute(("SET", key, 0, "PX", max(1, int(ttl * 1000)), "NX"), ("INCR", key))
+        return count
+
+    async def delete_prefix(self, prefix: str) -> int:
+        pattern = self.namespace + prefix.replace("\\", "\\\\").replace("*", "\\*").replace("?", "\\?") + "*"
+        removed = 0
+        cursor = b"0"
+        while True:
+            (reply,) = await self._execute(("SCAN", cursor, "MATCH", pattern, "COUNT", 500))
+            cursor, keys = reply
+            if keys:
+                (count,) = await self._execute(("DEL", *keys))
+                removed += count
+            if cursor == b"0":
+                return removed
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "address": f"{self.host}:{self.port}/{self.db}",
+            "idle_connections": len(self._idle),
+            "connections_opened": self.connections_opened,
+            "errors": self.errors,
+        }
+
+    async def _connect(self) -> _RedisConnection:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        connection = _RedisConnection(reader, writer)
+        self.connections_opened += 1
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.username, self.password) if self.username else ("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            for reply in await connection.execute(*setup):
+                if isinstance(reply, RedisError):
+                    connection.close()
+                    raise reply
+        return connection
+
+    async def _execute(self, *commands: tuple) -> list:
+        if self._slots is None:
+            raise StateBackendError("Redis state backend is not open")
+        async with self._slots:
+            connection = self._idle.pop() if self._idle else None
+            try:
+                if connection is None:
+                    connection = await asyncio.wait_for(self._connect(), self.timeout)
+                replies = await asyncio.wait_for(connection.execute(*commands), self.timeout)
+            except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                # The connection may hold a half-read reply: never reuse it
+                if connection is not None:
+                    connection.close()
+                self.errors += 1
+                raise StateBackendError(f"Redis state backend: {e!r}") from e
+            except BaseException:
+                if connection is not None:
+                    connection.close()
+                raise
+            self._idle.append(connection)
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                self.errors += 1
+                raise reply
+        return replies
+
+
+def create_backend(url: str, memory_max_entries: Optional[int] = None) -> StateBackend:
+    """Backend for a STATE_BACKEND URL (memory, sqlite:///path, redis://host:port/db)"""
+    parsed = urlparse(url if "://" in url else f"{url}://")
+    scheme = parsed.scheme.lower()
+    if scheme == "memory":
+        return MemoryBackend(memory_max_entries)
+    if scheme == "sqlite":
+        path = url.split("://", 1)[1]
+        # sqlite:///relative.db and sqlite:////absolute/path.db, as in SQLAlchemy
+        path = path[1:] if path.startswith("/") else path
+        if not path:
+            raise ValueError("STATE_BACKEND sqlite:// needs a file path, e.g. sqlite:///state.db")
+        return SQLiteBackend(path)
+    if scheme in ("redis", "tcp"):
+        return RedisBackend(url)
+    raise ValueError(f"Unknown STATE_BACKEND: {url}")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Minimal SMTP stand-in for benchmarks
+Accepts any login and message (no TLS), optionally slowed down per command,
+and counts delivered messages. Start the backend with SMTP_STARTTLS=false.
+
+Usage:
+    python stub_smtp_server.py --port 2525 --latency-ms 50
+"""
+
+import argparse
+import asyncio
+
+
+class StubSMTPServer:
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000
+        self.messages = 0
+        self.sessions = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.sessions += 1
+
+        async def reply(line: str):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            writer.write(line.encode() + b"\r\n")
+            await writer.drain()
+
+        try:
+            await reply("220 stub-smtp ESMTP ready")
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode("utf-8", errors="replace").strip().upper()
+
+                if command.startswith("EHLO"):
+                    await reply("250-stub-smtp\r\n250-AUTH PLAIN LOGIN\r\n250-8BITMIME\r\n250 OK")
+                elif command.startswith("HELO"):
+                    await reply("250 stub-smtp")
+                elif command.startswith("AUTH"):
+                    await reply("235 Authentication successful")
+                elif command.startswith(("MAIL", "RCPT", "RSET", "NOOP")):
+                    await reply("250 OK")
+                elif command == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    while (await reader.readline()) not in (b".\r\n", b".\n", b""):
+                        pass
+                    self.messages += 1
+                    await reply("250 OK queued")
+                elif command == "QUIT":
+                    await reply("221 Bye")
+                    break
+                else:
+                    await reply("502 Command not implemented")
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub SMTP server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay before each reply")
+    args = parser.parse_args()
+
+    stub = StubSMTPServer(args.latency_ms)
+    print(f"Stub SMTP server listening on {args.host}:{args.port}")
+    try:
+        asyncio.run(stub.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print(f"Received {stub.messages} message(s) in {stub.sessions} session(s)")
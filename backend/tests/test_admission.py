@@ -0,0 +1,151 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, parse_endpoint_limits
+
+
+def test_parse_endpoint_limits():
+    assert parse_endpoint_limits(" chat=20, analyze = 10,,bad") == {"chat": 20, "analyze": 10}
+    assert parse_endpoint_limits("") == {}
+
+
+def test_waiters_are_admitted_in_order():
+    controller = AdmissionController(max_concurrent=1, queue_timeout=5)
+    order = []
+
+    async def call(name):
+        async with controller.slot("chat"):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.gather(*(call(i) for i in range(4)))
+
+    asyncio.run(run())
+    assert order == [0, 1, 2, 3]
+    assert controller.queued_total == 3
+    assert controller.in_flight == 0
+
+
+def test_full_queue_is_shed_with_retry_after():
+    controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=5)
+
+    async def run():
+        held = await controller.acquire("chat")
+        waiting = asyncio.ensure_future(controller.acquire("chat"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as excinfo:
+            await controller.acquire("chat")
+        assert excinfo.value.status_code == 503 and excinfo.value.retry_after >= 1
+        held.release()
+        (await waiting).release()
+
+    asyncio.run(run())
+    assert controller.rejected["queue_full"] == 1
+    assert controller.in_flight == 0
+
+
+def test_queue_timeout():
+    controller = AdmissionController(max_concurrent=1, queue_timeout=0.01)
+
+    async def run():
+        held = await controller.acquire("chat")
+        with pytest.raises(AdmissionRejected):
+            await controller.acquire("chat")
+        held.release()
+
+    asyncio.run(run())
+    assert controller.rejected["queue_timeout"] == 1
+    assert controller.stats()["queued"] == 0
+
+
+def test_endpoint_limit_queues_instead_of_rejecting():
+    controller = AdmissionController(max_concurrent=10, queue_timeout=5, endpoint_limits={"batch": 1})
+    active = []
+
+    async def call():
+        async with controller.slot("batch"):
+            active.append(controller.stats()["endpoint_active"]["batch"])
+            await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.gather(*(call() for _ in range(3)))
+        # Other endpoints are not held back by the batch limit
+        async with controller.slot("chat"):
+            pass
+
+    asyncio.run(run())
+    assert active == [1, 1, 1]
+    assert controller.endpoint_queued_total == 2
+    assert controller.rejected["endpoint_limit"] == 0
+    assert controller.stats()["endpoint_active"] == {"batch": 0, "chat": 0}
+
+
+def test_endpoint_wait_times_out_with_429():
+    controller = AdmissionController(max_concurrent=10, queue_timeout=0.01, endpoint_limits={"batch": 1})
+
+    async def run():
+        held = await controller.acquire("batch")
+        with pytest.raises(AdmissionRejected) as excinfo:
+            await controller.acquire("batch")
+        assert excinfo.value.status_code == 429
+        held.release()
+
+    asyncio.run(run())
+    assert controller.stats()["endpoint_active"] == {"batch": 0}
+
+
+def test_cancelled_waiters_give_back_their_slots():
+    controller = AdmissionController(max_concurrent=1, queue_timeout=5, endpoint_limits={"batch": 1})
+
+    async def run():
+        held = await controller.acquire("batch")
+        waiting = asyncio.ensure_future(controller.acquire("batch"))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        held.release()
+        held.release()  # idempotent
+        async with controller.slot("batch"):
+            pass
+
+    asyncio.run(run())
+    assert controller.in_flight == 0
+    assert controller.stats()["endpoint_active"] == {"batch": 0}
+
+
+def test_disabled_controller_admits_everything():
+    controller = AdmissionController(max_concurrent=0)
+
+    async def run():
+        tickets = [await controller.acquire("chat") for _ in range(50)]
+        for ticket in tickets:
+            ticket.release()
+
+    asyncio.run(run())
+    assert controller.admitted == 50 and controller.queued_total == 0
+
+
+def test_try_acquire_only_takes_a_free_slot():
+    controller = AdmissionController(max_concurrent=2, queue_timeout=5, endpoint_limits={"chat": 2})
+
+    async def run():
+        held = await controller.acquire("chat")
+        extra = controller.try_acquire("chat")
+        assert extra is not None and controller.in_flight == 2
+        assert controller.try_acquire("chat") is None  # never queues
+        assert controller.try_acquire("analyze") is None
+        extra.release()
+        # A queued caller keeps its place ahead of an extra slot
+        other = await controller.acquire("analyze")
+        waiting = asyncio.ensure_future(controller.acquire("analyze"))
+        await asyncio.sleep(0)
+        held.release()
+        assert controller.try_acquire("chat") is None
+        (await waiting).release()
+        other.release()
+
+    asyncio.run(run())
+    assert controller.in_flight == 0
+    assert controller.stats()["endpoint_active"] == {"chat": 0, "analyze": 0}
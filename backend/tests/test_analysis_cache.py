@@ -0,0 +1,76 @@
+import asyncio
+
+from analysis_cache import TTLCache, make_cache_key
+from state_backend import StateBackendError
+
+
+class FailingBackend:
+    name = "failing"
+
+    async def get(self, key):
+        raise StateBackendError("down")
+
+    async def set(self, key, value, ttl=None):
+        raise StateBackendError("down")
+
+
+def test_cache_key_ignores_dict_order():
+    assert make_cache_key({"a": 1, "b": [1, 2]}) == make_cache_key({"b": [1, 2], "a": 1})
+    assert make_cache_key({"a": 1}) != make_cache_key({"a": 2})
+
+
+def test_hit_then_miss_after_ttl(clock):
+    cache = TTLCache(max_size=4, ttl=10, stale_ttl=100)
+
+    async def run():
+        assert await cache.get("k") is None
+        await cache.set("k", {"analysis": "x"})
+        assert await cache.get("k") == {"analysis": "x"}
+        clock.advance(11)
+        assert await cache.get("k") is None
+        # Expired but within stale_ttl: still there for degraded mode
+        assert await cache.get_stale("k") == {"analysis": "x"}
+
+    asyncio.run(run())
+    assert (cache.hits, cache.misses, cache.stale_hits) == (1, 2, 1)
+    assert cache.stats()["hit_rate"] == round(1 / 3, 4)
+
+
+def test_lru_eviction_and_invalidate():
+    cache = TTLCache(max_size=2, ttl=60)
+
+    async def run():
+        await cache.set("a", 1)
+        await cache.set("b", 2)
+        await cache.get("a")  # a is now the most recently used
+        await cache.set("c", 3)
+        assert await cache.get("b") is None
+        assert await cache.get("a") == 1
+        assert await cache.invalidate("a") == 1
+        assert await cache.invalidate() == 1
+
+    asyncio.run(run())
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["size"] == 0
+
+
+def test_disabled_cache_stores_nothing():
+    cache = TTLCache(max_size=0)
+
+    async def run():
+        await cache.set("k", 1)
+        return await cache.get("k")
+
+    assert asyncio.run(run()) is None
+    assert not cache.enabled
+
+
+def test_unreachable_backend_is_a_miss():
+    cache = TTLCache(max_size=4, backend=FailingBackend())
+
+    async def run():
+        await cache.set("k", 1)
+        return await cache.get("k")
+
+    assert asyncio.run(run()) is None
+    assert cache.errors == 2
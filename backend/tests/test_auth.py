@@ -0,0 +1,83 @@
+import asyncio
+
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from auth import AdminAuth, UserTokens, bearer_token
+
+
+def request(authorization: str = None) -> Request:
+    headers = [(b"authorization", authorization.encode())] if authorization is not None else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+def check(dependency, authorization: str = None):
+    """Run a dependency; returns the HTTP status it raised (None when allowed)"""
+    try:
+        asyncio.run(dependency(request(authorization)))
+    except HTTPException as e:
+        return e.status_code
+    return None
+
+
+def test_bearer_token():
+    assert bearer_token(request("Bearer abc")) == "abc"
+    assert bearer_token(request("bearer  abc ")) == "abc"
+    assert bearer_token(request("Basic abc")) is None
+    assert bearer_token(request("Bearer ")) is None
+    assert bearer_token(request()) is None
+
+
+def test_admin_endpoints_need_the_token():
+    auth = AdminAuth("s3cret")
+    assert check(auth, "Bearer s3cret") is None
+    assert check(auth, "Bearer wrong") == 401
+    assert check(auth, "s3cret") == 401
+    assert check(auth) == 401
+    assert auth.stats() == {"enabled": True, "allowed": 1, "rejected": 3}
+
+
+def test_admin_endpoints_are_disabled_without_a_token():
+    auth = AdminAuth("")
+    assert check(auth, "Bearer ") == 403
+    assert check(auth, "Bearer anything") == 403
+    assert not auth.enabled
+
+
+def user_check(tokens, user_id: str, authorization: str = None):
+    try:
+        return asyncio.run(tokens(request(authorization), user_id))
+    except HTTPException as e:
+        return e.status_code
+
+
+def test_user_tokens_round_trip(clock):
+    tokens = UserTokens(b"secret", ttl=60)
+    token, expires_at = tokens.issue("user.42/张")
+    assert expires_at == int(clock.now + 60)
+    assert tokens.verify(token) == "user.42/张"
+    assert UserTokens(b"secret").verify(token) == "user.42/张"  # another worker, same secret
+    assert UserTokens(b"other").verify(token) is None
+
+    clock.advance(60)
+    assert tokens.verify(token) is None  # expired
+
+
+def test_forged_user_tokens_are_rejected():
+    tokens = UserTokens(b"secret")
+    token, _ = tokens.issue("alice")
+    subject, expires_at, signature = token.split(".")
+    bob = tokens.issue("bob")[0].split(".")[0]
+    for forged in (f"{bob}.{expires_at}.{signature}", f"{subject}.{int(expires_at) + 1}.{signature}",
+                   f"{subject}.{expires_at}.", f"{subject}.{expires_at}", "alice", "", None):
+        assert tokens.verify(forged) is None
+
+
+def test_user_dependency_derives_the_user_from_the_token():
+    tokens = UserTokens(b"secret")
+    token, _ = tokens.issue("alice")
+    assert user_check(tokens, "alice", f"Bearer {token}") == "alice"
+    assert user_check(tokens, "bob", f"Bearer {token}") == 403
+    assert user_check(tokens, "alice") == 401
+    assert user_check(tokens, "alice", "Bearer alice") == 401
+    assert tokens.stats()["allowed"] == 1 and tokens.stats()["rejected"] == 3
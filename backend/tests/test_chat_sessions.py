@@ -0,0 +1,138 @@
+import asyncio
+import uuid
+
+from chat_sessions import SESSION_OVERHEAD_BYTES, ChatSession, SessionStore, Turn, estimate_tokens
+from state_backend import MemoryBackend
+
+
+def test_issued_ids_verify_with_the_same_secret_only():
+    store = SessionStore(secret=b"secret")
+    session_id = store.new_id()
+    token, _, signature = session_id.partition(".")
+    assert len(token) == 32 and len(signature) == 32
+    assert store.issued(session_id)
+    assert SessionStore(secret=b"secret").issued(session_id)  # another worker, same secret
+    assert not SessionStore(secret=b"other").issued(session_id)
+    assert store.new_id() != session_id
+
+
+def test_forged_and_unsigned_ids_are_rejected():
+    store = SessionStore(secret=b"secret")
+    token = store.new_id().partition(".")[0]
+    forged = [token, f"{token}.", f"{token}.{'0' * 32}", f"{uuid.uuid4().hex}.{store.new_id().partition('.')[2]}",
+              str(uuid.uuid4()), "", None]
+    for session_id in forged:
+        assert not store.accepts(session_id)
+    assert store.stats()["rejected_ids"] == len(forged)
+
+    async def run():
+        assert await store.load(str(uuid.uuid4()), create=True) is None
+        assert not await store.remove(token)
+    asyncio.run(run())
+    assert store.stats()["sessions"] == 0
+
+
+def test_legacy_uuids_during_the_deprecation_window():
+    store = SessionStore(secret=b"secret", legacy_ids=True)
+    legacy = str(uuid.uuid4())
+    assert store.accepts(legacy)
+    assert not store.accepts(legacy.upper())  # only the canonical form the app generated
+    assert not store.accepts("not-a-uuid")
+    session = asyncio.run(store.load(legacy, create=True))
+    assert session.id == legacy
+    assert store.stats()["legacy_requests"] == 2
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("血压偏高") == 4
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("血压 ok") == 3
+
+
+def test_window_slides_whole_exchanges_within_the_token_budget():
+    store = SessionStore(context_tokens=30)
+    session = store.get_or_create()
+    assert not store.record_turn(session, "a" * 40, "b" * 40)  # 20 tokens, fits
+    assert store.record_turn(session, "c" * 40, "d" * 40)      # 40 tokens: oldest exchange leaves
+    assert [t.content[0] for t in session.pending] == ["a", "b"]
+    assert [t.content[0] for t in session.turns] == ["c", "d"]
+    assert session.window_tokens <= store.context_tokens
+
+    # The latest exchange is kept even when it alone is over budget
+    store.record_turn(session, "e" * 400, "f")
+    assert [t.content[0] for t in session.turns] == ["e", "f"]
+    assert len(session.pending) == 4
+
+    messages = store.context_messages(session, "new")
+    assert [m["content"][0] for m in messages] == ["a", "b", "c", "d", "e", "f", "n"]
+    assert messages[-1] == {"role": "user", "content": "new"}
+
+
+def test_summary_folds_pending_turns():
+    store = SessionStore(context_tokens=10, summary_tokens=300)
+    session = store.get_or_create()
+    store.record_turn(session, "我的血压是多少", "平均 130/85")
+    store.record_turn(session, "需要吃药吗", "请咨询医生")
+    folded = list(session.pending)
+    summary = store.extractive_summary(session, folded)
+    assert summary == "用户：我的血压是多少；助手：平均 130/85"
+
+    store.apply_summary(session, summary, folded)
+    assert session.summary == summary and session.pending == []
+    messages = store.context_messages(session, "谢谢")
+    assert messages[0] == {"role": "system", "content": f"此前对话的摘要：{summary}"}
+
+    # Already folded elsewhere: a second apply is ignored
+    store.apply_summary(session, "stale", folded)
+    assert session.summary == summary
+
+
+def test_extractive_summary_stays_within_budget():
+    store = SessionStore(summary_tokens=20)
+    session = ChatSession("s")
+    session.summary = "旧的摘要内容"
+    turns = [Turn("user", "血压" * 10), Turn("assistant", "建议" * 10)]
+    summary = store.extractive_summary(session, turns)
+    assert summary.startswith("助手：")  # oldest parts are dropped first
+    assert len(summary) <= store.summary_tokens * 2
+
+
+def test_least_recently_used_sessions_are_evicted():
+    store = SessionStore(max_sessions=2)
+    first, second = store.get_or_create(), store.get_or_create()
+    store.get_or_create(first.id)  # touch
+    third = store.get_or_create()
+    assert store.get(second.id) is None
+    assert store.get(first.id) is first and store.get(third.id) is third
+    assert store.stats()["evicted"] == 1
+
+
+def test_memory_cap_evicts_but_keeps_the_active_session():
+    store = SessionStore(max_bytes=3 * SESSION_OVERHEAD_BYTES)
+    old = store.get_or_create()
+    active = store.get_or_create()
+    store.record_turn(active, "x" * SESSION_OVERHEAD_BYTES, "y" * SESSION_OVERHEAD_BYTES)
+    assert store.get(old.id) is None
+    assert store.get(active.id) is active
+    assert store.stats()["bytes"] == active.size_bytes
+
+    # A single session over the cap is never evicted while in use
+    store.record_turn(active, "z" * 4 * SESSION_OVERHEAD_BYTES, "")
+    assert store.get(active.id) is active
+
+
+def test_sessions_continue_on_another_worker_through_the_backend():
+    backend = MemoryBackend()
+    one = SessionStore(secret=b"secret", backend=backend)
+    two = SessionStore(secret=b"secret", backend=backend)
+
+    async def run():
+        session = await one.load(one.new_id(), create=True)
+        one.record_turn(session, "你好", "您好")
+        await one.save(session)
+        moved = await two.load(session.id)
+        assert [t.content for t in moved.turns] == ["你好", "您好"]
+        assert await two.remove(session.id)
+        assert await one.load(session.id) is None
+    asyncio.run(run())
@@ -0,0 +1,84 @@
+import pytest
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+
+
+def trip(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure(breaker.acquire())
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, open_seconds=30)
+    breaker.record_failure(breaker.acquire())
+    breaker.record_failure(breaker.acquire())
+    assert breaker.state == CLOSED
+    breaker.record_failure(breaker.acquire())
+    assert breaker.state == OPEN
+    assert breaker.opened == 1
+
+    clock.advance(10)
+    with pytest.raises(CircuitOpen) as excinfo:
+        breaker.acquire()
+    assert excinfo.value.retry_after == pytest.approx(20)
+    assert breaker.rejected == 1
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=3)
+    for _ in range(5):
+        breaker.record_failure(breaker.acquire())
+        breaker.record_failure(breaker.acquire())
+        breaker.record_success(0.1, breaker.acquire())
+    assert breaker.state == CLOSED
+
+
+def test_opens_when_a_full_window_is_slow(clock):
+    breaker = CircuitBreaker(failure_threshold=100, slow_call_seconds=1, slow_call_ratio=0.5, window=4)
+    for duration in (2, 2, 0.1):
+        breaker.record_success(duration, breaker.acquire())
+    assert breaker.state == CLOSED  # window not full yet
+    breaker.record_success(0.1, breaker.acquire())
+    assert breaker.state == OPEN
+
+
+def test_half_open_probe_closes_or_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=1, open_seconds=30, half_open_probes=1)
+    trip(breaker)
+    clock.advance(31)
+
+    probe = breaker.acquire()
+    assert probe and breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()  # only one probe at a time
+    breaker.record_failure(probe)
+    assert breaker.state == OPEN and breaker.opened == 2
+
+    clock.advance(31)
+    breaker.record_success(0.1, breaker.acquire())
+    assert breaker.state == CLOSED
+    assert breaker.acquire() is False
+
+
+def test_ignored_probe_frees_its_slot(clock):
+    breaker = CircuitBreaker(failure_threshold=1, open_seconds=1)
+    trip(breaker)
+    clock.advance(2)
+    breaker.record_ignored(breaker.acquire())
+    assert breaker.acquire() is True
+
+
+def test_calls_started_before_opening_do_not_count(clock):
+    breaker = CircuitBreaker(failure_threshold=1)
+    early = breaker.acquire()
+    trip(breaker)
+    breaker.record_success(0.1, early)
+    assert breaker.state == OPEN
+
+
+def test_disabled_breaker_never_opens():
+    breaker = CircuitBreaker(failure_threshold=0)
+    for _ in range(10):
+        breaker.record_failure(breaker.acquire())
+    assert breaker.state == CLOSED
+    assert breaker.stats()["enabled"] is False
@@ -0,0 +1,121 @@
+import asyncio
+import gzip
+import zlib
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from compression import (
+    DECOMPRESS_CHUNK_BYTES,
+    CompressionMiddleware,
+    InvalidContentEncoding,
+    decode_request_body,
+    negotiate,
+)
+
+BIG = {"analysis": "血压偏高" * 500}
+
+
+async def chunked(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def decode(data: bytes, encoding, size: int = 100) -> list:
+    async def run():
+        return [chunk async for chunk in decode_request_body(chunked(data, size), encoding)]
+    return asyncio.run(run())
+
+
+async def big(request):
+    return JSONResponse(BIG)
+
+
+async def small(request):
+    return JSONResponse({"ok": True})
+
+
+async def events(request):
+    return StreamingResponse(iter(["data: x\n\n" * 200]), media_type="text/event-stream")
+
+
+async def lines(request):
+    return StreamingResponse(iter(['{"index": %d}\n' % i for i in range(3)]), media_type="application/x-ndjson")
+
+
+async def precompressed(request):
+    return PlainTextResponse("x" * 2000, headers={"Content-Encoding": "identity"})
+
+
+app = CompressionMiddleware(
+    Starlette(routes=[Route(path, handler) for path, handler in (
+        ("/big", big), ("/small", small), ("/events", events), ("/lines", lines), ("/precompressed", precompressed),
+    )]),
+    minimum_size=512,
+)
+client = TestClient(app)
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip, deflate", "gzip"),
+    ("br;q=0.5, gzip;q=0.8", "gzip"),
+    ("br, gzip", "br"),
+    ("gzip;q=0", None),
+    ("*", "br"),
+    ("identity", None),
+    ("gzip;q=abc, br", "br"),
+])
+def test_negotiate(header, expected):
+    assert negotiate(header, ("br", "gzip")) == expected
+
+
+def test_negotiate_without_brotli():
+    assert negotiate("br", ("gzip",)) is None
+
+
+def test_large_json_is_gzipped():
+    response = client.get("/big", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) < len(response.content)
+    assert response.json() == BIG
+
+
+def test_small_and_event_stream_responses_are_not_compressed():
+    for path in ("/small", "/events", "/precompressed"):
+        response = client.get(path, headers={"Accept-Encoding": "gzip"})
+        assert response.headers.get("content-encoding") in (None, "identity"), path
+    assert "content-encoding" not in client.get("/big", headers={"Accept-Encoding": "identity"}).headers
+
+
+def test_streamed_ndjson_is_compressed_per_chunk():
+    response = client.get("/lines", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text.splitlines() == ['{"index": 0}', '{"index": 1}', '{"index": 2}']
+
+
+def test_gzip_request_body_round_trip():
+    data = b'{"systolic": 120, "diastolic": 80}\n' * 1000
+    assert b"".join(decode(gzip.compress(data), "gzip")) == data
+    assert b"".join(decode(data, None)) == data
+
+
+def test_gzip_bomb_is_decompressed_in_bounded_steps():
+    bomb = gzip.compress(b"\0" * (20 * DECOMPRESS_CHUNK_BYTES))
+    chunks = decode(bomb, "gzip", size=len(bomb))  # one small input chunk
+    assert max(map(len, chunks)) <= DECOMPRESS_CHUNK_BYTES
+    assert sum(map(len, chunks)) == 20 * DECOMPRESS_CHUNK_BYTES
+
+
+@pytest.mark.parametrize("body, encoding, status", [
+    (b"not gzip at all", "gzip", 400),
+    (gzip.compress(b"x" * 1000)[:-10], "gzip", 400),
+    (zlib.compress(b"x"), "br", 415),
+])
+def test_bad_request_bodies(body, encoding, status):
+    with pytest.raises(InvalidContentEncoding) as excinfo:
+        decode(body, encoding)
+    assert excinfo.value.status_code == status
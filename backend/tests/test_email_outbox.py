@@ -0,0 +1,128 @@
+import asyncio
+
+from email_outbox import EmailOutbox
+
+
+def compose(alerts, suppressed):
+    body = "|".join(section for _, section in alerts)
+    return "alert", body + (f" +{suppressed}" if suppressed else "")
+
+
+def run(scenario, **options):
+    """Run scenario(outbox, delivered) with SMTP replaced by a list of sent bodies"""
+    async def main():
+        outbox = EmailOutbox("smtp.example.com", 465, "user", "password", workers=1,
+                             compose_digest=compose, **options)
+        sent = []
+        outbox._send_blocking = lambda message: sent.append(message.body)
+
+        async def delivered():
+            await outbox._queue.join()
+            return list(sent)
+
+        await outbox.start()
+        try:
+            await scenario(outbox, delivered)
+        finally:
+            await outbox.stop()
+        return outbox, sent
+
+    return asyncio.run(main())
+
+
+def test_first_alert_is_sent_immediately(clock):
+    async def scenario(outbox, delivered):
+        message_id = outbox.enqueue_alert("a@example.com", "high", "h1")
+        assert await delivered() == ["h1"]
+        assert outbox.get(message_id)["status"] == "sent"
+
+    run(scenario)
+
+
+def test_follow_ups_in_the_window_share_one_digest():
+    async def scenario(outbox, delivered):
+        outbox.enqueue_alert("a@example.com", "high", "h1")
+        first = outbox.enqueue_alert("a@example.com", "high", "h2")
+        second = outbox.enqueue_alert("a@example.com", "high", "h3")
+        assert first == second
+        assert outbox.get(first)["status"] == "pending"
+        assert outbox.get(first)["alerts"] == 2
+        assert await delivered() == ["h1"]
+        await asyncio.sleep(0.15)  # the window closes
+        assert await delivered() == ["h1", "h2|h3"]
+
+    outbox, _ = run(scenario, digest_window=0.1)
+    assert outbox.coalesced == 2
+
+
+def test_repeats_are_suppressed_during_the_cooldown(clock):
+    async def scenario(outbox, delivered):
+        outbox.enqueue_alert("a@example.com", "high", "h1")
+        clock.advance(200)  # past the digest window
+        assert outbox.enqueue_alert("a@example.com", "high", "h2") is None
+        assert outbox.enqueue_alert("b@example.com", "high", "other") is not None
+        clock.advance(3600)
+        assert outbox.enqueue_alert("a@example.com", "high", "h3") is not None
+        assert await delivered() == ["h1", "other", "h3 +1"]
+
+    outbox, _ = run(scenario, digest_window=120, alert_cooldown=3600)
+    assert outbox.suppressed == 1
+
+
+def test_escalation_skips_the_window_with_pending_alerts(clock):
+    async def scenario(outbox, delivered):
+        outbox.enqueue_alert("a@example.com", "high", "h1")
+        clock.advance(10)
+        outbox.enqueue_alert("a@example.com", "high", "h2")
+        clock.advance(10)
+        outbox.enqueue_alert("a@example.com", "critical", "c1")
+        assert await delivered() == ["h1", "h2|c1"]
+        clock.advance(200)
+        # critical is now the level already reported
+        assert outbox.enqueue_alert("a@example.com", "critical", "c2") is None
+        assert outbox.enqueue_alert("a@example.com", "high", "h3") is None
+
+    outbox, _ = run(scenario)
+    assert outbox.escalations == 1
+
+
+def test_escalation_after_the_window_is_sent_at_once(clock):
+    async def scenario(outbox, delivered):
+        outbox.enqueue_alert("a@example.com", "high", "h1")
+        clock.advance(200)
+        assert outbox.enqueue_alert("a@example.com", "high", "h2") is None
+        outbox.enqueue_alert("a@example.com", "critical", "c1")
+        assert await delivered() == ["h1", "c1 +1"]
+
+    outbox, _ = run(scenario)
+    assert outbox.escalations == 1
+
+
+def test_zero_window_suppresses_follow_ups(clock):
+    async def scenario(outbox, delivered):
+        outbox.enqueue_alert("a@example.com", "high", "h1")
+        assert outbox.enqueue_alert("a@example.com", "high", "h2") is None
+        assert await delivered() == ["h1"]
+
+    run(scenario, digest_window=0)
+
+
+def test_stop_sends_open_digests(clock):
+    async def scenario(outbox, delivered):
+        outbox.enqueue_alert("a@example.com", "high", "h1")
+        outbox.enqueue_alert("a@example.com", "high", "h2")
+
+    _, sent = run(scenario)
+    assert sent == ["h1", "h2"]
+
+
+def test_disabled_without_credentials():
+    async def main():
+        outbox = EmailOutbox("smtp.example.com", 465, None, None)
+        await outbox.start()
+        try:
+            return outbox.enqueue_alert("a@example.com", "high", "h1")
+        finally:
+            await outbox.stop()
+
+    assert asyncio.run(main()) is None
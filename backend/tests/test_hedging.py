@@ -0,0 +1,183 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import hedging
+from hedging import HedgedCaller, LatencyTracker, is_retryable
+
+
+def response(status_code: int) -> httpx.Response:
+    return httpx.Response(status_code)
+
+
+class FakeSend:
+    """send() stand-in: each call takes the next (delay, outcome); the last one repeats"""
+
+    def __init__(self, *steps):
+        self.steps = list(steps)
+        self.calls = 0
+        self.cancelled = 0
+
+    async def __call__(self):
+        delay, outcome = self.steps[min(self.calls, len(self.steps) - 1)]
+        self.calls += 1
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+class Reserver:
+    """reserve_hedge() stand-in with `free` units of capacity"""
+
+    def __init__(self, free: int = 1):
+        self.free = free
+        self.released = 0
+
+    def __call__(self):
+        if self.free == 0:
+            return None
+        self.free -= 1
+
+        def release():
+            self.released += 1
+            self.free += 1
+        return release
+
+
+def hedger(**kwargs) -> HedgedCaller:
+    """Hedging on with enough 0.05s samples for a 0.05s hedge delay"""
+    options = dict(hedge=True, hedge_min_delay=0.05, hedge_max_ratio=1.0, min_samples=5,
+                   max_retries=0, deadline=5.0)
+    options.update(kwargs)
+    caller = HedgedCaller(**options)
+    for _ in range(5):
+        caller.latencies.add(0.05)
+    return caller
+
+
+def test_is_retryable():
+    assert is_retryable(response(503))
+    assert not is_retryable(response(429))
+    assert is_retryable(httpx.ConnectError("reset"))
+    assert not is_retryable(httpx.ReadTimeout("slow"))
+    assert not is_retryable(ValueError())
+
+
+def test_latency_percentile():
+    tracker = LatencyTracker(size=100)
+    assert tracker.percentile(95) is None
+    for i in range(1, 101):
+        tracker.add(i / 100)
+    assert tracker.percentile(95) == pytest.approx(0.95)
+    assert tracker.percentile(50) == pytest.approx(0.5)
+
+
+def test_hedge_delay():
+    caller = HedgedCaller(hedge=True, hedge_percentile=90, hedge_min_delay=0.5, hedge_max_ratio=0.5, min_samples=10)
+    assert caller.hedge_delay() is None  # too few samples
+    for i in range(1, 11):
+        caller.latencies.add(float(i))
+    assert caller.hedge_delay() is None  # no calls yet, so no hedge budget
+    caller.calls = 4
+    assert caller.hedge_delay() == 9.0
+    caller.hedges = 2
+    assert caller.hedge_delay() is None  # hedge_max_ratio used up
+
+    caller = HedgedCaller(hedge=True, hedge_min_delay=0.5, min_samples=1)
+    caller.latencies.add(0.1)
+    caller.calls = 100
+    assert caller.hedge_delay() == 0.5  # never below hedge_min_delay
+    assert HedgedCaller(hedge=False, min_samples=0).hedge_delay() is None
+
+
+def test_slow_call_is_hedged_and_the_hedge_wins():
+    caller = hedger()
+    send = FakeSend((1.0, response(200)), (0.0, response(200)))
+    reserve = Reserver()
+
+    started = time.monotonic()
+    result = asyncio.run(caller.call(send, reserve))
+    elapsed = time.monotonic() - started
+
+    assert result.status_code == 200
+    assert 0.05 <= elapsed < 0.5  # answered by the hedge sent after the 0.05s delay
+    assert send.calls == 2 and send.cancelled == 1
+    assert (caller.hedges, caller.hedge_wins) == (1, 1)
+    assert reserve.released == 1 and reserve.free == 1
+
+
+def test_fast_call_is_not_hedged():
+    caller = hedger()
+    send = FakeSend((0.0, response(200)))
+    asyncio.run(caller.call(send, Reserver()))
+    assert send.calls == 1 and caller.hedges == 0
+
+
+def test_hedge_is_skipped_without_capacity():
+    caller = hedger()
+    send = FakeSend((0.2, response(200)))
+    assert asyncio.run(caller.call(send, Reserver(free=0))).status_code == 200
+    assert send.calls == 1
+    assert (caller.hedges, caller.hedges_skipped) == (0, 1)
+
+    # Without a reserve_hedge callback the call is never hedged
+    asyncio.run(caller.call(send))
+    assert send.calls == 2 and caller.hedges_skipped == 1
+
+
+def test_failed_hedge_waits_for_the_first_request():
+    caller = hedger()
+    send = FakeSend((0.2, response(200)), (0.0, response(502)))
+    reserve = Reserver()
+    assert asyncio.run(caller.call(send, reserve)).status_code == 200
+    assert caller.hedge_wins == 0 and reserve.released == 1
+
+
+def test_retries_5xx_and_network_errors():
+    caller = HedgedCaller(max_retries=2, retry_backoff=0.01)
+    send = FakeSend((0.0, response(503)), (0.0, httpx.ConnectError("reset")), (0.0, response(200)))
+    assert asyncio.run(caller.call(send)).status_code == 200
+    assert send.calls == 3 and caller.retries == 2
+
+    # Client errors are final
+    send = FakeSend((0.0, response(400)))
+    assert asyncio.run(caller.call(send)).status_code == 400
+    assert send.calls == 1
+
+
+def test_retries_run_out():
+    caller = HedgedCaller(max_retries=2, retry_backoff=0.01)
+    send = FakeSend((0.0, response(503)))
+    assert asyncio.run(caller.call(send)).status_code == 503  # the last response is returned
+    assert send.calls == 3
+
+    send = FakeSend((0.0, httpx.ConnectError("reset")))
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(caller.call(send))
+
+
+def test_backoff_never_sleeps_past_the_deadline(monkeypatch):
+    monkeypatch.setattr(hedging.random, "uniform", lambda low, high: 60.0)
+    caller = HedgedCaller(max_retries=5, retry_backoff=30.0, deadline=0.2)
+    send = FakeSend((0.0, response(503)))
+
+    started = time.monotonic()
+    with pytest.raises(httpx.TimeoutException):
+        asyncio.run(caller.call(send))
+    assert time.monotonic() - started < 1.0
+    assert caller.deadline_exceeded == 1
+
+
+def test_slow_upstream_hits_the_deadline():
+    caller = HedgedCaller(deadline=0.1)
+    send = FakeSend((5.0, response(200)))
+    with pytest.raises(httpx.TimeoutException):
+        asyncio.run(caller.call(send))
+    assert send.cancelled == 1 and caller.deadline_exceeded == 1
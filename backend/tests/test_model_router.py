@@ -0,0 +1,85 @@
+import time
+
+import pytest
+
+from model_router import ModelRouter, prompt_chars
+
+MODELS = ["qwen-turbo", "qwen-plus", "qwen-max"]
+
+
+@pytest.fixture
+def router(clock, monkeypatch):
+    monkeypatch.setattr(time, "perf_counter", clock)
+    return ModelRouter(MODELS, budgets={"qwen-plus": 2, "qwen-max": 1}, long_prompt_chars=100,
+                       max_latency=10.0, latency_alpha=0.5, latency_ttl=60.0)
+
+
+def test_requires_a_model():
+    with pytest.raises(ValueError):
+        ModelRouter([])
+
+
+def test_preferred_model_by_severity_and_prompt_length(router):
+    assert router.choose(10) == "qwen-turbo"
+    assert router.choose(10, "elevated") == "qwen-turbo"
+    assert router.choose(10, "high") == "qwen-plus"
+    assert router.choose(500) == "qwen-plus"
+    assert router.choose(500, "critical") == "qwen-max"
+    assert ModelRouter(["only"]).choose(500, "critical") == "only"
+
+
+def test_exhausted_budget_falls_back_to_a_faster_model(router):
+    held = router.acquire(10, "critical")
+    assert held.model == "qwen-max"
+    assert router.acquire(10, "critical").model == "qwen-plus"
+    assert router.acquire(10, "critical").model == "qwen-plus"
+    # Every budgeted model is full: the unbudgeted fastest model takes the rest
+    assert router.acquire(10, "critical").model == "qwen-turbo"
+    assert router.stats()["qwen-max"]["in_flight"] == 1
+
+    held.release()
+    held.release()  # idempotent
+    assert router.stats()["qwen-max"]["in_flight"] == 0
+    assert router.acquire(10, "critical").model == "qwen-max"
+
+
+def test_try_acquire_never_exceeds_the_budget(router):
+    lease = router.try_acquire("qwen-max")
+    assert lease is not None
+    assert router.try_acquire("qwen-max") is None
+    lease.release(observe=False)
+    assert router.try_acquire("qwen-max") is not None
+    assert router.stats()["qwen-max"]["routed"] == 0  # hedges are not routing decisions
+
+
+def test_latency_is_an_ewma_of_observed_calls(router, clock):
+    for seconds in (4.0, 8.0):
+        lease = router.acquire(10, "critical")
+        clock.advance(seconds)
+        lease.release()
+    assert router.stats()["qwen-max"]["latency_seconds"] == pytest.approx(6.0)  # alpha 0.5
+
+    lease = router.acquire(10, "critical")
+    clock.advance(100.0)
+    lease.release(observe=False)  # failed calls are not sampled
+    assert router.stats()["qwen-max"]["latency_seconds"] == pytest.approx(6.0)
+
+
+def test_slow_model_is_skipped_until_its_sample_is_stale(router, clock):
+    lease = router.acquire(10, "critical")
+    clock.advance(30.0)
+    lease.release()
+    assert router.choose(10, "critical") == "qwen-plus"
+
+    lease = router.acquire(10, "high")
+    clock.advance(12.0)
+    lease.release()
+    assert router.choose(10, "critical") == "qwen-turbo"  # both stronger models are over max_latency
+
+    clock.advance(60.0)
+    assert router.choose(10, "critical") == "qwen-max"
+
+
+def test_prompt_chars():
+    assert prompt_chars({"messages": [{"content": "abc"}, {"content": None}, {"content": "血压"}]}) == 5
+    assert prompt_chars({}) == 0
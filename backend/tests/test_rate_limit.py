@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+from starlette.requests import Request
+
+from admission import AdmissionRejected
+from rate_limit import RateLimiter, client_id, parse_trusted_proxies
+from state_backend import MemoryBackend, StateBackendError
+
+
+class FailingBackend:
+    name = "failing"
+
+    async def incr(self, key, ttl):
+        raise StateBackendError("down")
+
+
+def request(peer: str, forwarded: str = None) -> Request:
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "headers": headers, "client": (peer, 50000)})
+
+
+def test_limit_per_client_and_window():
+    limiter = RateLimiter(MemoryBackend(), limit=2, window=60)
+
+    async def run():
+        await limiter.check("a", now=600)
+        await limiter.check("a", now=610)
+        await limiter.check("b", now=610)
+        with pytest.raises(AdmissionRejected) as excinfo:
+            await limiter.check("a", now=615)
+        assert excinfo.value.status_code == 429
+        assert excinfo.value.retry_after == 45  # until the next window starts
+        await limiter.check("a", now=660)
+
+    asyncio.run(run())
+    assert (limiter.allowed, limiter.rejected) == (4, 1)
+
+
+def test_disabled_limiter_counts_nothing():
+    limiter = RateLimiter(MemoryBackend(), limit=0)
+
+    async def run():
+        for _ in range(10):
+            await limiter.check("a")
+
+    asyncio.run(run())
+    assert limiter.allowed == 0 and not limiter.enabled
+
+
+def test_unreachable_backend_lets_requests_through():
+    limiter = RateLimiter(FailingBackend(), limit=1)
+
+    async def run():
+        for _ in range(3):
+            await limiter.check("a")
+
+    asyncio.run(run())
+    assert limiter.errors == 3 and limiter.rejected == 0
+
+
+def test_forwarded_header_is_ignored_without_trusted_proxies():
+    assert client_id(request("203.0.113.7", "198.51.100.1")) == "203.0.113.7"
+    trusted = parse_trusted_proxies("10.0.0.0/8")
+    assert client_id(request("203.0.113.7", "198.51.100.1"), trusted) == "203.0.113.7"
+
+
+def test_forwarded_client_behind_trusted_proxies():
+    trusted = parse_trusted_proxies("10.0.0.1, 172.16.0.0/12")
+    # Right-most hop not added by a trusted proxy; the left-most value is client-controlled
+    assert client_id(request("10.0.0.1", "1.1.1.1, 198.51.100.1, 172.16.5.5"), trusted) == "198.51.100.1"
+    assert client_id(request("10.0.0.1"), trusted) == "10.0.0.1"
+    assert client_id(request("10.0.0.1", "172.16.0.9"), trusted) == "172.16.0.9"
+
+
+def test_spoofed_forwarded_header_cannot_dodge_the_limit():
+    limiter = RateLimiter(MemoryBackend(), limit=1)
+
+    async def run():
+        await limiter(request("203.0.113.7", "198.51.100.1"))
+        with pytest.raises(AdmissionRejected):
+            await limiter(request("203.0.113.7", "198.51.100.2"))
+
+    asyncio.run(run())
+
+
+def test_parse_trusted_proxies():
+    assert parse_trusted_proxies("") == []
+    assert [str(n) for n in parse_trusted_proxies(" 10.0.0.1 ,::1,192.168.0.0/16")] == [
+        "10.0.0.1/32", "::1/128", "192.168.0.0/16"
+    ]
+    with pytest.raises(ValueError):
+        parse_trusted_proxies("not-an-ip")
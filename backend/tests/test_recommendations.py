@@ -0,0 +1,65 @@
+import pytest
+
+from recommendations import RecommendationExtractor, extract_recommendations, is_recommendation
+
+
+@pytest.mark.parametrize("line", [
+    "1. 每天监测血压",
+    "2、减少盐的摄入",
+    "3) 规律运动",
+    "（1）保证睡眠",
+    "(2) 戒烟限酒",
+    "一、饮食调整",
+    "（一）定期复查",
+    "**1. 控制体重**",
+    "### 2. 就医建议",
+    "• 保持心情舒畅",
+    "- 多吃蔬菜",
+    "* 适量运动",
+    "建议每周复查一次",
+])
+def test_recommendation_lines(line):
+    assert is_recommendation(line)
+
+
+@pytest.mark.parametrize("line", [
+    "10.5 mmHg 是平均值",
+    "1.5倍于正常范围",
+    "---",
+    "**总体评估**",
+    "您的血压整体偏高。",
+])
+def test_other_lines(line):
+    assert not is_recommendation(line)
+
+
+def test_line_split_across_chunks():
+    extractor = RecommendationExtractor()
+    assert extractor.feed("分析结果\n1. 每天") == []
+    assert extractor.feed("监测血压\n2、") == ["1. 每天监测血压"]
+    assert extractor.feed("减少盐") == []
+    assert extractor.close() == ["2、减少盐"]
+    assert extractor.recommendations == ["1. 每天监测血压", "2、减少盐"]
+
+
+def test_stops_at_the_limit():
+    text = "\n".join(f"{i}. 建议{i}" for i in range(1, 10))
+    assert extract_recommendations(text, limit=3) == ["1. 建议1", "2. 建议2", "3. 建议3"]
+
+    extractor = RecommendationExtractor(limit=1)
+    assert extractor.feed("- 第一条\n- 第二条\n") == ["- 第一条"]
+    assert extractor.done
+    assert extractor.feed("- 第三条\n") == []
+    assert extractor.close() == []
+
+
+def test_full_response():
+    text = (
+        "## 血压分析\n"
+        "平均收缩压 135.2 mmHg，较上周高 10.5 mmHg。\n"
+        "---\n"
+        "**建议：**\n"
+        "（一）饮食\n"
+        "1. 减少盐的摄入\n"
+    )
+    assert extract_recommendations(text) == ["**建议：**", "（一）饮食", "1. 减少盐的摄入"]
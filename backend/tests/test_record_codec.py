@@ -0,0 +1,131 @@
+import asyncio
+from typing import Optional
+
+import numpy as np
+import pytest
+from pydantic import BaseModel
+
+from record_codec import (
+    MAX_LINE_BYTES,
+    BodyTooLarge,
+    RecordError,
+    decode_analysis_payload,
+    decode_columnar_payload,
+    is_columnar,
+    is_ndjson,
+    read_body,
+    read_ndjson,
+)
+
+
+class Reading(BaseModel):
+    """Stand-in for main.BloodPressureRecord"""
+    systolic: int
+    diastolic: int
+    heart_rate: Optional[int] = None
+    timestamp: Optional[float] = None
+    notes: Optional[str] = None
+
+
+async def chunked(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+def ndjson(*chunks: bytes, max_bytes: int = 1 << 20):
+    return asyncio.run(read_ndjson(chunked(*chunks), max_bytes, Reading.model_validate))
+
+
+def test_records_payload_becomes_arrays():
+    columns = decode_analysis_payload({"records": [
+        {"systolic": 120, "diastolic": 80, "heart_rate": 70, "timestamp": 1.7e9, "notes": "am"},
+        {"systolic": 140, "diastolic": 90},
+    ], "email": "a@example.com"})
+    assert len(columns) == 2
+    assert columns.arrays.systolic.tolist() == [120, 140]
+    assert np.isnan(columns.arrays.heart_rate[1]) and np.isnan(columns.arrays.timestamp[1])
+    assert columns.notes == ["am", None]
+    assert columns.email == "a@example.com"
+
+
+@pytest.mark.parametrize("payload", [
+    [],
+    {"records": "x"},
+    {"records": [{"systolic": "120", "diastolic": 80}]},  # needs pydantic's coercion
+    {"records": [{"systolic": 120.5, "diastolic": 80}]},
+    {"records": [{"systolic": 120, "diastolic": 80, "notes": 1}]},
+    {"records": [], "email": 1},
+])
+def test_unusual_payloads_are_left_to_pydantic(payload):
+    assert decode_analysis_payload(payload) is None
+
+
+def test_columnar_payload():
+    payload = {"systolic": [120, 130], "diastolic": [80, 85], "timestamp": [1.0, None]}
+    assert is_columnar(payload) and not is_columnar({"records": []})
+    columns = decode_columnar_payload(payload)
+    assert columns.arrays.diastolic.tolist() == [80, 85]
+    assert np.isnan(columns.arrays.heart_rate).all()
+    assert columns.notes is None
+    rows = list(columns.rows(batch_size=1))
+    assert rows == [
+        [{"timestamp": 1.0, "systolic": 120, "diastolic": 80, "heart_rate": None, "notes": None}],
+        [{"timestamp": None, "systolic": 130, "diastolic": 85, "heart_rate": None, "notes": None}],
+    ]
+
+
+@pytest.mark.parametrize("payload, loc", [
+    ({"systolic": [120], "diastolic": [80], "timestamps": [1.0]}, ("timestamps",)),
+    ({"systolic": [120], "diastolic": [80, 81]}, ("diastolic",)),
+    ({"systolic": [120], "diastolic": [None]}, ("diastolic",)),
+    ({"systolic": [120], "diastolic": [80], "heart_rate": [70.5]}, ("heart_rate",)),
+    ({"systolic": [120], "diastolic": [80], "notes": [1]}, ("notes",)),
+    ({"systolic": [120], "diastolic": [80], "email": 5}, ("email",)),
+])
+def test_invalid_columns_are_rejected(payload, loc):
+    with pytest.raises(RecordError) as excinfo:
+        decode_columnar_payload(payload)
+    assert excinfo.value.errors[0]["loc"] == loc
+
+
+def test_ndjson_lines_split_across_chunks():
+    columns = ndjson(
+        b'{"systolic": 120, "diastolic": 80}\n{"systo',
+        b'lic": 130, "diastolic": 85, "notes": "pm"}\n\n',
+        b'{"systolic": "140", "diastolic": 90}',  # coerced by the model, no trailing newline
+    )
+    assert columns.arrays.systolic.tolist() == [120, 130, 140]
+    assert columns.notes == [None, "pm", None]
+
+
+def test_ndjson_errors_carry_the_line_number():
+    with pytest.raises(RecordError) as excinfo:
+        ndjson(b'{"systolic": 120, "diastolic": 80}\n{"systolic": 120}\n')
+    assert excinfo.value.errors[0]["loc"] == (2, "diastolic")
+
+    with pytest.raises(RecordError) as excinfo:
+        ndjson(b'{"systolic": 120, "diastolic": 80}\nnot json\n')
+    assert excinfo.value.errors[0]["loc"] == (2,)
+
+
+def test_ndjson_limits():
+    with pytest.raises(BodyTooLarge):
+        ndjson(b'{"systolic": 120, "diastolic": 80}\n' * 10, max_bytes=100)
+    with pytest.raises(RecordError):
+        ndjson(b"x" * (MAX_LINE_BYTES + 1))
+    # A complete oversized line inside a chunk is rejected too, not only a trailing partial
+    with pytest.raises(RecordError) as excinfo:
+        ndjson(b'{"systolic": 120, "diastolic": 80}\n' + b" " * MAX_LINE_BYTES + b'{}\n{"systolic": 1')
+    assert excinfo.value.errors[0]["loc"] == (2,)
+
+
+def test_read_body_cap():
+    assert asyncio.run(read_body(chunked(b"ab", b"cd"), 4)) == b"abcd"
+    with pytest.raises(BodyTooLarge):
+        asyncio.run(read_body(chunked(b"ab", b"cde"), 4))
+
+
+def test_ndjson_content_types():
+    assert is_ndjson("application/x-ndjson; charset=utf-8")
+    assert not is_ndjson("application/json")
+    assert not is_ndjson(None)
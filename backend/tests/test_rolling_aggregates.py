@@ -0,0 +1,236 @@
+import asyncio
+import json
+import os
+import random
+import sqlite3
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from bp_stats import BPArrays, compute_stats, utc_offset
+from reading_store import ReadingStore
+from rolling_aggregates import (
+    EWMA_ALPHA,
+    MAX_WINDOW_DAYS,
+    SECONDS_PER_DAY,
+    RollingAggregates,
+    RunningStats,
+    UserAggregates,
+    window_start,
+)
+
+NOW = 1_700_000_000.0
+
+
+def readings(count: int, days: float, seed: int = 1, first_seq: int = 1):
+    """`count` readings spread over the `days` before NOW, oldest first, numbered from first_seq"""
+    rng = random.Random(seed)
+    start = NOW - days * SECONDS_PER_DAY
+    return [
+        {
+            "timestamp": start + (i + rng.random()) * days * SECONDS_PER_DAY / count,
+            "systolic": rng.randint(100, 170),
+            "diastolic": rng.randint(60, 105),
+            "heart_rate": rng.choice([None, rng.randint(55, 95)]),
+            "seq": first_seq + i,
+        }
+        for i in range(count)
+    ]
+
+
+def test_running_stats_welford_and_ewma():
+    values = [120.0, 135.0, 128.0, 150.0, 110.0]
+    stats = RunningStats()
+    for x in values:
+        stats.update(x)
+    assert stats.count == 5
+    assert stats.mean == pytest.approx(np.mean(values))
+    assert stats.std == pytest.approx(np.std(values))
+    assert (stats.min, stats.max) == (110.0, 150.0)
+
+    ewma = values[0]
+    for x in values[1:]:
+        ewma = EWMA_ALPHA * x + (1 - EWMA_ALPHA) * ewma
+    assert stats.ewma == pytest.approx(ewma)
+
+    # A late (out of order) reading counts in the mean but not in the EWMA
+    stats.update(90.0, in_order=False)
+    assert stats.mean == pytest.approx(np.mean(values + [90.0]))
+    assert stats.ewma == pytest.approx(ewma)
+    assert stats.min == 90.0
+
+
+def test_old_day_buckets_expire():
+    agg = UserAggregates()
+    agg.add(NOW - 80 * SECONDS_PER_DAY, 150, 95)
+    agg.add(NOW - 30 * SECONDS_PER_DAY, 140, 90)
+    assert len(agg.days) == 2
+    later = NOW + 20 * SECONDS_PER_DAY
+    agg.add(later, 120, 80)
+    assert sorted(agg.days) == [int((NOW - 30 * SECONDS_PER_DAY) // SECONDS_PER_DAY), int(later // SECONDS_PER_DAY)]
+    assert agg.count == 3  # all-time statistics keep every reading
+    assert agg.window_stats(90, later).count == 2
+    assert agg.window_stats(7, later).count == 1
+
+    # A late reading older than every window is not bucketed at all
+    agg.add(NOW - 100 * SECONDS_PER_DAY, 160, 100)
+    assert len(agg.days) == 2 and agg.count == 4
+    assert agg.window_stats(90, later).count == 2
+
+
+@pytest.mark.parametrize("days", [7, 30, 90])
+def test_window_stats_match_compute_stats(days):
+    data = readings(400, 120)
+    agg = UserAggregates()
+    for r in data:
+        agg.add(r["timestamp"], r["systolic"], r["diastolic"], r["heart_rate"], utc_offset())
+
+    start = window_start(days, NOW)
+    in_window = [SimpleNamespace(**r) for r in data if r["timestamp"] >= start]
+    expected = compute_stats(BPArrays.from_records(in_window))
+    actual = agg.window_stats(days, NOW)
+
+    assert actual.count == expected.count == len(in_window)
+    for name in ("mean_systolic", "mean_diastolic", "std_systolic", "std_diastolic", "min_systolic",
+                 "max_systolic", "min_diastolic", "max_diastolic", "mean_pulse_pressure", "mean_heart_rate",
+                 "systolic_slope_per_day", "diastolic_slope_per_day", "morning_surge"):
+        assert getattr(actual, name) == pytest.approx(getattr(expected, name), rel=1e-6, abs=1e-9), name
+    assert actual.bucket_mean_systolic == pytest.approx(expected.bucket_mean_systolic)
+
+
+def test_empty_window():
+    agg = UserAggregates()
+    agg.add(NOW - 20 * SECONDS_PER_DAY, 120, 80)
+    assert agg.window_stats(7, NOW) is None
+    assert agg.summary(NOW)["windows"]["7d"] is None
+
+
+def test_readings_apply_only_in_version_order():
+    aggregates = RollingAggregates()
+    data = readings(10, 5)
+    assert aggregates.add_readings("u", data[:4]).version == 4
+    # seq 7.. skips readings another worker stored: nothing is applied
+    assert aggregates.add_readings("u", data[6:]) is None
+    assert aggregates.get("u").count == 4
+    agg = aggregates.add_readings("u", data[4:])
+    assert (agg.version, agg.count) == (10, 10)
+
+    rebuilt = aggregates.rebuild("u", data)
+    assert rebuilt.to_dict() == agg.to_dict()
+    assert aggregates.rebuild("nobody", []).version == 0
+
+
+def test_snapshot_round_trip():
+    agg = RollingAggregates().add_readings("u", readings(50, 40))
+    restored = UserAggregates.from_dict(json.loads(json.dumps(agg.to_dict())))
+    assert restored.version == agg.version
+    assert restored.summary(NOW) == agg.summary(NOW)
+
+
+def test_worker_snapshots_merge_by_version(tmp_path):
+    path = str(tmp_path / "aggregates.json")
+    older, newer = RollingAggregates(), RollingAggregates()
+    older.add_readings("a", readings(5, 3))
+    older.add_readings("b", readings(8, 3, seed=2))
+    newer.add_readings("a", readings(7, 3))
+    (tmp_path / "aggregates.json").write_text(
+        json.dumps({"users": {uid: agg.to_dict() for uid, agg in older.users.items()}}))
+    (tmp_path / "aggregates.123.json").write_text(
+        json.dumps({"users": {uid: agg.to_dict() for uid, agg in newer.users.items()}}))
+    (tmp_path / "aggregates.bak.json").write_text("not a worker snapshot")
+    # Left over by a crashed worker, older than the configured snapshot
+    os.utime(tmp_path / "aggregates.123.json", (NOW - 60, NOW - 60))
+
+    async def run():
+        merged = RollingAggregates(path, snapshot_interval=3600)
+        await merged.start()
+        versions = {uid: agg.version for uid, agg in merged.users.items()}
+        worker_files = sorted(p.name for p in tmp_path.glob("aggregates.*.json"))
+        await merged.stop()
+        return versions, worker_files
+
+    versions, worker_files = asyncio.run(run())
+    assert versions == {"a": 7, "b": 8}
+    assert worker_files == ["aggregates.bak.json"]  # the leftover worker snapshot was merged and removed
+    # The merged state was handed over to the configured path on stop()
+    data = json.loads((tmp_path / "aggregates.json").read_text())
+    assert {uid: d["version"] for uid, d in data["users"].items()} == {"a": 7, "b": 8}
+
+
+def test_snapshot_without_versions_is_ignored(tmp_path):
+    agg = UserAggregates()
+    agg.add(NOW, 120, 80)
+    data = agg.to_dict()
+    del data["version"]
+    (tmp_path / "aggregates.json").write_text(json.dumps({"users": {"u": data}}))
+
+    async def run():
+        aggregates = RollingAggregates(str(tmp_path / "aggregates.json"), snapshot_interval=3600)
+        await aggregates.start()
+        await aggregates.stop()
+        return aggregates.users
+
+    assert asyncio.run(run()) == {}
+
+
+def store_scenario(path: str, scenario):
+    async def run():
+        store = ReadingStore(path)
+        await store.open()
+        try:
+            return await scenario(store)
+        finally:
+            await store.close()
+    return asyncio.run(run())
+
+
+def test_reading_store_versions(tmp_path):
+    async def scenario(store):
+        first = await store.add_readings("u", [
+            {"timestamp": NOW, "systolic": 120, "diastolic": 80},
+            {"timestamp": NOW + 60, "systolic": 125, "diastolic": 82},
+        ])
+        assert [r["seq"] for r in first] == [1, 2]
+        # Duplicates are skipped and do not use up a seq
+        again = await store.add_readings("u", [
+            {"timestamp": NOW, "systolic": 120, "diastolic": 80},
+            {"timestamp": NOW - 60, "systolic": 130, "diastolic": 85},
+        ])
+        assert [(r["timestamp"], r["seq"]) for r in again] == [(NOW - 60, 3)]
+        await store.add_readings("other", [{"timestamp": NOW, "systolic": 110, "diastolic": 70}])
+
+        assert await store.version("u") == 3
+        assert await store.version("other") == 1
+        assert await store.version("nobody") == 0
+        assert [r["seq"] for r in await store.get_readings_after("u", 1)] == [2, 3]
+        assert [r["timestamp"] for r in await store.get_readings("u")] == [NOW + 60, NOW, NOW - 60]
+
+        aggregates = RollingAggregates()
+        assert aggregates.add_readings("u", await store.get_readings_after("u")).version == 3
+
+    store_scenario(str(tmp_path / "readings.db"), scenario)
+
+
+def test_reading_store_numbers_old_databases(tmp_path):
+    path = str(tmp_path / "readings.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE readings (user_id TEXT NOT NULL, timestamp REAL NOT NULL, systolic INTEGER NOT NULL, "
+        "diastolic INTEGER NOT NULL, heart_rate INTEGER, notes TEXT, "
+        "PRIMARY KEY (user_id, timestamp, systolic, diastolic)) WITHOUT ROWID"
+    )
+    conn.executemany("INSERT INTO readings VALUES (?, ?, ?, ?, NULL, NULL)", [
+        ("u", NOW + 60, 130, 85), ("u", NOW, 120, 80), ("v", NOW, 110, 70),
+    ])
+    conn.commit()
+    conn.close()
+
+    async def scenario(store):
+        numbered = [(r["timestamp"], r["seq"]) for r in await store.get_readings_after("u")]
+        added = await store.add_readings("u", [{"timestamp": NOW + 120, "systolic": 140, "diastolic": 90}])
+        return numbered, added[0]["seq"], await store.version("u"), await store.version("v")
+
+    numbered, next_seq, version_u, version_v = store_scenario(path, scenario)
+    assert numbered == [(NOW, 1), (NOW + 60, 2)]  # numbered in timestamp order
+    assert (next_seq, version_u, version_v) == (3, 3, 1)
@@ -0,0 +1,100 @@
+import asyncio
+import gc
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    started = []
+
+    async def fetch():
+        started.append(1)
+        await asyncio.sleep(0.01)
+        return {"analysis": "ok"}
+
+    async def run():
+        results = await asyncio.gather(*(flight.do("key", fetch) for _ in range(5)))
+        other = await flight.do("other", fetch)
+        return results, other
+
+    results, other = asyncio.run(run())
+    assert len(started) == 2
+    assert all(result is results[0] for result in results)
+    assert other == {"analysis": "ok"}
+    assert flight.stats() == {"in_flight": 0, "calls": 2, "shared": 4}
+
+
+def test_later_calls_start_a_new_flight():
+    flight = SingleFlight()
+    counter = []
+
+    async def fetch():
+        counter.append(1)
+        return len(counter)
+
+    async def run():
+        return await flight.do("key", fetch), await flight.do("key", fetch)
+
+    assert asyncio.run(run()) == (1, 2)
+
+
+def test_cancelling_one_waiter_keeps_the_shared_call():
+    flight = SingleFlight()
+    release = None
+
+    async def fetch():
+        await release.wait()
+        return "done"
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        first = asyncio.ensure_future(flight.do("key", fetch))
+        second = asyncio.ensure_future(flight.do("key", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await second == "done"
+        assert first.cancelled()
+
+    asyncio.run(run())
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_errors_reach_every_waiter():
+    flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def run():
+        return await asyncio.gather(*(flight.do("key", fetch) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert [type(result) for result in results] == [ValueError] * 3
+    assert flight.stats() == {"in_flight": 0, "calls": 1, "shared": 2}
+
+
+def test_error_is_retrieved_when_every_waiter_left():
+    flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        unhandled = []
+        loop.set_exception_handler(lambda loop, context: unhandled.append(context))
+        waiter = asyncio.ensure_future(flight.do("key", fetch))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0.02)
+        gc.collect()  # an unretrieved exception is reported when the task is collected
+        return unhandled
+
+    assert asyncio.run(run()) == []
+    assert flight.stats()["in_flight"] == 0
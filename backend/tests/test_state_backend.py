@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from redis_standin import RedisStandIn
+from state_backend import (
+    MemoryBackend,
+    RedisBackend,
+    SQLiteBackend,
+    StateBackend,
+    StateBackendError,
+    create_backend,
+)
+
+
+def run_on(kind: str, tmp_path, scenario):
+    """Run scenario(backend) against an opened backend of the given kind"""
+    async def run():
+        server = None
+        if kind == "memory":
+            backend = MemoryBackend()
+        elif kind == "sqlite":
+            backend = SQLiteBackend(str(tmp_path / "state.db"))
+        else:
+            server = await asyncio.start_server(RedisStandIn().handle, "127.0.0.1", 0)
+            backend = RedisBackend(f"redis://127.0.0.1:{server.sockets[0].getsockname()[1]}/0")
+        await backend.open()
+        try:
+            return await scenario(backend)
+        finally:
+            await backend.close()
+            if server is not None:
+                server.close()
+                await server.wait_closed()
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite", "redis"])
+def test_key_value_contract(kind, tmp_path):
+    async def scenario(backend):
+        assert await backend.get("missing") is None
+        await backend.set("a:1", {"reply": "你好", "n": [1, 2]})
+        assert await backend.get("a:1") == {"reply": "你好", "n": [1, 2]}
+        assert await backend.delete("a:1") is True
+        assert await backend.delete("a:1") is False
+
+        assert [await backend.incr("counter", 60) for _ in range(3)] == [1, 2, 3]
+
+        for key in ("p:1", "p:2", "q:1"):
+            await backend.set(key, 1)
+        assert await backend.delete_prefix("p:") == 2
+        assert await backend.get("q:1") == 1
+
+    run_on(kind, tmp_path, scenario)
+
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_ttl_expiry(kind, tmp_path, clock):
+    async def scenario(backend):
+        await backend.set("k", "v", ttl=10)
+        await backend.set("forever", "v")
+        assert await backend.incr("counter", 10) == 1
+        clock.advance(11)
+        assert await backend.get("k") is None
+        assert await backend.get("forever") == "v"
+        # An expired counter starts over
+        assert await backend.incr("counter", 10) == 1
+
+    run_on(kind, tmp_path, scenario)
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(max_entries=2)
+
+    async def scenario():
+        await backend.set("a", 1)
+        await backend.set("b", 2)
+        await backend.get("a")
+        await backend.set("c", 3)
+        return [await backend.get(key) for key in ("a", "b", "c")]
+
+    assert asyncio.run(scenario()) == [1, None, 3]
+    assert backend.evictions == 1
+
+
+def test_unreachable_redis_raises_state_backend_error():
+    async def scenario():
+        backend = RedisBackend("redis://127.0.0.1:1/0", timeout=0.5)
+        await backend.open()  # only logs
+        with pytest.raises(StateBackendError):
+            await backend.get("k")
+        return backend.errors
+
+    assert asyncio.run(scenario()) >= 1
+
+
+def test_state_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StateBackend()
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("memory", MemoryBackend),
+    ("sqlite:///state.db", SQLiteBackend),
+    ("redis://:secret@cache:6380/2", RedisBackend),
+])
+def test_create_backend(url, expected):
+    assert type(create_backend(url)) is expected
+
+
+def test_create_backend_parses_urls():
+    assert create_backend("sqlite:///state.db").path == "state.db"
+    assert create_backend("sqlite:////var/lib/state.db").path == "/var/lib/state.db"
+    redis = create_backend("redis://:secret@cache:6380/2")
+    assert (redis.host, redis.port, redis.db, redis.password) == ("cache", 6380, 2, "secret")
+    for url in ("sqlite://", "mongodb://x"):
+        with pytest.raises(ValueError):
+            create_backend(url)
@@ -0,0 +1,147 @@
+"""
+Rule-based fast path for routine blood pressure uploads
+Stable, normal readings get a deterministic templated analysis without an
+upstream call; anything elevated or changing is escalated to the LLM.
+fallback_analysis() covers the escalated cases while the LLM is unavailable.
+"""
+
+from bp_stats import PreparedRecords
+
+# A history counts as stable when all of these hold
+STABLE_MAX_SLOPE = 1.0          # |trend| in mmHg per day
+STABLE_MAX_STD = 15.0           # systolic standard deviation in mmHg
+STABLE_MAX_RECENT_SHIFT = 10.0  # recent vs overall mean systolic in mmHg
+
+TIER_RULE = "rule"
+TIER_LLM = "llm"
+TIER_FALLBACK = "fallback"  # LLM unavailable (circuit open), rule-based answer
+
+ROUTINE_RECOMMENDATIONS = [
+    "1. 继续保持低盐、清淡的饮食，多吃蔬菜水果",
+    "2. 坚持适量运动，如每天散步30分钟",
+    "3. 保证充足睡眠，保持心情舒畅",
+    "4. 按时测量血压，最好每天固定时间测量",
+    "5. 如出现头晕、胸闷等不适，请及时就医",
+]
+
+LEVEL_ASSESSMENTS = {
+    "normal": "处于正常范围",
+    "elevated": "略高于正常范围，需要注意",
+    "high": "明显偏高，属于高血压范围",
+    "critical": "严重偏高，存在较高风险",
+}
+
+FALLBACK_RECOMMENDATIONS = {
+    "normal": ROUTINE_RECOMMENDATIONS,
+    "elevated": [
+        "1. 减少盐的摄入，每天不超过5克",
+        "2. 坚持适量运动，控制体重",
+        "3. 保证充足睡眠，避免情绪激动",
+        "4. 每天固定时间测量血压并记录",
+        "5. 如持续偏高，请咨询医生",
+    ],
+    "high": [
+        "1. 请尽快咨询医生，评估是否需要调整治疗",
+        "2. 按医嘱规律服药，不要自行停药",
+        "3. 严格限盐，避免饮酒和剧烈运动",
+        "4. 每天早晚各测量一次血压并记录",
+        "5. 如出现头痛、头晕、胸闷，请立即就医",
+    ],
+    "critical": [
+        "1. 请立即休息，保持安静，并尽快就医",
+        "2. 如出现剧烈头痛、胸痛、呼吸困难或肢体无力，请立即拨打120",
+        "3. 不要自行大量加服降压药",
+        "4. 请家人陪同，密切观察身体状况",
+        "5. 就医时带上近期的血压记录",
+    ],
+}
+
+
+def is_routine(prepared: PreparedRecords, alert_level: str) -> bool:
+    """True when the readings are normal and stable enough to skip the LLM"""
+    stats = prepared.stats
+    if alert_level != "normal" or stats is None:
+        return False
+
+    for slope in (stats.systolic_slope_per_day, stats.diastolic_slope_per_day):
+        if slope is not None and abs(slope) > STABLE_MAX_SLOPE:
+            return False
+
+    if stats.std_systolic > STABLE_MAX_STD:
+        return False
+
+    recent_mean = float(prepared.recent_arrays.systolic.mean())
+    if abs(recent_mean - stats.mean_systolic) > STABLE_MAX_RECENT_SHIFT:
+        return False
+
+    return True
+
+
+def rule_based_analysis(prepared: PreparedRecords) -> dict:
+    """Templated analysis with the same shape as analyze_bp_data()"""
+    stats = prepared.stats
+    recent = prepared.recent_arrays
+    latest = prepared.latest
+
+    lines = [
+        "血压水平评估：",
+        f"最近{len(recent)}次测量的平均血压为 {recent.systolic.mean():.0f}/{recent.diastolic.mean():.0f} mmHg，"
+        f"最新一次为 {latest.systolic}/{latest.diastolic} mmHg，处于正常范围。",
+        "",
+        "趋势分析：",
+        f"共{stats.count}次记录，收缩压波动幅度约 ±{stats.std_systolic:.0f} mmHg，整体平稳，没有明显的升高趋势。",
+    ]
+    if stats.mean_heart_rate is not None:
+        lines.append(f"平均心率 {stats.mean_heart_rate:.0f} bpm。")
+    lines += [
+        "",
+        "健康提示：",
+        "目前血压控制良好，请继续保持现在的生活习惯。",
+        "",
+        "具体建议：",
+        *ROUTINE_RECOMMENDATIONS,
+        "",
+        "目前无需特别就医，定期体检即可。",
+    ]
+
+    return {
+        "analysis": "\n".join(lines),
+        "recommendations": list(ROUTINE_RECOMMENDATIONS),
+    }
+
+
+def fallback_analysis(prepared: PreparedRecords, alert_level: str) -> dict:
+    """Conservative templated analysis for any alert level, used when Qwen is unavailable"""
+    stats = prepared.stats
+    recent = prepared.recent_arrays
+    latest = prepared.latest
+    recommendations = FALLBACK_RECOMMENDATIONS.get(alert_level, FALLBACK_RECOMMENDATIONS["elevated"])
+
+    lines = [
+        "（AI分析服务暂时不可用，以下为根据测量数据自动生成的基础分析）",
+        "",
+        "血压水平评估：",
+        f"最近{len(recent)}次测量的平均血压为 {recent.systolic.mean():.0f}/{recent.diastolic.mean():.0f} mmHg，"
+        f"最新一次为 {latest.systolic}/{latest.diastolic} mmHg，{LEVEL_ASSESSMENTS.get(alert_level, '需要注意')}。",
+    ]
+    slope = stats.systolic_slope_per_day if stats is not None else None
+    if slope is not None:
+        lines += ["", "趋势分析："]
+        if slope > STABLE_MAX_SLOPE:
+            lines.append(f"收缩压呈上升趋势，平均每天升高约 {slope:.1f} mmHg。")
+        elif slope < -STABLE_MAX_SLOPE:
+            lines.append(f"收缩压呈下降趋势，平均每天降低约 {-slope:.1f} mmHg。")
+        else:
+            lines.append("收缩压整体比较平稳。")
+    lines += [
+        "",
+        "具体建议：",
+        *recommendations,
+        "",
+        "AI服务恢复后，可以重新获取详细分析。",
+    ]
+
+    return {
+        "analysis": "\n".join(lines),
+        "recommendations": list(recommendations),
+    }